@@ -0,0 +1,79 @@
+"""Бенчмарк вибірки вікна контексту з chat_history.
+
+Перевіряє, що затримка get_user_context не залежить від розміру історії
+користувача (10 → 100 000 записів) завдяки LIMIT в SQL та індексу
+idx_chat_history_user_recent.
+
+Потребує реальної PostgreSQL (DATABASE_URL з .env або оточення):
+
+    python -m benchmarks.bench_context_window
+"""
+
+import asyncio
+import statistics
+import time
+
+from bot.config import runtime_config
+from bot.db.database import close_pool, create_pool, get_db_connection, init_db
+from bot.db.user_settings import get_user_context
+
+# Службовий ID, що не перетинається з реальними користувачами Telegram
+BENCH_USER_ID = -424242
+HISTORY_SIZES = [10, 100, 1_000, 10_000, 100_000]
+ITERATIONS = 200
+
+
+async def _seed_history(size: int) -> None:
+    """Перезаписує історію службового користувача `size` записами."""
+    async with get_db_connection() as conn:
+        await conn.execute("DELETE FROM chat_history WHERE user_id = $1", BENCH_USER_ID)
+        records = [
+            (BENCH_USER_ID, "user" if i % 2 == 0 else "model", f"Повідомлення №{i}")
+            for i in range(size)
+        ]
+        await conn.copy_records_to_table(
+            "chat_history", records=records, columns=["user_id", "role", "content"]
+        )
+        await conn.execute("ANALYZE chat_history")
+
+
+async def _measure() -> list[float]:
+    """Повертає затримки (мс) послідовних викликів get_user_context."""
+    latencies = []
+    for _ in range(ITERATIONS):
+        start = time.perf_counter()
+        await get_user_context(BENCH_USER_ID)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+async def main() -> None:
+    """Запускає бенчмарк для кожного розміру історії та друкує таблицю."""
+    await create_pool()
+    try:
+        await init_db()
+        async with get_db_connection() as conn:
+            await conn.execute(
+                "INSERT INTO users (user_id, username) VALUES ($1, 'bench') "
+                "ON CONFLICT (user_id) DO NOTHING",
+                BENCH_USER_ID,
+            )
+
+        print(f"Вікно контексту: {runtime_config.CONTEXT_MESSAGE_LIMIT}, ітерацій: {ITERATIONS}")
+        print(f"{'рядків':>10} | {'p50, мс':>8} | {'p95, мс':>8} | {'max, мс':>8}")
+        for size in HISTORY_SIZES:
+            await _seed_history(size)
+            await get_user_context(BENCH_USER_ID)  # Прогрів кешу запиту
+            latencies = sorted(await _measure())
+            p50 = statistics.median(latencies)
+            p95 = latencies[int(len(latencies) * 0.95) - 1]
+            print(f"{size:>10} | {p50:>8.3f} | {p95:>8.3f} | {latencies[-1]:>8.3f}")
+    finally:
+        async with get_db_connection() as conn:
+            await conn.execute("DELETE FROM chat_history WHERE user_id = $1", BENCH_USER_ID)
+            await conn.execute("DELETE FROM users WHERE user_id = $1", BENCH_USER_ID)
+        await close_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,74 @@
+"""Бенчмарк перетворення та розбиття довгих відповідей моделі.
+
+Перевіряє, що час markdown_to_html + split_html росте лінійно з розміром
+відповіді (256 КБ → 8 МБ), і порівнює його з попереднім розбиттям через
+повторні зрізи `text[split_pos:]`.
+
+Не потребує БД чи мережі:
+
+    python -m benchmarks.bench_split_message
+"""
+
+import random
+import time
+
+from bot.presentation.formatting import MAX_MESSAGE_LENGTH, markdown_to_html, split_html
+from bot.presentation.message_utils import find_split_position
+
+SIZES = [256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 8 * 1024 * 1024]
+WORDS = [
+    "відповідь", "модель", "**жирний**", "*курсив*", "`код<x>`", "😀", "a&b",
+    "[посилання](https://example.com/?a=1&b=2)", "\n", "\n- пункт", "\n## Заголовок\n",
+]
+
+
+def _make_text(size: int) -> str:
+    """Генерує Markdown приблизно заданого розміру (в символах) з блоками коду."""
+    rng = random.Random(size)
+    pieces = []
+    length = 0
+    while length < size:
+        if rng.random() < 0.01:
+            piece = "\n```python\n" + "x = [i ** 2 for i in range(10)]\n" * 20 + "```\n"
+        else:
+            piece = rng.choice(WORDS) + " "
+        pieces.append(piece)
+        length += len(piece)
+    return "".join(pieces)
+
+
+def _legacy_split(text: str) -> int:
+    """Попередній алгоритм: кожна частина копіює весь залишок тексту."""
+    parts = 0
+    while text:
+        if len(text) <= MAX_MESSAGE_LENGTH:
+            return parts + 1
+        split_pos = find_split_position(text, MAX_MESSAGE_LENGTH)
+        parts += 1
+        text = text[split_pos:].lstrip()
+    return parts
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main() -> None:
+    """Запускає бенчмарк для кожного розміру та друкує таблицю."""
+    print(f"{'розмір':>8} | {'частин':>6} | {'html, мс':>9} | {'split, мс':>9} | {'мс/МБ':>7} | {'старий, мс':>10}")
+    for size in SIZES:
+        text = _make_text(size)
+        converted, convert_ms = _timed(markdown_to_html, text)
+        parts, split_ms = _timed(split_html, converted)
+        _, legacy_ms = _timed(_legacy_split, text)
+        per_mb = (convert_ms + split_ms) / (size / (1024 * 1024))
+        print(
+            f"{size // 1024:>6}КБ | {len(parts):>6} | {convert_ms:>9.1f} | {split_ms:>9.1f} | "
+            f"{per_mb:>7.1f} | {legacy_ms:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -8,10 +8,13 @@ from aiogram.enums import ParseMode
 from aiogram.exceptions import TelegramForbiddenError
 
 from bot.config.settings import settings
-from bot.db.cache import warm_up_caches
-from bot.db.database import init_db
-from bot.handlers import admin, general
+from bot.db.cache import start_cache_expiry, stop_cache_tasks, warm_up_caches
+from bot.db.database import close_pool, create_pool, init_db
+from bot.db.user_settings import start_chat_history_writer, stop_chat_history_writer
+from bot.handlers import admin, buttons, general
 from bot.handlers import settings as settings_handler
+from bot.middlewares.outbound_rate_limit import outbound_rate_limiter
+from bot.middlewares.user_context import UserContextMiddleware
 from bot.services.gemini import refresh_available_models
 from bot.core.logging_setup import get_logger, setup_logging
 
@@ -19,24 +22,47 @@ logger = get_logger(__name__)
 
 
 async def main() -> None:
-    """Ініціалізує та запускає бота."""
-    await init_db()
-    await refresh_available_models()  # Спочатку оновлюємо список моделей з API
-    await warm_up_caches()  # Потім прогріваємо кеш
+    """Ініціалізує та запускає бота.
 
-    logger.info("Запуск бота...")
+    Послідовно виконується лише те, без чого не можна приймати оновлення:
+    пул з'єднань і схема БД. Оновлення списку моделей і прогрів кешу
+    виконуються паралельно у фоні, поки бот уже обробляє повідомлення.
+    """
+    await create_pool()
+    background_startup = None
+    try:
+        await init_db()
+        start_chat_history_writer()
+        start_cache_expiry()
+        background_startup = asyncio.create_task(_run_background_startup(), name="background-startup")
 
-    bot = Bot(
-        token=settings.TG_TOKEN,
-        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+        await _run_bot()
+    finally:
+        if background_startup is not None and not background_startup.done():
+            background_startup.cancel()
+            await asyncio.gather(background_startup, return_exceptions=True)
+        await stop_cache_tasks()
+        await stop_chat_history_writer()  # Записуємо в БД усе, що залишилось у черзі
+        await close_pool()
+
+
+async def _run_background_startup() -> None:
+    """Паралельно оновлює список моделей з API та прогріває кеш."""
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    results = await asyncio.gather(
+        refresh_available_models(),
+        warm_up_caches(),
+        return_exceptions=True,
     )
-    dp = Dispatcher()
+    for phase, result in zip(("оновлення моделей", "прогрів кешу"), results, strict=True):
+        if isinstance(result, Exception):
+            logger.error("Фоновий етап запуску '%s' завершився помилкою: %s", phase, result)
+    logger.info("Фонові етапи запуску завершено за %.2f сек.", loop.time() - started)
 
-    dp.include_router(admin.router)
-    dp.include_router(settings_handler.router)
-    dp.include_router(general.router)  # Цей роутер має бути останнім
 
-    # Повідомлення власнику про запуск
+async def _notify_owner(bot: Bot) -> None:
+    """Надсилає власнику повідомлення про запуск бота."""
     try:
         await bot.send_message(settings.OWNER_ID, "Бот успішно запущений!")
         logger.info(
@@ -51,7 +77,37 @@ async def main() -> None:
     except Exception:
         logger.exception("Помилка при відправці повідомлення власнику")
 
-    await dp.start_polling(bot)
+
+async def _run_bot() -> None:
+    """Створює бота, реєструє роутери та запускає polling."""
+    logger.info("Запуск бота...")
+
+    bot = Bot(
+        token=settings.TG_TOKEN,
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+    )
+    # Усі вихідні запити проходять через спільні ліміти швидкості Telegram
+    bot.session.middleware(outbound_rate_limiter)
+    dp = Dispatcher()
+
+    # Користувач і його роль визначаються один раз до фільтрів усіх роутерів
+    user_context_middleware = UserContextMiddleware()
+    dp.message.outer_middleware(user_context_middleware)
+    dp.callback_query.outer_middleware(user_context_middleware)
+
+    # Кнопки меню знаходяться за точним текстом до решти фільтрів
+    dp.include_router(buttons.router)
+    dp.include_router(admin.router)
+    dp.include_router(settings_handler.router)
+    dp.include_router(general.router)  # Цей роутер має бути останнім
+
+    # Повідомлення власнику не затримує початок polling
+    notify_task = asyncio.create_task(_notify_owner(bot), name="notify-owner")
+    try:
+        await dp.start_polling(bot)
+    finally:
+        if not notify_task.done():
+            notify_task.cancel()
 
 
 if __name__ == "__main__":
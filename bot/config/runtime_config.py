@@ -4,11 +4,12 @@
 
 # Максимальна кількість повідомлень для зберігання в контексті чату.
 # Якщо контекст перевищує цей ліміт, найстаріші повідомлення будуть видалені.
+# Скільки з них потрапить у запит, визначає бюджет TOKEN_LIMIT_IN.
 CONTEXT_MESSAGE_LIMIT = 10
 
 # Ліміт токенів для вхідного повідомлення до Gemini API.
-# Якщо вхідне повідомлення (включно з контекстом) перевищує цей ліміт,
-# воно буде обрізано або оброблено відповідно до логіки обрізання.
+# Контекст заповнюється від найновіших повідомлень, доки разом із запитом
+# користувача він вміщується в цей ліміт; старіші повідомлення відкидаються.
 TOKEN_LIMIT_IN = 30000 # Приклад значення, потрібно уточнити для конкретної моделі
 
 # Ліміт токенів для вихідної відповіді від Gemini API.
@@ -16,9 +17,33 @@ TOKEN_LIMIT_IN = 30000 # Приклад значення, потрібно ут
 # але не перевищить цей ліміт.
 TOKEN_LIMIT_OUT = 2000 # Приклад значення, потрібно уточнити для конкретної моделі
 
+# Бюджет токенів на роздуми (thinking) для моделей, що їх підтримують.
+# Роздуми рахуються в max_output_tokens, тому для таких моделей ліміт
+# дорівнює TOKEN_LIMIT_OUT + цей бюджет: інакше роздуми можуть вичерпати
+# весь ліміт, і відповідь прийде без тексту.
+TOKEN_THINKING_BUDGET = 1024
+
+# Префікси назв моделей (без "models/"), що роздумують за замовчуванням.
+THINKING_MODEL_PREFIXES = ("gemini-2.5", "gemini-3")
+
+# Винятки серед них: моделі, що за замовчуванням не роздумують. Їм бюджет
+# не задається, щоб не вмикати роздуми й не додавати затримки та вартості.
+NON_THINKING_MODEL_PREFIXES = ("gemini-2.5-flash-lite",)
+
+# Скільки байтів UTF-8 в середньому припадає на один токен (для локальної оцінки).
+TOKEN_ESTIMATE_BYTES_PER_TOKEN = 4
+
+# Уточнювати кількість токенів повідомлень контексту через count_tokens у фоні.
+# Точні значення кешуються за хешем вмісту; без цього використовується оцінка.
+TOKEN_EXACT_COUNT = False
+
+# Скільки точних підрахунків токенів зберігати в кеші.
+TOKEN_COUNT_CACHE_MAX_ENTRIES = 20_000
+
 # --- Інші налаштування (можна додавати сюди) ---
 
-# Наприклад, таймаути для API запитів (в секундах)
+# Наприклад, таймаути для API запитів (в секундах).
+# Це також верхня межа адаптивного таймауту (див. ADAPTIVE_TIMEOUTS).
 GEMINI_API_TIMEOUT = 120
 
 # Кількість повторних спроб для мережевих запитів
@@ -26,3 +51,204 @@ API_RETRY_ATTEMPTS = 3
 
 # Базова затримка для експоненційної затримки (в секундах)
 API_RETRY_BASE_DELAY = 5
+
+# --- Пул з'єднань PostgreSQL ---
+
+# Мінімальна та максимальна кількість з'єднань у пулі.
+DB_POOL_MIN_SIZE = 2
+DB_POOL_MAX_SIZE = 10
+
+# Максимальний час очікування вільного з'єднання з пулу (в секундах).
+DB_POOL_ACQUIRE_TIMEOUT = 10
+
+# Таймаут встановлення нового з'єднання та виконання запиту (в секундах).
+DB_CONNECT_TIMEOUT = 10
+DB_COMMAND_TIMEOUT = 30
+
+# Кількість підготовлених запитів, що кешуються на кожне з'єднання.
+DB_STATEMENT_CACHE_SIZE = 100
+
+# З'єднання, що простоює довше за цей час, закривається (в секундах).
+DB_POOL_MAX_INACTIVE_LIFETIME = 300
+
+# Схема за замовчуванням для всіх з'єднань пулу.
+DB_SEARCH_PATH = "public"
+
+# --- Відкладений запис історії чату ---
+
+# Кількість повідомлень у черзі, після якої вона одразу записується в БД.
+CHAT_HISTORY_FLUSH_BATCH_SIZE = 50
+
+# Максимальний час перебування повідомлення в черзі до запису (в секундах).
+CHAT_HISTORY_FLUSH_INTERVAL = 1.0
+
+# Скільки разів поспіль повторювати запис пакета, перш ніж записати його
+# по одному повідомленню й відкинути ті, що не записуються.
+CHAT_HISTORY_FLUSH_MAX_RETRIES = 3
+
+# --- Кеш вікна контексту ---
+
+# Бюджет пам'яті для кешу останніх повідомлень користувачів (в байтах).
+# При перевищенні витісняються найдавніше активні користувачі (LRU).
+CONTEXT_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# --- Обмеження кешів у пам'яті ---
+
+# Максимальна кількість записів та бюджет пам'яті кешу налаштувань користувачів.
+USER_CACHE_MAX_ENTRIES = 50_000
+USER_CACHE_MAX_BYTES = 16 * 1024 * 1024
+
+# Інтервал фонового видалення прострочених записів з усіх кешів (в секундах).
+CACHE_PURGE_INTERVAL = 60
+
+# Скільки секунд після завершення TTL кеші налаштувань і моделей ще віддають
+# застаріле значення, оновлюючи його у фоні (stale-while-revalidate). 0 — вимкнено.
+CACHE_STALE_TTL = 30
+
+# --- Прогрів кешу при старті ---
+
+# Скільки найактивніших користувачів завантажувати в кеш (None — усіх).
+WARM_UP_USERS_LIMIT = 10_000
+
+# Розмір пакета, що читається серверним курсором за один раз.
+WARM_UP_FETCH_SIZE = 1_000
+
+# --- Потокові відповіді ---
+
+# Надсилати відповідь частинами, поступово редагуючи повідомлення.
+STREAM_RESPONSES = True
+
+# Мінімальний інтервал між редагуваннями одного повідомлення (в секундах),
+# щоб не перевищувати ліміти Telegram.
+STREAM_EDIT_INTERVAL = 1.5
+
+# Загальний термін потокової відповіді (в секундах). Таймаут запиту діє на
+# кожен фрагмент, тому без цієї межі потік, що повільно надсилає фрагменти,
+# тривав би необмежено. Після терміну зберігається вже отриманий текст.
+STREAM_TOTAL_TIMEOUT = 300
+
+# --- Статус-повідомлення ---
+
+# Через скільки секунд генерації показувати статус "Очікуйте...".
+# Швидкі відповіді надсилаються одразу, без статус-повідомлення.
+STATUS_MESSAGE_DELAY = 2.0
+
+# Як часто (в секундах) оновлювати індикатор "друкує..." під час генерації
+# (Telegram показує його близько 5 секунд).
+TYPING_REFRESH_INTERVAL = 4.0
+
+# --- Реєстрація користувачів ---
+
+# Як часто (в секундах) оновлювати username та ім'я відомого користувача в БД.
+USER_PROFILE_REFRESH_INTERVAL = 24 * 60 * 60
+
+# --- Обмеження одночасних запитів до Gemini ---
+
+# Скільки запитів до Gemini API може виконуватись одночасно.
+GEMINI_MAX_CONCURRENCY = 8
+
+# Окремі ліміти для моделей, наприклад {"models/gemini-2.5-pro": 2}.
+GEMINI_MODEL_CONCURRENCY: dict[str, int] = {}
+
+# Скільки запитів одного користувача може виконуватись одночасно.
+GEMINI_USER_CONCURRENCY = 1
+
+# Скільки запитів може чекати в черзі загалом та від одного користувача.
+# Понад ці ліміти користувач одразу отримує відповідь "зачекайте".
+GEMINI_QUEUE_SIZE = 100
+GEMINI_USER_QUEUE_SIZE = 3
+
+# --- Черга повідомлень користувача ---
+
+# Вікно (в секундах), у якому послідовні повідомлення користувача
+# об'єднуються в один запит до моделі. 0 — кожне повідомлення окремо
+# (за замовчуванням: вікно додає свою тривалість до кожної відповіді).
+MESSAGE_DEBOUNCE_WINDOW = 0
+
+# --- Резервні моделі ---
+
+# Після таймауту чи перевантаження (429/503) переходити до наступної моделі
+# за пріоритетом (наприклад, pro → flash → flash-lite).
+MODEL_FALLBACK_ENABLED = True
+
+# На скільки секунд модель виключається з ланцюжка після такого збою.
+MODEL_COOLDOWN = 60
+
+# --- Запобіжники (circuit breaker) ---
+
+# Після скількох збоїв поспіль модель або ключ API перестають отримувати запити.
+CIRCUIT_FAILURE_THRESHOLD = 5
+
+# Скільки секунд запобіжник залишається розімкненим до пробного запиту.
+CIRCUIT_RECOVERY_TIMEOUT = 30
+
+# Найдовша пауза (в секундах) за підказкою сервера retry-after, яку варто
+# почекати в межах одного запиту. Довша пауза — відповідь "спробуйте пізніше".
+CIRCUIT_MAX_RETRY_WAIT = 10
+
+# --- Хеджування запитів ---
+
+# Якщо відповідь моделі затримується довше, ніж зазвичай, надсилати
+# паралельно другий запит (через окремий ключ API) і брати ту відповідь,
+# що прийде першою. Діє лише для звичайних запитів: потокові відповіді
+# (STREAM_RESPONSES) не хеджуються.
+HEDGE_ENABLED = False
+
+# Після якого перцентиля недавніх затримок моделі надсилати другий запит.
+HEDGE_PERCENTILE = 0.9
+
+# Модель для другого запиту (наприклад, дешевша). None — та сама модель.
+HEDGE_MODEL: str | None = None
+
+# Скільки других запитів можна надіслати за хвилину, щоб не подвоїти витрати.
+HEDGE_BUDGET_PER_MINUTE = 10
+
+# --- Затримки моделей та адаптивні таймаути ---
+
+# Гістограма затримок кожної моделі охоплює останні LATENCY_WINDOW_SECONDS
+# секунд і оновлюється частинами по LATENCY_WINDOW_SECONDS / LATENCY_WINDOW_SLICES.
+LATENCY_WINDOW_SECONDS = 30 * 60
+LATENCY_WINDOW_SLICES = 6
+
+# Скільки замірів потрібно щонайменше, щоб довіряти перцентилям моделі.
+LATENCY_MIN_SAMPLES = 20
+
+# Таймаут запиту до моделі = перцентиль її затримок × множник,
+# але не менше ADAPTIVE_TIMEOUT_MIN і не більше GEMINI_API_TIMEOUT.
+ADAPTIVE_TIMEOUTS = True
+ADAPTIVE_TIMEOUT_PERCENTILE = 0.99
+ADAPTIVE_TIMEOUT_MULTIPLIER = 2.0
+ADAPTIVE_TIMEOUT_MIN = 10
+
+# Пауза перед повтором = медіана затримок моделі × 2^спроба
+# (API_RETRY_BASE_DELAY, поки замірів замало) в межах від MIN до MAX секунд.
+API_RETRY_DELAY_MIN = 1
+API_RETRY_DELAY_MAX = 30
+
+# --- Пул ключів Gemini API ---
+
+# Ліміти одного ключа на хвилину: запитів (RPM) та токенів (TPM).
+# Ключ, що досяг ліміту, пропускається до звільнення; None — без обмеження.
+API_KEY_RPM_LIMIT: int | None = None
+API_KEY_TPM_LIMIT: int | None = None
+
+# На скільки секунд ключ виводиться з ротації після відповіді 429,
+# якщо сервер не вказав час очікування.
+API_KEY_COOLDOWN = 60
+
+# --- Вихідні запити до Telegram ---
+
+# Скільки повідомлень на секунду бот надсилає загалом (ліміт Telegram ≈30/с).
+TG_GLOBAL_RATE = 30
+
+# Швидкість та запас (burst) повідомлень в один приватний чат (≈1/с)
+# і в одну групу (≈20/хв).
+TG_CHAT_RATE = 1.0
+TG_CHAT_BURST = 3
+TG_GROUP_RATE = 20 / 60
+
+# Скільки разів автоматично повторювати запит після TelegramRetryAfter.
+TG_RETRY_AFTER_ATTEMPTS = 3
+
+# Індикатор "друкує..." старший за цей час (в секундах) не надсилається.
+TG_CHAT_ACTION_MAX_AGE = 5
@@ -8,8 +8,16 @@ class Settings(BaseSettings):
 
     TG_TOKEN: str
     GEMINI_API_KEY: str
+    # Додаткові ключі Gemini API через кому: запити розподіляються між усіма ключами
+    GEMINI_API_KEYS: str = ""
     OWNER_ID: int
     DATABASE_URL: str
 
+    @property
+    def gemini_api_keys(self) -> list[str]:
+        """Повертає всі ключі Gemini API без повторів, основний — першим."""
+        keys = [self.GEMINI_API_KEY, *self.GEMINI_API_KEYS.split(",")]
+        return list(dict.fromkeys(key.strip() for key in keys if key.strip()))
+
 
 settings = Settings()
@@ -1,27 +1,332 @@
 """
 Централізований модуль для керування кешем в пам'яті.
 """
+import asyncio
 import logging
+import sys
 import time
-from typing import Dict, Any, Optional
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterator, List, Optional, Set, Tuple
+
+from bot.config import runtime_config
 
 from bot.db.database import get_db_connection
 
 logger = logging.getLogger(__name__)
 
-# --- Змінні кешу ---
+# Маркер відсутнього значення для кешів, що зберігають None як валідне значення
+MISSING = object()
+
+# Скільки останніх інвалідацій окремих ключів пам'ятає кеш. Старіші зводяться
+# до спільної нижньої межі: завантаження, розпочаті до неї, відкидаються для всіх ключів.
+INVALIDATION_HISTORY_SIZE = 10_000
+
+
+def estimate_size(value: Any) -> int:
+    """Приблизно оцінює розмір значення в пам'яті (в байтах), включно з вкладеними."""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset, deque)):
+        size += sum(estimate_size(item) for item in value)
+    return size
+
+
+class _CacheEntry:
+    """Запис кешу: значення, момент завершення TTL (monotonic) та оцінений розмір."""
+
+    __slots__ = ('value', 'expires_at', 'size')
+
+    def __init__(self, value: Any, expires_at: Optional[float], size: int):
+        self.value = value
+        self.expires_at = expires_at
+        self.size = size
+
+
+class TTLCache:
+    """Обмежений LRU-кеш з TTL.
+
+    Записи витісняються в порядку давності використання, коли перевищено
+    `max_entries` або `max_bytes`. Прострочені записи видаляються ліниво при
+    зверненні та періодично через `purge_expired`. Ведуться лічильники
+    влучань, промахів, витіснень і прострочень.
+
+    `get_or_load` об'єднує одночасні промахи за одним ключем в одне
+    завантаження (single-flight). Якщо задано `stale_ttl`, прострочений запис
+    ще стільки секунд віддається одразу, а оновлюється у фоні
+    (stale-while-revalidate).
+
+    Інвалідація ключа відкидає лише завантаження цього ключа, розпочаті до
+    неї: кеш пам'ятає, на якому значенні `generation` ключ видалено
+    востаннє, і `is_valid_since` порівнює його з моментом початку.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        ttl: Optional[float],
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        stale_ttl: float = 0,
+    ):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.stale_ttl = stale_ttl
+        self._data: "OrderedDict[Hashable, _CacheEntry]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._refresh_tasks: Set[asyncio.Task] = set()
+        # Змінюється при інвалідації, щоб не зберегти результат завантаження, розпочатого до неї
+        self._generation = 0
+        # Значення _generation на момент останнього delete кожного ключа (від давніших до новіших)
+        self._invalidated: "OrderedDict[Hashable, int]" = OrderedDict()
+        # Ключі, інвалідовані до цього моменту (clear або забуті записи), вважаються зміненими
+        self._invalidated_floor = 0
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.coalesced = 0
+        self.stale_hits = 0
+
+    @property
+    def generation(self) -> int:
+        """Лічильник інвалідацій: змінюється при кожному delete/clear."""
+        return self._generation
+
+    def is_valid_since(self, key: Hashable, generation: int) -> bool:
+        """Чи не інвалідували `key` після моменту, коли `generation` мав це значення."""
+        return max(self._invalidated_floor, self._invalidated.get(key, 0)) <= generation
+
+    def _lookup(self, key: Hashable, allow_stale: bool = False) -> Optional[_CacheEntry]:
+        """Повертає живий запис або None, видаляючи запис, що вийшов за межі stale_ttl."""
+        entry = self._data.get(key)
+        if entry is None or entry.expires_at is None:
+            return entry
+        now = time.monotonic()
+        if entry.expires_at + self.stale_ttl <= now:
+            self._remove(key)
+            self.expirations += 1
+            return None
+        if entry.expires_at <= now and not allow_stale:
+            return None
+        return entry
+
+    def _remove(self, key: Hashable) -> Optional[_CacheEntry]:
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry.size
+        return entry
+
+    def _evict(self):
+        """Витісняє найдавніше використані записи, поки кеш перевищує обмеження."""
+        while self._data and (
+            (self.max_entries is not None and len(self._data) > self.max_entries)
+            or (self.max_bytes is not None and self.bytes > self.max_bytes)
+        ):
+            _, entry = self._data.popitem(last=False)
+            self.bytes -= entry.size
+            self.evictions += 1
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Повертає значення за ключем (з оновленням LRU) або `default` при промаху."""
+        entry = self._lookup(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry.value
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """Повертає значення без оновлення LRU та лічильників."""
+        entry = self._lookup(key)
+        return default if entry is None else entry.value
+
+    def set(self, key: Hashable, value: Any):
+        """Зберігає значення з TTL кешу та застосовує обмеження розміру."""
+        self._remove(key)
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        size = estimate_size(value) if self.max_bytes is not None else 0
+        self._data[key] = _CacheEntry(value, expires_at, size)
+        self.bytes += size
+        self._evict()
+
+    def delete(self, key: Hashable) -> bool:
+        """Видаляє запис. Повертає True, якщо він існував."""
+        self._generation += 1
+        self._invalidated.pop(key, None)
+        self._invalidated[key] = self._generation
+        if len(self._invalidated) > INVALIDATION_HISTORY_SIZE:
+            _, forgotten = self._invalidated.popitem(last=False)
+            self._invalidated_floor = forgotten
+        self._inflight.pop(key, None)
+        return self._remove(key) is not None
+
+    def clear(self):
+        """Видаляє всі записи (лічильники зберігаються)."""
+        self._generation += 1
+        self._invalidated.clear()
+        self._invalidated_floor = self._generation
+        self._inflight.clear()
+        self._data.clear()
+        self.bytes = 0
+
+    async def get_or_load(
+        self,
+        key: Hashable,
+        loader: Callable[[], Awaitable[Any]],
+        cache_none: bool = True,
+    ) -> Any:
+        """Повертає значення з кешу або завантажує його через `loader`.
+
+        Одночасні промахи за одним ключем чекають на одне спільне завантаження.
+        Прострочене в межах `stale_ttl` значення повертається одразу, а
+        `loader` запускається у фоні. Якщо `cache_none` вимкнено, результат
+        None не кешується.
+        """
+        entry = self._lookup(key, allow_stale=True)
+        if entry is not None:
+            self._data.move_to_end(key)
+            self.hits += 1
+            if entry.expires_at is not None and entry.expires_at <= time.monotonic():
+                self.stale_hits += 1
+                if key not in self._inflight:
+                    self._start_load(key, loader, cache_none, background=True)
+            return entry.value
+
+        self.misses += 1
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            future = self._start_load(key, loader, cache_none)
+        return await asyncio.shield(future)
+
+    def _start_load(
+        self,
+        key: Hashable,
+        loader: Callable[[], Awaitable[Any]],
+        cache_none: bool,
+        background: bool = False,
+    ) -> asyncio.Future:
+        """Запускає завантаження значення як окрему задачу та реєструє його як in-flight."""
+        generation = self._generation
+
+        async def _load() -> Any:
+            try:
+                value = await loader()
+                if self.is_valid_since(key, generation) and (value is not None or cache_none):
+                    self.set(key, value)
+                return value
+            finally:
+                if self._inflight.get(key) is task:
+                    del self._inflight[key]
+
+        task = asyncio.create_task(_load(), name=f"{self.name}-load")
+        self._inflight[key] = task
+        if background:
+            # Помилку фонового оновлення лише логуємо: користувач уже отримав застаріле значення
+            self._refresh_tasks.add(task)
+            task.add_done_callback(self._on_refresh_done)
+        return task
+
+    def _on_refresh_done(self, task: asyncio.Task):
+        self._refresh_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Не вдалося оновити запис кешу {self.name} у фоні: {task.exception()}")
+
+    def purge_expired(self) -> int:
+        """Видаляє всі прострочені записи та повертає їх кількість."""
+        now = time.monotonic()
+        expired = [
+            k for k, e in self._data.items()
+            if e.expires_at is not None and e.expires_at + self.stale_ttl <= now
+        ]
+        for key in expired:
+            self._remove(key)
+        self.expirations += len(expired)
+        return len(expired)
+
+    def items(self) -> Iterator[Tuple[Hashable, Any, Optional[float]]]:
+        """Перебирає живі записи як (ключ, значення, секунд до завершення TTL)."""
+        now = time.monotonic()
+        for key, entry in list(self._data.items()):
+            if entry.expires_at is None:
+                yield key, entry.value, None
+            elif entry.expires_at > now:
+                yield key, entry.value, entry.expires_at - now
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self._lookup(key) is not None
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        """Повертає лічильники та заповненість кешу."""
+        lookups = self.hits + self.misses
+        return {
+            'name': self.name,
+            'entries': len(self._data),
+            'max_entries': self.max_entries,
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'coalesced': self.coalesced,
+            'stale_hits': self.stale_hits,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+# --- Екземпляри кешу ---
 
 # Кеш для загальних налаштувань (ключ -> значення)
-settings_cache: Dict[str, Any] = {}
 SETTINGS_CACHE_TTL = 60  # 1 хвилина
+settings_cache = TTLCache(
+    'settings_cache', ttl=SETTINGS_CACHE_TTL, max_entries=256,
+    stale_ttl=runtime_config.CACHE_STALE_TTL,
+)
 
-# Кеш для списку моделей
-models_cache: Optional[Dict[str, Any]] = None
+# Кеш для списку моделей (MODELS_CACHE_KEY -> список імен)
 MODELS_CACHE_TTL = 300  # 5 хвилин
+MODELS_CACHE_KEY = 'models'
+models_cache = TTLCache(
+    'models_cache', ttl=MODELS_CACHE_TTL, max_entries=1,
+    stale_ttl=runtime_config.CACHE_STALE_TTL,
+)
 
-# Кеш для налаштувань користувачів (user_id -> dict)
-user_cache: Dict[int, Dict[str, Any]] = {}
+# Кеш для налаштувань користувачів ((user_id, поле) -> значення)
 USER_CACHE_TTL = 120  # 2 хвилини
+USER_CACHE_FIELDS = ('role', 'tts_settings')
+user_cache = TTLCache(
+    'user_cache', ttl=USER_CACHE_TTL,
+    max_entries=runtime_config.USER_CACHE_MAX_ENTRIES,
+    max_bytes=runtime_config.USER_CACHE_MAX_BYTES,
+)
+
+# Кеш вікна контексту чату (user_id -> кільцевий буфер останніх (role, content)).
+# Без TTL: буфер актуалізується при кожному записі, витіснення — LRU за бюджетом пам'яті.
+# Запис для користувача поза кешем інвалідує його ключ (див. TTLCache.is_valid_since),
+# щоб читання, що вже триває, не заповнило кеш застарілими даними.
+context_cache = TTLCache('context_cache', ttl=None, max_bytes=runtime_config.CONTEXT_CACHE_MAX_BYTES)
+
+# Останні збережені в БД username/ім'я користувача; TTL задає, як часто їх оновлювати
+profile_cache = TTLCache(
+    'profile_cache',
+    ttl=runtime_config.USER_PROFILE_REFRESH_INTERVAL,
+    max_entries=runtime_config.USER_CACHE_MAX_ENTRIES,
+)
+
+ALL_CACHES = (settings_cache, models_cache, user_cache, context_cache, profile_cache)
+
+# ID користувачів, які точно є в таблиці users (користувачі не видаляються)
+known_users: Set[int] = set()
 
 
 # --- Приватні функції для прогріву ---
@@ -38,19 +343,78 @@ async def _warm_up_settings_cache():
     await get_text_model_name()
     logger.info("Кеш налаштувань прогріто.")
 
+# Найактивніші користувачі першими: за останнім повідомленням (індекс chat_history), потім за реєстрацією.
+# LIMIT NULL у PostgreSQL означає відсутність обмеження.
+_WARM_UP_USERS_QUERY = """
+    SELECT u.user_id, u.role, u.tts_enabled, u.tts_voice
+    FROM users u
+    LEFT JOIN LATERAL (
+        SELECT h.timestamp FROM chat_history h
+        WHERE h.user_id = u.user_id
+        ORDER BY h.timestamp DESC, h.id DESC
+        LIMIT 1
+    ) last_message ON TRUE
+    ORDER BY last_message.timestamp DESC NULLS LAST, u.created_at DESC
+    LIMIT $1
+"""
+
+
+def _fill_user_cache(row, generation: int) -> bool:
+    """Записує роль і налаштування TTS користувача в кеш, не перезаписуючи свіжіші дані.
+
+    Рядок пропускається, якщо кеш користувача інвалідували після моменту `generation`.
+    """
+    user_id = row['user_id']
+    if (user_id, 'role') in user_cache or (user_id, 'tts_settings') in user_cache:
+        return False
+    if not all(user_cache.is_valid_since((user_id, field), generation) for field in USER_CACHE_FIELDS):
+        return False
+    user_cache.set((user_id, 'role'), row['role'])
+    user_cache.set((user_id, 'tts_settings'), {
+        "tts_enabled": bool(row['tts_enabled']),
+        "tts_voice": row['tts_voice'],
+    })
+    return True
+
+
+async def _warm_up_known_users():
+    """Завантажує ID усіх зареєстрованих користувачів у множину known_users."""
+    loaded = 0
+    async with get_db_connection() as conn:
+        async with conn.transaction():
+            cursor = await conn.cursor("SELECT user_id FROM users")
+            while True:
+                rows = await cursor.fetch(runtime_config.WARM_UP_FETCH_SIZE)
+                if not rows:
+                    break
+                known_users.update(row['user_id'] for row in rows)
+                loaded += len(rows)
+    logger.info(f"Завантажено {loaded} відомих користувачів.")
+
+
 async def _warm_up_users_cache():
-    """Завантажує в кеш дані всіх існуючих користувачів."""
-    from bot.db.user_settings import get_user_role, get_user_tts_settings
+    """Завантажує в кеш ролі та налаштування TTS найактивніших користувачів одним запитом.
+
+    Рядки читаються серверним курсором пакетами по WARM_UP_FETCH_SIZE.
+    Користувачі, чий кеш інвалідувався під час читання пакета, пропускаються:
+    їхні дані могли застаріти й будуть завантажені ліниво.
+    """
+    limit = runtime_config.WARM_UP_USERS_LIMIT
+    warmed = 0
     async with get_db_connection() as conn:
-        user_ids = await conn.fetch("SELECT user_id FROM users")
-        if user_ids:
-            for record in user_ids:
-                user_id = record['user_id']
-                await get_user_role(user_id)
-                await get_user_tts_settings(user_id)
-            logger.info(f"Прогріто кеш для {len(user_ids)} користувачів.")
-        else:
-            logger.info("Користувачі для прогріву кешу не знайдені.")
+        async with conn.transaction():
+            cursor = await conn.cursor(_WARM_UP_USERS_QUERY, limit)
+            while True:
+                generation = user_cache.generation
+                rows = await cursor.fetch(runtime_config.WARM_UP_FETCH_SIZE)
+                if not rows:
+                    break
+                warmed += sum(_fill_user_cache(row, generation) for row in rows)
+
+    if warmed:
+        logger.info(f"Прогріто кеш для {warmed} користувачів.")
+    else:
+        logger.info("Користувачі для прогріву кешу не знайдені.")
 
 
 # --- Публічна функція для прогріву ---
@@ -58,33 +422,121 @@ async def _warm_up_users_cache():
 async def warm_up_caches():
     """
     Завантажує всі основні дані в кеш при старті бота.
+
+    Моделі та налаштування прогріваються одразу, а кеш користувачів —
+    у фоновій задачі, щоб не затримувати запуск polling.
     """
     logger.info("Прогрівання кешу...")
     await _warm_up_models_cache()
     await _warm_up_settings_cache()
-    await _warm_up_users_cache()
-    logger.info("Прогрівання кешу завершено.")
+    _start_background_task(_warm_up_users_cache_safely(), name="users-cache-warm-up")
+    logger.info("Прогрівання кешу завершено, кеш користувачів прогрівається у фоні.")
+
+
+async def _warm_up_users_cache_safely():
+    """Прогріває кеш користувачів у фоні, не зупиняючи бота при помилці."""
+    try:
+        await _warm_up_known_users()
+        await _warm_up_users_cache()
+    except Exception as e:
+        logger.error(f"Не вдалося прогріти кеш користувачів: {e}")
+
+
+# --- Фонові задачі кешу ---
+
+_background_tasks: Set[asyncio.Task] = set()
+
+
+def _start_background_task(coro: Awaitable[Any], name: str) -> asyncio.Task:
+    """Запускає фонову задачу кешу та зберігає посилання на неї до завершення."""
+    task = asyncio.create_task(coro, name=name)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+async def _purge_expired_periodically(interval: float):
+    """Періодично видаляє прострочені записи з усіх кешів."""
+    while True:
+        await asyncio.sleep(interval)
+        purged = sum(c.purge_expired() for c in ALL_CACHES)
+        if purged:
+            logger.debug(f"Видалено {purged} прострочених записів кешу.")
+
+
+def start_cache_expiry():
+    """Запускає фонову задачу очищення прострочених записів кешу."""
+    if not any(task.get_name() == "cache-expiry" for task in _background_tasks):
+        _start_background_task(
+            _purge_expired_periodically(runtime_config.CACHE_PURGE_INTERVAL),
+            name="cache-expiry",
+        )
+
+
+async def stop_cache_tasks():
+    """Зупиняє всі фонові задачі кешу (очищення, прогрів)."""
+    tasks = list(_background_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
 
 
 # --- Функції для інвалідації кешу ---
 
 def invalidate_settings_cache(key: Optional[str] = None):
     """Інвалідує весь кеш налаштувань або за конкретним ключем."""
-    global settings_cache
     if key is None:
-        settings_cache = {}
-    elif key in settings_cache:
-        del settings_cache[key]
+        settings_cache.clear()
+    else:
+        settings_cache.delete(key)
 
 def invalidate_models_cache():
     """Інвалідує кеш списку моделей."""
-    global models_cache
-    models_cache = None
+    models_cache.clear()
 
 def invalidate_user_cache(user_id: int, key: Optional[str] = None):
     """Інвалідує кеш для конкретного користувача або за ключем."""
-    if user_id in user_cache:
-        if key and key in user_cache[user_id]:
-            del user_cache[user_id][key]
-        elif key is None:
-            del user_cache[user_id]
+    for field in (key,) if key else USER_CACHE_FIELDS:
+        user_cache.delete((user_id, field))
+
+
+def mark_user_known(user_id: int):
+    """Позначає користувача як зареєстрованого в БД."""
+    known_users.add(user_id)
+
+def is_user_known(user_id: int) -> bool:
+    """Повертає True, якщо користувач точно є в таблиці users."""
+    return user_id in known_users
+
+
+# --- Кеш вікна контексту ---
+
+def get_cached_context(user_id: int) -> Optional[List[Tuple[str, str]]]:
+    """Повертає закешоване вікно контексту користувача або None при промаху."""
+    buffer = context_cache.get(user_id)
+    return None if buffer is None else list(buffer)
+
+
+def set_cached_context(user_id: int, messages: List[Tuple[str, str]]):
+    """Заповнює кеш контексту користувача останніми CONTEXT_MESSAGE_LIMIT повідомленнями."""
+    limit = runtime_config.CONTEXT_MESSAGE_LIMIT
+    context_cache.set(user_id, deque(messages[-limit:] if limit else [], maxlen=limit))
+
+
+def append_cached_context(user_id: int, role: str, content: str):
+    """Додає повідомлення до кешу контексту, якщо користувач у кеші."""
+    buffer = context_cache.peek(user_id)
+    if buffer is None:
+        context_cache.delete(user_id)
+        return
+    buffer.append((role, content))
+    # Повторне збереження перераховує розмір буфера та оновлює LRU
+    context_cache.set(user_id, buffer)
+
+
+def invalidate_context_cache(user_id: Optional[int] = None):
+    """Інвалідує кеш контексту для користувача або повністю."""
+    if user_id is None:
+        context_cache.clear()
+    else:
+        context_cache.delete(user_id)
@@ -1,5 +1,4 @@
 import logging
-import time
 from typing import Optional
 
 from bot.db.database import get_db_connection
@@ -14,15 +13,12 @@ CONFIG_KEY_TEXT_MODEL = "current_text_model"
 
 async def get_setting(key: str, default: Optional[str] = None) -> Optional[str]:
     """Отримує значення налаштування за ключем з БД з кешуванням."""
-    cached = cache.settings_cache.get(key)
-    if cached and (time.time() - cached['timestamp']) < cache.SETTINGS_CACHE_TTL:
-        return cached['value']
+    async def _load() -> Optional[str]:
+        async with get_db_connection() as conn:
+            return await conn.fetchval("SELECT value FROM bot_config WHERE key = $1", key)
 
-    async with get_db_connection() as conn:
-        value = await conn.fetchval("SELECT value FROM bot_config WHERE key = $1", key)
-        if value is not None:
-            cache.settings_cache[key] = {'timestamp': time.time(), 'value': value}
-        return value if value is not None else default
+    value = await cache.settings_cache.get_or_load(key, _load, cache_none=False)
+    return value if value is not None else default
 
 async def set_setting(key: str, value: str):
     """Встановлює або оновлює значення налаштування в БД та інвалідує кеш."""
@@ -1,15 +1,99 @@
 import asyncpg
+import json
 import logging
 import asyncio
 from contextlib import asynccontextmanager
+from typing import Optional
 
+from bot.config import runtime_config
 from bot.config.settings import settings
 
 logger = logging.getLogger(__name__)
 
+# Спільний для всього процесу пул з'єднань (створюється в app.main)
+_pool: Optional[asyncpg.Pool] = None
+
+
+async def _init_connection(conn: asyncpg.Connection):
+    """Налаштовує кожне нове з'єднання пулу: кодеки для JSON-типів."""
+    for type_name in ('json', 'jsonb'):
+        await conn.set_type_codec(
+            type_name, encoder=json.dumps, decoder=json.loads, schema='pg_catalog'
+        )
+
+
+async def create_pool() -> asyncpg.Pool:
+    """Створює спільний пул з'єднань, намагаючись підключитися кілька разів."""
+    global _pool
+    if _pool is not None:
+        return _pool
+
+    retries = 5
+    delay = 5  # seconds
+    for attempt in range(retries):
+        try:
+            _pool = await asyncpg.create_pool(
+                settings.DATABASE_URL,
+                min_size=runtime_config.DB_POOL_MIN_SIZE,
+                max_size=runtime_config.DB_POOL_MAX_SIZE,
+                max_inactive_connection_lifetime=runtime_config.DB_POOL_MAX_INACTIVE_LIFETIME,
+                statement_cache_size=runtime_config.DB_STATEMENT_CACHE_SIZE,
+                timeout=runtime_config.DB_CONNECT_TIMEOUT,
+                command_timeout=runtime_config.DB_COMMAND_TIMEOUT,
+                server_settings={'search_path': runtime_config.DB_SEARCH_PATH},
+                init=_init_connection,
+            )
+            logger.info(
+                f"Пул з'єднань з БД створено (min={runtime_config.DB_POOL_MIN_SIZE}, "
+                f"max={runtime_config.DB_POOL_MAX_SIZE})."
+            )
+            return _pool
+        except OSError as e:
+            if attempt < retries - 1:
+                logger.warning(
+                    f"Не вдалося створити пул з'єднань (спроба {attempt + 1}/{retries}): {e}. "
+                    f"Повторна спроба через {delay} секунд..."
+                )
+                await asyncio.sleep(delay)
+            else:
+                logger.error("Не вдалося створити пул з'єднань після кількох спроб.")
+                raise
+
+
+async def close_pool():
+    """Закриває спільний пул з'єднань, дочекавшись звільнення з'єднань."""
+    global _pool
+    if _pool is None:
+        return
+    pool, _pool = _pool, None
+    await pool.close()
+    logger.info("Пул з'єднань з БД закрито.")
+
+
+def get_db_pool() -> Optional[asyncpg.Pool]:
+    """Повертає спільний пул з'єднань або None, якщо його ще не створено."""
+    return _pool
+
+
 @asynccontextmanager
 async def get_db_connection():
-    """Надає контекстний менеджер для отримання з'єднання з пулу до БД."""
+    """Надає контекстний менеджер для отримання з'єднання з пулу до БД.
+
+    Якщо пул ще не створено (скрипти, health check), відкриває окреме з'єднання.
+    """
+    if _pool is not None:
+        pool = _pool
+        try:
+            conn = await pool.acquire(timeout=runtime_config.DB_POOL_ACQUIRE_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.error("Вичерпано час очікування вільного з'єднання з пулу БД.")
+            raise
+        try:
+            yield conn
+        finally:
+            await pool.release(conn)
+        return
+
     conn = None
     try:
         conn = await asyncpg.connect(settings.DATABASE_URL)
@@ -46,9 +130,14 @@ async def init_db():
                         id SERIAL PRIMARY KEY,
                         model_name TEXT NOT NULL UNIQUE,
                         is_active BOOLEAN DEFAULT TRUE,
-                        priority INTEGER DEFAULT 100
+                        priority INTEGER DEFAULT 100,
+                        is_available BOOLEAN DEFAULT TRUE
                     )
                 """)
+                # Наявність моделі в API ведеться окремо від is_active, який задає адміністратор
+                await conn.execute("""
+                    ALTER TABLE ai_models ADD COLUMN IF NOT EXISTS is_available BOOLEAN DEFAULT TRUE
+                """)
                 await conn.execute("""
                     CREATE TABLE IF NOT EXISTS bot_config (
                         key TEXT PRIMARY KEY,
@@ -73,6 +162,11 @@ async def init_db():
                         timestamp TIMESTAMPTZ DEFAULT NOW()
                     )
                 """)
+                # Індекс для вибірки останніх N повідомлень користувача без сортування всієї історії
+                await conn.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_chat_history_user_recent
+                    ON chat_history (user_id, timestamp DESC, id DESC)
+                """)
                 await conn.execute("""
                     CREATE TABLE IF NOT EXISTS long_term_memory (
                         id SERIAL PRIMARY KEY,
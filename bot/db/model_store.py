@@ -1,5 +1,4 @@
 import logging
-import time
 from typing import List
 
 from bot.db.database import get_db_connection
@@ -19,38 +18,54 @@ def _get_model_priority(model_name: str) -> int:
     return 100 # Пріоритет за замовчуванням для інших моделей
 
 async def sync_models(api_models: List[str]):
-    """Синхронізує список моделей з API з базою даних та інвалідує кеш."""
+    """Синхронізує список моделей з API з базою даних та інвалідує кеш.
+
+    Нові моделі додаються, зниклі з API позначаються недоступними (is_available),
+    а повернені знову стають доступними. Встановлені адміністратором
+    is_active та priority для наявних моделей не змінюються.
+    """
     async with get_db_connection() as conn:
-        db_rows = await conn.fetch("SELECT model_name FROM ai_models ORDER BY model_name ASC")
-        db_models = [row['model_name'] for row in db_rows]
+        db_rows = await conn.fetch("SELECT model_name, is_available FROM ai_models")
+        db_models = {row['model_name']: row['is_available'] for row in db_rows}
+        api_set = set(api_models)
+
+        changes = [
+            (model_name, _get_model_priority(model_name), True)
+            for model_name in sorted(api_set)
+            if not db_models.get(model_name, False)
+        ]
+        changes.extend(
+            (model_name, _get_model_priority(model_name), False)
+            for model_name, is_available in sorted(db_models.items())
+            if is_available and model_name not in api_set
+        )
 
-        if set(db_models) == set(api_models):
+        if not changes:
             logger.info("Список моделей в БД актуальний. Оновлення не потрібне.")
             return
 
-        logger.info("Списки моделей відрізняються. Повне оновлення таблиці ai_models...")
+        await conn.executemany(
+            """
+            INSERT INTO ai_models (model_name, priority, is_available) VALUES ($1, $2, $3)
+            ON CONFLICT (model_name) DO UPDATE SET is_available = EXCLUDED.is_available
+            """,
+            changes,
+        )
 
-        async with conn.transaction():
-            await conn.execute("DELETE FROM ai_models")
-            for model_name in api_models:
-                priority = _get_model_priority(model_name)
-                await conn.execute(
-                    "INSERT INTO ai_models (model_name, priority) VALUES ($1, $2)",
-                    model_name, priority
-                )
-        
-        cache.invalidate_models_cache()
-        logger.info(f"Таблицю ai_models повністю оновлено. Додано {len(api_models)} моделей.")
+    cache.invalidate_models_cache()
+    available = sum(1 for change in changes if change[2])
+    logger.info(
+        f"Таблицю ai_models оновлено: доступними позначено {available}, "
+        f"недоступними — {len(changes) - available} моделей."
+    )
 
 async def get_available_models() -> List[str]:
     """Повертає список активних моделей AI з кешуванням."""
-    if cache.models_cache and (time.time() - cache.models_cache['timestamp']) < cache.MODELS_CACHE_TTL:
-        return cache.models_cache['models']
+    async def _load() -> List[str]:
+        async with get_db_connection() as conn:
+            rows = await conn.fetch(
+                "SELECT model_name FROM ai_models WHERE is_active = TRUE AND is_available = TRUE ORDER BY priority ASC, model_name ASC"
+            )
+            return [row['model_name'] for row in rows]
 
-    async with get_db_connection() as conn:
-        rows = await conn.fetch(
-            "SELECT model_name FROM ai_models WHERE is_active = TRUE ORDER BY priority ASC, model_name ASC"
-        )
-        models = [row['model_name'] for row in rows]
-        cache.models_cache = {'timestamp': time.time(), 'models': models}
-        return models
+    return await cache.models_cache.get_or_load(cache.MODELS_CACHE_KEY, _load)
@@ -1,8 +1,11 @@
+import asyncio
 import logging
-import time
-from typing import Dict, Any, List, Optional
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional, Tuple
 from aiogram.types import User
 from bot.db.database import get_db_connection
+from bot.config import runtime_config
 from bot.config.settings import settings
 from bot.db import cache
 
@@ -10,43 +13,137 @@ logger = logging.getLogger(__name__)
 
 # --- Керування користувачами та ролями ---
 
-async def register_user_if_not_exists(tg_user: User):
-    """Перевіряє, чи існує користувач у БД. Якщо ні, створює новий запис.
-    Автоматично призначає роль 'owner', якщо ID співпадає з OWNER_ID.
+_INSERT_USER_QUERY = """
+    INSERT INTO users (user_id, username, first_name, last_name, role)
+    VALUES ($1, $2, $3, $4, $5)
+    ON CONFLICT (user_id) DO NOTHING
+    RETURNING role, tts_enabled, tts_voice
+"""
+_SELECT_USER_QUERY = "SELECT role, tts_enabled, tts_voice FROM users WHERE user_id = $1"
+
+
+def _profile_of(tg_user: User) -> Tuple[Optional[str], str, Optional[str]]:
+    """Повертає поля профілю Telegram, що зберігаються в таблиці users."""
+    return tg_user.username, tg_user.full_name, tg_user.last_name
+
+
+async def _fetch_or_register_user(conn, tg_user: User) -> Tuple[Any, bool]:
+    """Повертає рядок користувача (role, tts_enabled, tts_voice) та ознаку нової реєстрації.
+
+    Для невідомих ID спершу виконується INSERT ... ON CONFLICT DO NOTHING RETURNING,
+    тож нового користувача реєструє один запит.
     """
-    async with get_db_connection() as conn:
-        user_data = await conn.fetchrow("SELECT user_id, role FROM users WHERE user_id = $1", tg_user.id)
+    user_id = tg_user.id
+    if cache.is_user_known(user_id):
+        row = await conn.fetchrow(_SELECT_USER_QUERY, user_id)
+        if row is not None:
+            return row, False
+
+    role = 'owner' if user_id == settings.OWNER_ID else 'user'
+    row = await conn.fetchrow(_INSERT_USER_QUERY, user_id, *_profile_of(tg_user), role)
+    is_new = row is not None
+    if is_new:
+        logger.info(
+            f"Новий користувач (ID: {user_id}, Name: {tg_user.full_name}, "
+            f"Role: {role}) зареєстрований у базі даних."
+        )
+        cache.profile_cache.set(user_id, _profile_of(tg_user))
+    else:
+        row = await conn.fetchrow(_SELECT_USER_QUERY, user_id)
+    cache.mark_user_known(user_id)
+    return row, is_new
+
 
-        if user_data is None:
-            role = 'owner' if tg_user.id == settings.OWNER_ID else 'user'
+async def _refresh_user_profile(tg_user: User):
+    """Оновлює username та ім'я користувача в БД, якщо вони змінилися.
+
+    Для кожного користувача звертається до БД не частіше, ніж раз на
+    USER_PROFILE_REFRESH_INTERVAL, або одразу, якщо профіль змінився.
+    """
+    profile = _profile_of(tg_user)
+    if cache.profile_cache.peek(tg_user.id) == profile:
+        return
+    try:
+        async with get_db_connection() as conn:
             await conn.execute(
-                "INSERT INTO users (user_id, username, first_name, last_name, role) "
-                "VALUES ($1, $2, $3, $4, $5)",
-                tg_user.id, tg_user.username, tg_user.full_name, tg_user.last_name, role
-            )
-            logger.info(
-                f"Новий користувач (ID: {tg_user.id}, Name: {tg_user.full_name}, "
-                f"Role: {role}) зареєстрований у базі даних."
+                "UPDATE users SET username = $2, first_name = $3, last_name = $4 "
+                "WHERE user_id = $1 AND (username IS DISTINCT FROM $2 "
+                "OR first_name IS DISTINCT FROM $3 OR last_name IS DISTINCT FROM $4)",
+                tg_user.id, *profile,
             )
-            cache.invalidate_user_cache(tg_user.id)
+    except Exception as e:
+        logger.warning(f"Не вдалося оновити профіль користувача (ID: {tg_user.id}): {e}")
+        return
+    cache.profile_cache.set(tg_user.id, profile)
+
+
+@dataclass(frozen=True)
+class UserContext:
+    """Дані користувача, потрібні для обробки одного оновлення."""
+
+    user_id: int
+    role: str
+    tts_enabled: bool
+    tts_voice: str
+
+    @property
+    def is_owner(self) -> bool:
+        return self.user_id == settings.OWNER_ID
+
+    @property
+    def is_admin(self) -> bool:
+        return self.role in ('admin', 'owner')
+
+    @property
+    def tts_settings(self) -> Dict[str, Any]:
+        return {"tts_enabled": self.tts_enabled, "tts_voice": self.tts_voice}
 
-        elif tg_user.id == settings.OWNER_ID and user_data['role'] != 'owner':
-            await update_user_role(tg_user.id, 'owner')
-            logger.info(f"Роль власника (ID: {tg_user.id}) відновлено.")
+
+async def resolve_user_context(tg_user: User) -> UserContext:
+    """Повертає UserContext користувача, за потреби реєструючи його.
+
+    Для користувачів з кешем ролі та TTS не робить жодного запиту до БД,
+    інакше читає або створює запис одним запитом і заповнює кеш. Відомі
+    користувачі (cache.known_users) лише читаються, без спроби вставки;
+    username та ім'я оновлюються лише тоді, коли вони змінилися.
+    """
+    user_id = tg_user.id
+    role = cache.user_cache.get((user_id, 'role'))
+    tts = cache.user_cache.get((user_id, 'tts_settings'))
+    is_owner = user_id == settings.OWNER_ID
+    if role is not None and tts is not None and (role == 'owner' or not is_owner):
+        await _refresh_user_profile(tg_user)
+        return UserContext(user_id, role, tts["tts_enabled"], tts["tts_voice"])
+
+    generation = cache.user_cache.generation
+    async with get_db_connection() as conn:
+        row, is_new = await _fetch_or_register_user(conn, tg_user)
+
+    role = row['role']
+    if is_owner and role != 'owner':
+        await update_user_role(user_id, 'owner')
+        logger.info(f"Роль власника (ID: {user_id}) відновлено.")
+        role = 'owner'
+        generation = cache.user_cache.generation
+    if not is_new:
+        await _refresh_user_profile(tg_user)
+
+    context = UserContext(user_id, role, bool(row['tts_enabled']), row['tts_voice'])
+    # Не перезаписуємо кеш, якщо його інвалідували, поки виконувався запит
+    if cache.user_cache.is_valid_since((user_id, 'role'), generation):
+        cache.user_cache.set((user_id, 'role'), role)
+    if cache.user_cache.is_valid_since((user_id, 'tts_settings'), generation):
+        cache.user_cache.set((user_id, 'tts_settings'), context.tts_settings)
+    return context
 
 
 async def get_user_role(user_id: int) -> Optional[str]:
     """Повертає роль користувача з БД з кешуванням."""
-    cached = cache.user_cache.get(user_id, {}).get('role')
-    if cached and (time.time() - cached['timestamp']) < cache.USER_CACHE_TTL:
-        return cached['value']
+    async def _load() -> Optional[str]:
+        async with get_db_connection() as conn:
+            return await conn.fetchval("SELECT role FROM users WHERE user_id = $1", user_id)
 
-    async with get_db_connection() as conn:
-        role = await conn.fetchval("SELECT role FROM users WHERE user_id = $1", user_id)
-        if user_id not in cache.user_cache:
-            cache.user_cache[user_id] = {}
-        cache.user_cache[user_id]['role'] = {'timestamp': time.time(), 'value': role}
-        return role
+    return await cache.user_cache.get_or_load((user_id, 'role'), _load)
 
 async def update_user_role(user_id: int, role: str):
     """Оновлює роль користувача в БД та інвалідує кеш."""
@@ -59,26 +156,19 @@ async def update_user_role(user_id: int, role: str):
 
 async def get_user_tts_settings(user_id: int) -> Dict[str, Any]:
     """Отримує налаштування TTS (enabled, voice) для користувача з кешуванням."""
-    cached = cache.user_cache.get(user_id, {}).get('tts_settings')
-    if cached and (time.time() - cached['timestamp']) < cache.USER_CACHE_TTL:
-        return cached['value']
-
-    async with get_db_connection() as conn:
-        row = await conn.fetchrow(
-            "SELECT tts_enabled, tts_voice FROM users WHERE user_id = $1", user_id
-        )
+    async def _load() -> Dict[str, Any]:
+        async with get_db_connection() as conn:
+            row = await conn.fetchrow(
+                "SELECT tts_enabled, tts_voice FROM users WHERE user_id = $1", user_id
+            )
         if row:
-            settings_val = {
+            return {
                 "tts_enabled": bool(row['tts_enabled']),
                 "tts_voice": row['tts_voice'],
             }
-        else:
-            settings_val = {"tts_enabled": True, "tts_voice": "female"} # Значення за замовчуванням
+        return {"tts_enabled": True, "tts_voice": "female"} # Значення за замовчуванням
 
-        if user_id not in cache.user_cache:
-            cache.user_cache[user_id] = {}
-        cache.user_cache[user_id]['tts_settings'] = {'timestamp': time.time(), 'value': settings_val}
-        return settings_val
+    return await cache.user_cache.get_or_load((user_id, 'tts_settings'), _load)
 
 async def update_user_tts_enabled(user_id: int, enabled: bool):
     """Оновлює статус TTS та інвалідує кеш."""
@@ -94,22 +184,228 @@ async def update_user_tts_voice(user_id: int, voice: str):
 
 # --- Контекст чату ---
 
-async def get_user_context(user_id: int) -> List[Dict[str, Any]]:
-    """Отримує історію чату (контекст) для користувача з БД.
+# Запис черги: (user_id, role, content, created_at)
+_HistoryRecord = Tuple[int, str, str, datetime]
+
+
+class _ChatHistoryWriter:
+    """Write-behind черга для записів chat_history.
+
+    Повідомлення накопичуються в пам'яті й записуються в БД одним
+    багаторядковим INSERT, коли черга досягає `batch_size` або минає
+    `flush_interval` секунд. Ще не записані повідомлення користувача
+    доступні через `pending_for`, щоб get_user_context бачив власні записи.
+    Якщо пакет не записується `max_retries` разів поспіль, його записи
+    пишуться по одному, а ті, що не записуються й так, відкидаються.
     """
-    context = []
-    async with get_db_connection() as conn:
-        rows = await conn.fetch(
-            "SELECT role, content FROM chat_history WHERE user_id = $1 ORDER BY timestamp ASC",
-            user_id
-        )
-        for row in rows:
-            context.append({'role': row['role'], 'parts': [{'text': row['content']}]})
-    return context
+
+    def __init__(self, batch_size: int, flush_interval: float, max_retries: int = 3):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self._queue: List[_HistoryRecord] = []
+        self._failures = 0  # Невдалі спроби записати пакет поспіль
+        self._stopping = False
+        self._inflight_users: set[int] = set()
+        self._flush_done: Optional[asyncio.Future] = None
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        """Чи працює фонова задача запису."""
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """Запускає фонову задачу періодичного запису."""
+        if not self.running:
+            self._wakeup = asyncio.Event()
+            self._stopping = False
+            self._task = asyncio.create_task(self._run(), name="chat-history-writer")
+
+    async def stop(self):
+        """Зупиняє фонову задачу та записує все, що залишилось у черзі."""
+        if self._task is not None:
+            # Задача не скасовується, щоб не перервати запис уже забраного пакета
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    def enqueue(self, user_id: int, role: str, content: str):
+        """Додає повідомлення до черги без звернення до БД."""
+        self._queue.append((user_id, role, content, datetime.now(timezone.utc)))
+        if len(self._queue) >= self.batch_size:
+            self._wakeup.set()
+
+    def pending_for(self, user_id: int) -> List[_HistoryRecord]:
+        """Повертає ще не забрані на запис повідомлення користувача."""
+        return [r for r in self._queue if r[0] == user_id]
+
+    def still_pending(self, records: List[_HistoryRecord]) -> bool:
+        """Чи залишаються записи в черзі (flush забирає чергу цілком)."""
+        return not records or any(r is records[0] for r in self._queue)
+
+    def is_inflight(self, user_id: int) -> bool:
+        """Чи записуються зараз повідомлення користувача в БД."""
+        return user_id in self._inflight_users
+
+    async def wait_inflight(self):
+        """Чекає завершення поточного запису (якщо він відбувається)."""
+        if self._flush_done is not None:
+            await asyncio.shield(self._flush_done)
+
+    async def discard(self, user_id: int):
+        """Відкидає повідомлення користувача з черги та чекає запису вже забраних."""
+        self._queue = [r for r in self._queue if r[0] != user_id]
+        while self.is_inflight(user_id):
+            await self.wait_inflight()
+
+    async def flush(self):
+        """Записує всі повідомлення з черги одним запитом."""
+        async with self._flush_lock:
+            if not self._queue:
+                return
+            batch, self._queue = self._queue, []
+            self._inflight_users = {r[0] for r in batch}
+            self._flush_done = asyncio.get_running_loop().create_future()
+            try:
+                user_ids, roles, contents, created = zip(*batch, strict=True)
+                async with get_db_connection() as conn:
+                    await conn.execute(
+                        "INSERT INTO chat_history (user_id, role, content, timestamp) "
+                        "SELECT * FROM unnest($1::bigint[], $2::text[], $3::text[], $4::timestamptz[])",
+                        list(user_ids), list(roles), list(contents), list(created)
+                    )
+                self._failures = 0
+                logger.debug(f"Записано {len(batch)} повідомлень історії чату.")
+            except Exception as e:
+                self._failures += 1
+                logger.error(f"Не вдалося записати {len(batch)} повідомлень історії чату: {e}")
+                if self._failures < self.max_retries:
+                    # Повертаємо записи на початок черги, щоб спробувати наступного разу
+                    self._queue[:0] = batch
+                else:
+                    self._failures = 0
+                    await self._write_each(batch)
+            finally:
+                self._inflight_users = set()
+                self._flush_done.set_result(None)
+                self._flush_done = None
+
+    async def _write_each(self, batch: List[_HistoryRecord]):
+        """Записує пакет по одному запису, відкидаючи ті, що не записуються."""
+        written = 0
+        try:
+            async with get_db_connection() as conn:
+                for user_id, role, content, created in batch:
+                    try:
+                        await conn.execute(
+                            "INSERT INTO chat_history (user_id, role, content, timestamp) "
+                            "VALUES ($1, $2, $3, $4)",
+                            user_id, role, content, created
+                        )
+                        written += 1
+                    except Exception as e:
+                        logger.error(f"Відкинуто повідомлення історії чату користувача {user_id}: {e}")
+        except Exception as e:
+            logger.error(f"Не вдалося підключитися до БД для запису історії чату: {e}")
+        if written < len(batch):
+            logger.error(f"Відкинуто {len(batch) - written} з {len(batch)} повідомлень історії чату.")
+
+    async def _run(self):
+        """Цикл фонової задачі: запис за розміром черги або за інтервалом."""
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+
+_history_writer = _ChatHistoryWriter(
+    batch_size=runtime_config.CHAT_HISTORY_FLUSH_BATCH_SIZE,
+    flush_interval=runtime_config.CHAT_HISTORY_FLUSH_INTERVAL,
+    max_retries=runtime_config.CHAT_HISTORY_FLUSH_MAX_RETRIES,
+)
+
+
+def start_chat_history_writer():
+    """Вмикає відкладений пакетний запис історії чату."""
+    _history_writer.start()
+    logger.info("Відкладений запис історії чату запущено.")
+
+
+async def stop_chat_history_writer():
+    """Зупиняє відкладений запис і записує в БД усі повідомлення з черги."""
+    await _history_writer.stop()
+    logger.info("Відкладений запис історії чату зупинено, черга записана.")
+
+
+async def flush_chat_history():
+    """Примусово записує в БД усі повідомлення з черги."""
+    await _history_writer.flush()
+
+
+async def get_user_context(user_id: int, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Отримує останні `limit` повідомлень історії чату (контекст) для користувача.
+
+    Спочатку перевіряється кеш вікна контексту. При промаху ліміт застосовується
+    в SQL: вибираються найновіші записи за індексом (user_id, timestamp DESC, id DESC),
+    після чого порядок розвертається у хронологічний, до них додаються ще не
+    записані в БД повідомлення користувача, і результат потрапляє в кеш.
+    За замовчуванням використовується CONTEXT_MESSAGE_LIMIT.
+    """
+    if limit is None:
+        limit = runtime_config.CONTEXT_MESSAGE_LIMIT
+
+    if limit <= runtime_config.CONTEXT_MESSAGE_LIMIT:
+        cached = cache.get_cached_context(user_id)
+        if cached is not None:
+            return _to_context(cached[-limit:] if limit else [])
+
+    window = max(limit, runtime_config.CONTEXT_MESSAGE_LIMIT)
+    generation = cache.context_cache.generation
+    while True:
+        # Поки повідомлення користувача записуються, їх не видно ні в черзі, ні (можливо) в БД
+        while _history_writer.is_inflight(user_id):
+            await _history_writer.wait_inflight()
+        pending = _history_writer.pending_for(user_id)
+
+        async with get_db_connection() as conn:
+            rows = await conn.fetch(
+                "SELECT role, content FROM chat_history WHERE user_id = $1 "
+                "ORDER BY timestamp DESC, id DESC LIMIT $2",
+                user_id, window
+            )
+        # Якщо під час запиту черга користувача пішла на запис, результат міг їх не включати
+        if _history_writer.still_pending(pending):
+            break
+
+    messages = [(row['role'], row['content']) for row in reversed(rows)]
+    messages.extend((role, content) for _, role, content, _ in pending)
+    # Не заповнюємо кеш, якщо під час читання історія користувача змінилась в обхід кешу
+    if cache.context_cache.is_valid_since(user_id, generation):
+        cache.set_cached_context(user_id, messages)
+    return _to_context(messages[-limit:] if limit else [])
+
+def _to_context(messages: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+    """Перетворює пари (role, content) у формат контексту Gemini."""
+    return [{'role': role, 'parts': [{'text': content}]} for role, content in messages]
 
 async def add_message_to_context(user_id: int, role: str, content: str):
-    """Додає нове повідомлення до історії чату користувача.
+    """Додає нове повідомлення до історії чату користувача та кешу контексту.
+
+    Якщо відкладений запис запущено, повідомлення лише ставиться в чергу.
     """
+    cache.append_cached_context(user_id, role, content)
+    if _history_writer.running:
+        _history_writer.enqueue(user_id, role, content)
+        return
+
     async with get_db_connection() as conn:
         await conn.execute(
             "INSERT INTO chat_history (user_id, role, content) VALUES ($1, $2, $3)",
@@ -119,6 +415,7 @@ async def add_message_to_context(user_id: int, role: str, content: str):
 async def clear_user_context(user_id: int):
     """Очищує історію чату для користувача.
     """
+    await _history_writer.discard(user_id)
     async with get_db_connection() as conn:
         await conn.execute("DELETE FROM chat_history WHERE user_id = $1", user_id)
-
+    cache.invalidate_context_cache(user_id)
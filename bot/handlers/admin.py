@@ -1,7 +1,6 @@
 import aiofiles
 import os
-import time
-from typing import List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 from aiogram import F, Router
 from aiogram.filters import Command, Filter
@@ -13,8 +12,16 @@ from bot.config.settings import settings
 from bot.db.admin_store import add_admin, is_admin, list_admins, remove_admin
 from bot.db.config_store import get_text_model_name, set_text_model
 from bot.db.model_store import get_available_models
+from bot.db.user_settings import UserContext
+from bot.handlers.buttons import buttons
+from bot.middlewares.outbound_rate_limit import outbound_rate_limiter
 from bot.presentation.keyboards.inline import get_model_selection_keyboard
 from bot.presentation.keyboards.reply import get_admin_management_keyboard, get_admin_menu
+from bot.services.gemini import key_pool
+from bot.services.hedging import hedge_budget
+from bot.services.latency import latency_tracker
+from bot.services.model_health import model_health
+from bot.services.scheduler import gemini_scheduler
 from bot.core.logging_setup import get_logger
 
 # Імпортуємо кеші для моніторингу
@@ -30,16 +37,20 @@ EMPTY_CACHE_MESSAGE = "- Порожньо"
 class AdminFilter(Filter):
     """Фільтр для перевірки, чи є користувач адміном."""
 
-    async def __call__(self, message: Message) -> bool:
+    async def __call__(self, message: Message, user_context: Optional[UserContext] = None) -> bool:
         """Перевіряє права доступу користувача."""
+        if user_context is not None:
+            return user_context.is_admin
         return await is_admin(message.from_user.id)
 
 
 class OwnerFilter(Filter):
     """Фільтр для перевірки, чи є користувач власником."""
 
-    async def __call__(self, message: Message) -> bool:
+    async def __call__(self, message: Message, user_context: Optional[UserContext] = None) -> bool:
         """Перевіряє, чи є користувач власником бота."""
+        if user_context is not None:
+            return user_context.is_owner
         return message.from_user.id == settings.OWNER_ID
 
 
@@ -52,43 +63,49 @@ class AdminActions(StatesGroup):
 
 # --- ІНФОРМАЦІЯ ПРО СИСТЕМУ (для власника) ---
 
-def _get_settings_cache_info(now: float) -> List[str]:
+def _get_settings_cache_info() -> List[str]:
     """Повертає інформацію про кеш налаштувань."""
     info_parts = ["\nКеш налаштувань (settings_cache):"]
-    if cache.settings_cache:
-        for key, data in cache.settings_cache.items():
-            ttl = round(data['timestamp'] + cache.SETTINGS_CACHE_TTL - now)
-            info_parts.append(f"- {key}: {data['value']} (залишилось {ttl} сек)")
+    entries = list(cache.settings_cache.items())
+    if entries:
+        for key, value, ttl in entries:
+            info_parts.append(f"- {key}: {value} (залишилось {round(ttl)} сек)")
     else:
         info_parts.append(EMPTY_CACHE_MESSAGE)
     return info_parts
 
-def _get_models_cache_info(now: float) -> List[str]:
+def _get_models_cache_info() -> List[str]:
     """Повертає інформацію про кеш моделей."""
     info_parts = ["\nКеш моделей (models_cache):"]
-    if cache.models_cache:
-        ttl = round(cache.models_cache['timestamp'] + cache.MODELS_CACHE_TTL - now)
-        models = cache.models_cache['models']
-        info_parts.append(f"- models: {models} (залишилось {ttl} сек)")
+    entries = list(cache.models_cache.items())
+    if entries:
+        for _, models, ttl in entries:
+            info_parts.append(f"- models: {models} (залишилось {round(ttl)} сек)")
     else:
         info_parts.append(EMPTY_CACHE_MESSAGE)
     return info_parts
 
-def _format_user_cache_entry(user_id: int, user_data: dict, now: float) -> List[str]:
+def _format_user_cache_entry(user_id: int, user_data: Dict[str, Tuple[Any, float]]) -> List[str]:
     """Форматує запис кешу для одного користувача."""
     info = [f"\n- Користувач {user_id}:"]
-    for key, data in user_data.items():
-        ttl = round(data['timestamp'] + cache.USER_CACHE_TTL - now)
-        info.append(f"  - {key}: {data['value']} (залишилось {ttl} сек)")
+    for key, (value, ttl) in user_data.items():
+        info.append(f"  - {key}: {value} (залишилось {round(ttl)} сек)")
     return info
 
-async def _get_owner_user_cache_info(now: float) -> List[str]:
+def _group_user_cache() -> Dict[int, Dict[str, Tuple[Any, float]]]:
+    """Групує записи кешу користувачів (user_id, поле) за user_id."""
+    grouped: Dict[int, Dict[str, Tuple[Any, float]]] = {}
+    for (user_id_cache, field), value, ttl in cache.user_cache.items():
+        grouped.setdefault(user_id_cache, {})[field] = (value, ttl)
+    return grouped
+
+async def _get_owner_user_cache_info() -> List[str]:
     """Повертає інформацію про кеш користувачів для власника."""
     info_parts = []
     admin_cache_view = {}
     user_cache_view = {}
 
-    for user_id_cache, user_data in cache.user_cache.items():
+    for user_id_cache, user_data in _group_user_cache().items():
         if await is_admin(user_id_cache):
             admin_cache_view[user_id_cache] = user_data
         else:
@@ -100,56 +117,79 @@ async def _get_owner_user_cache_info(now: float) -> List[str]:
     if admin_cache_view:
         info_parts.append("\n👑 **Адміністратори:**")
         for user_id_cache, user_data in admin_cache_view.items():
-            info_parts.extend(_format_user_cache_entry(user_id_cache, user_data, now))
+            info_parts.extend(_format_user_cache_entry(user_id_cache, user_data))
 
     if user_cache_view:
         info_parts.append("\n👥 **Користувачі:**")
         for user_id_cache, user_data in user_cache_view.items():
-            info_parts.extend(_format_user_cache_entry(user_id_cache, user_data, now))
+            info_parts.extend(_format_user_cache_entry(user_id_cache, user_data))
             
     return info_parts
 
-async def _get_admin_user_cache_info(now: float) -> List[str]:
+async def _get_admin_user_cache_info() -> List[str]:
     """Повертає інформацію про кеш користувачів для адміна."""
     info_parts = []
     user_cache_view = {}
-    for user_id_cache, user_data in cache.user_cache.items():
+    for user_id_cache, user_data in _group_user_cache().items():
         if not await is_admin(user_id_cache):
             user_cache_view[user_id_cache] = user_data
 
     if user_cache_view:
         for user_id_cache, user_data in user_cache_view.items():
-            info_parts.extend(_format_user_cache_entry(user_id_cache, user_data, now))
+            info_parts.extend(_format_user_cache_entry(user_id_cache, user_data))
     else:
         info_parts.append(EMPTY_CACHE_MESSAGE)
         
     return info_parts
 
-async def _get_user_cache_info(now: float, is_owner: bool) -> List[str]:
+def _format_cache_stats(stats: Dict[str, Any]) -> List[str]:
+    """Форматує лічильники одного кешу."""
+    limits = []
+    if stats['max_entries'] is not None:
+        limits.append(f"{stats['entries']} / {stats['max_entries']} записів")
+    else:
+        limits.append(f"{stats['entries']} записів")
+    if stats['max_bytes'] is not None:
+        limits.append(f"{stats['bytes']} / {stats['max_bytes']} байт")
+    return [
+        f"- {stats['name']}: {', '.join(limits)}",
+        f"  влучання: {stats['hits']}, промахи: {stats['misses']} (hit rate {stats['hit_rate']:.1%}), "
+        f"витіснено: {stats['evictions']}, прострочено: {stats['expirations']}",
+        f"  об'єднано промахів: {stats['coalesced']}, віддано застарілих: {stats['stale_hits']}",
+    ]
+
+def _get_cache_stats_info() -> List[str]:
+    """Повертає статистику всіх кешів."""
+    info_parts = ["\nСтатистика кешів:"]
+    for cache_obj in cache.ALL_CACHES:
+        info_parts.extend(_format_cache_stats(cache_obj.stats()))
+    return info_parts
+
+async def _get_user_cache_info(is_owner: bool) -> List[str]:
     """Повертає інформацію про кеш користувачів."""
     info_parts = ["\nКеш користувачів (user_cache):"]
     if is_owner:
-        info_parts.extend(await _get_owner_user_cache_info(now))
+        info_parts.extend(await _get_owner_user_cache_info())
     else:
-        info_parts.extend(await _get_admin_user_cache_info(now))
+        info_parts.extend(await _get_admin_user_cache_info())
     return info_parts
 
-@router.message(AdminFilter(), F.text == "ℹ️ Інфо про кеш")
-async def cache_info_handler(message: Message) -> None:
+@buttons.button("ℹ️ Інфо про кеш", permission=AdminFilter())
+async def cache_info_handler(message: Message, user_context: UserContext) -> None:
     """Надсилає звіт про стан кешу у вигляді файлу."""
     user_id = message.from_user.id
-    is_owner = user_id == settings.OWNER_ID
+    is_owner = user_context.is_owner
     logger.info(
         "%s (ID: %d) запросив інформацію про кеш.",
         "Власник" if is_owner else "Адмін",
         user_id,
     )
 
-    now = time.time()
     info_parts = ["ℹ️ Поточний стан кешу:"]
-    info_parts.extend(_get_settings_cache_info(now))
-    info_parts.extend(_get_models_cache_info(now))
-    info_parts.extend(await _get_user_cache_info(now, is_owner))
+    info_parts.extend(_get_settings_cache_info())
+    info_parts.extend(_get_models_cache_info())
+    info_parts.extend(await _get_user_cache_info(is_owner))
+    info_parts.extend(_get_cache_stats_info())
 
     # Створюємо тимчасовий файл
     file_path = f"cache_info_{user_id}.txt"
@@ -173,33 +213,123 @@ async def cache_info_handler(message: Message) -> None:
             os.remove(file_path)
 
 
+# --- СТАН GEMINI API ---
+
+BREAKER_STATE_LABELS = {
+    "closed": "🟢 працює",
+    "half_open": "🟡 пробний запит",
+    "open": "🔴 вимкнено",
+}
+
+
+def _format_breakers(title: str, snapshots: List[Dict[str, Any]]) -> List[str]:
+    """Форматує стан запобіжників моделей або ключів."""
+    lines = [f"\n<b>{title}:</b>"]
+    if not snapshots:
+        lines.append("- Запитів ще не було")
+    for snapshot in snapshots:
+        line = (
+            f"- {snapshot['name']}: {BREAKER_STATE_LABELS[snapshot['state']]}, "
+            f"збоїв поспіль: {snapshot['failures']}, розмикань: {snapshot['trips']}"
+        )
+        if snapshot['remaining']:
+            line += f" (ще {round(snapshot['remaining'])} сек)"
+        lines.append(line)
+    return lines
+
+
+def _format_api_keys() -> List[str]:
+    """Форматує використання кожного ключа Gemini API."""
+    lines = ["\n<b>Ключі API:</b>"]
+    if not len(key_pool):
+        lines.append("- Ключів не налаштовано")
+    for snapshot in key_pool.snapshot():
+        line = (
+            f"- {snapshot['label']}: {BREAKER_STATE_LABELS[snapshot['state']]}, "
+            f"{snapshot['rpm']} запитів і {snapshot['tpm']} токенів за хвилину "
+            f"(усього {snapshot['requests']} / {snapshot['tokens']}), 429: {snapshot['rate_limited']}"
+        )
+        if snapshot['cooldown']:
+            line += f", поза ротацією ще {round(snapshot['cooldown'])} сек"
+        lines.append(line)
+    return lines
+
+
+def _format_latency() -> List[str]:
+    """Форматує перцентилі, гістограму затримок і поточний таймаут кожної моделі."""
+    lines = ["\n<b>Затримки відповідей:</b>"]
+    snapshots = latency_tracker.snapshot()
+    if not snapshots:
+        lines.append("- Замірів ще немає")
+    for snapshot in snapshots:
+        lines.append(
+            f"- {snapshot['model']}: p50 ≤{snapshot['p50']:.1f}с, p90 ≤{snapshot['p90']:.1f}с, "
+            f"p99 ≤{snapshot['p99']:.1f}с ({snapshot['samples']} замірів), "
+            f"таймаут {snapshot['timeout']:.0f}с"
+        )
+        buckets = ", ".join(f"≤{bound:.1f}с: {count}" for bound, count in snapshot['buckets'])
+        lines.append(f"  {buckets}")
+    return lines
+
+
+@buttons.button("🩺 Стан API", permission=AdminFilter())
+async def api_status_handler(message: Message) -> None:
+    """Показує стан запобіжників моделей і ключів Gemini API та навантаження."""
+    logger.info("Адмін (ID: %d) запросив стан Gemini API.", message.from_user.id)
+
+    stats = gemini_scheduler.stats()
+    lines = ["🩺 Стан Gemini API"]
+    lines.extend(_format_breakers("Моделі", model_health.breakers.snapshot()))
+    lines.extend(_format_api_keys())
+    lines.extend(_format_latency())
+    degraded = model_health.degraded()
+    if degraded:
+        lines.append(f"\nТимчасово в обхід: {', '.join(degraded)}")
+    lines.append(
+        f"\nЗапити: виконується {stats['running']}, у черзі {stats['queued']}, "
+        f"відхилено {stats['rejected']}"
+    )
+    hedges = hedge_budget.stats()
+    lines.append(
+        f"Додаткові запити: {hedges['spent']}/{hedges['limit']} за хвилину, "
+        f"усього {hedges['fired']}, з них швидші за основний: {hedges['won']}"
+    )
+    telegram = outbound_rate_limiter.stats()
+    lines.append(
+        f"Telegram: надіслано {telegram['sent']}, у черзі {telegram['queued']}, "
+        f"об'єднано редагувань {telegram['coalesced']}, відкинуто {telegram['dropped']}, "
+        f"повторів після RetryAfter {telegram['retried']}"
+    )
+    await message.answer("\n".join(lines))
+
+
 # --- НАВІГАЦІЯ АДМІН-ПАНЕЛІ ---
 
 
-@router.message(AdminFilter(), F.text == "👑 Адмін-панель")
-async def admin_panel_handler(message: Message) -> None:
+@buttons.button("👑 Адмін-панель", permission=AdminFilter())
+async def admin_panel_handler(message: Message, user_context: UserContext) -> None:
     """Обробляє кнопку 'Адмін-панель'."""
     logger.info("Адмін (ID: %d) увійшов в адмін-панель.", message.from_user.id)
-    is_owner = message.from_user.id == settings.OWNER_ID
-    await message.answer("Ви в адмін-панелі.", reply_markup=get_admin_menu(is_owner))
+    await message.answer("Ви в адмін-панелі.", reply_markup=get_admin_menu(user_context.is_owner))
 
 
-@router.message(AdminFilter(), F.text == "⬅️ Назад до адмін-панелі")
-async def back_to_admin_panel_handler(message: Message, state: FSMContext) -> None:
+@buttons.button("⬅️ Назад до адмін-панелі", permission=AdminFilter())
+async def back_to_admin_panel_handler(
+    message: Message, state: FSMContext, user_context: UserContext
+) -> None:
     """Повертає до головного меню адмін-панелі."""
     logger.info(
         "Адмін (ID: %d) повернувся до головного меню адмін-панелі.",
         message.from_user.id,
     )
     await state.clear()  # Очищуємо стан FSM
-    is_owner = message.from_user.id == settings.OWNER_ID
-    await message.answer("Ви в адмін-панелі.", reply_markup=get_admin_menu(is_owner))
+    await message.answer("Ви в адмін-панелі.", reply_markup=get_admin_menu(user_context.is_owner))
 
 
 # --- КЕРУВАННЯ МОДЕЛЛЮ AI ---
 
 
-@router.message(AdminFilter(), F.text == "🤖 Змінити модель AI")
+@buttons.button("🤖 Змінити модель AI", permission=AdminFilter())
 async def change_model_handler(message: Message) -> None:
     """Показує інлайн-клавіатуру для вибору моделі AI."""
     logger.info("Адмін (ID: %d) ініціював зміну моделі AI.", message.from_user.id)
@@ -250,11 +380,9 @@ async def set_model_callback_handler(callback: CallbackQuery) -> None:
 # --- КЕРУВАННЯ АДМІНАМИ (для власника) ---
 
 
-@router.message(OwnerFilter(), F.text == "👥 Редагувати адмінів")
+@buttons.button("👥 Редагувати адмінів", permission=OwnerFilter())
 async def manage_admins_handler(message: Message) -> None:
     """Показує меню керування адмінами."""
-    if message.from_user.id != settings.OWNER_ID:
-        return
     logger.info(
         "Власник (ID: %d) увійшов в меню керування адмінами.", message.from_user.id
     )
@@ -264,11 +392,9 @@ async def manage_admins_handler(message: Message) -> None:
     )
 
 
-@router.message(OwnerFilter(), F.text == "➕ Додати адміна")
+@buttons.button("➕ Додати адміна", permission=OwnerFilter())
 async def add_admin_start_handler(message: Message, state: FSMContext) -> None:
     """Запускає процес додавання нового адміна."""
-    if message.from_user.id != settings.OWNER_ID:
-        return
     logger.info(
         "Власник (ID: %d) ініціював додавання адміна.", message.from_user.id
     )
@@ -279,11 +405,9 @@ async def add_admin_start_handler(message: Message, state: FSMContext) -> None:
     )
 
 
-@router.message(OwnerFilter(), F.text == "➖ Видалити адміна")
+@buttons.button("➖ Видалити адміна", permission=OwnerFilter())
 async def remove_admin_start_handler(message: Message, state: FSMContext) -> None:
     """Запускає процес видалення адміна."""
-    if message.from_user.id != settings.OWNER_ID:
-        return
     logger.info(
         "Власник (ID: %d) ініціював видалення адміна.", message.from_user.id
     )
@@ -294,11 +418,9 @@ async def remove_admin_start_handler(message: Message, state: FSMContext) -> Non
     )
 
 
-@router.message(OwnerFilter(), F.text == "📋 Список адмінів")
+@buttons.button("📋 Список адмінів", permission=OwnerFilter())
 async def list_admins_handler(message: Message) -> None:
     """Показує список ID всіх адмінів."""
-    if message.from_user.id != settings.OWNER_ID:
-        return
     logger.info("Власник (ID: %d) запросив список адмінів.", message.from_user.id)
     admins = await list_admins()
     if not admins:
@@ -315,7 +437,9 @@ async def list_admins_handler(message: Message) -> None:
 
 
 @router.message(Command("cancel"))
-async def cancel_fsm_handler(message: Message, state: FSMContext) -> None:
+async def cancel_fsm_handler(
+    message: Message, state: FSMContext, user_context: UserContext
+) -> None:
     """Обробляє команду /cancel для виходу зі стану FSM."""
     current_state = await state.get_state()
     if current_state is None:
@@ -327,8 +451,7 @@ async def cancel_fsm_handler(message: Message, state: FSMContext) -> None:
         current_state,
     )
     await state.clear()
-    is_owner = message.from_user.id == settings.OWNER_ID
-    await message.answer("Дію скасовано.", reply_markup=get_admin_menu(is_owner))
+    await message.answer("Дію скасовано.", reply_markup=get_admin_menu(user_context.is_owner))
 
 
 @router.message(AdminActions.waiting_for_admin_to_add)
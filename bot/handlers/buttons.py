@@ -0,0 +1,75 @@
+"""Таблиця обробників кнопок меню.
+
+Кнопки reply-клавіатур надсилають фіксований текст, тому обробник
+знаходиться за точним текстом у словнику за O(1), а перевірка прав
+(AdminFilter, OwnerFilter) виконується лише для знайденої кнопки.
+Довільний текст не збігається з жодним ключем і одразу переходить до
+наступних роутерів, не проходячи фільтри кожної кнопки.
+
+Роутер цього модуля підключається першим.
+"""
+
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+
+from aiogram import Router
+from aiogram.dispatcher.event.handler import CallableObject
+from aiogram.filters import Filter
+from aiogram.types import Message
+
+from bot.core.logging_setup import get_logger
+
+logger = get_logger(__name__)
+
+# Обробник кнопки та перевірка прав (None — кнопка доступна всім)
+_Entry = Tuple[CallableObject, Optional[CallableObject]]
+
+
+class ButtonTable:
+    """Відповідність "текст кнопки → обробник" з перевіркою прав."""
+
+    def __init__(self):
+        self._entries: Dict[str, _Entry] = {}
+
+    def button(self, *texts: str, permission: Optional[Filter] = None) -> Callable:
+        """
+        Реєструє обробник для кнопок з указаними текстами.
+
+        Обробник отримує ті самі аргументи, що й звичайний обробник aiogram
+        (message, state, user_context, bot тощо), і повертається без змін.
+
+        Args:
+            texts: Точні тексти кнопок
+            permission: Фільтр прав, який виконується лише для цих кнопок
+        """
+        def decorator(handler: Callable) -> Callable:
+            entry = (CallableObject(handler), CallableObject(permission) if permission else None)
+            for text in texts:
+                if text in self._entries:
+                    raise ValueError(f"Кнопка {text!r} вже зареєстрована")
+                self._entries[text] = entry
+            return handler
+
+        return decorator
+
+    def __contains__(self, text: str) -> bool:
+        return text in self._entries
+
+    async def match(self, message: Message, **data: Any) -> Union[bool, Dict[str, Any]]:
+        """Знаходить обробник кнопки; False — це не кнопка або бракує прав."""
+        entry = self._entries.get(message.text) if message.text else None
+        if entry is None:
+            return False
+        handler, permission = entry
+        if permission is not None and not await permission.call(message, **data):
+            return False
+        return {"button": handler}
+
+
+buttons = ButtonTable()
+router = Router()
+
+
+@router.message(buttons.match)
+async def dispatch_button(message: Message, button: CallableObject, **data: Any) -> Any:
+    """Викликає обробник натиснутої кнопки."""
+    return await button.call(message, **data)
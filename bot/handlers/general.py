@@ -1,15 +1,18 @@
 """Головний модуль обробки повідомлень та команд."""
 
 from aiogram import Bot, F, Router
-from aiogram.enums.chat_action import ChatAction
 from aiogram.filters import CommandStart
 from aiogram.types import Message
 
-from bot.db.user_settings import register_user_if_not_exists
+from bot.config import runtime_config
+from bot.db.user_settings import UserContext
+from bot.handlers.buttons import buttons
 from bot.presentation.keyboards.reply import get_main_menu, get_settings_menu
 from bot.presentation.message_utils import send_long_message
-from bot.presentation.status_messages import delete_status, send_status, update_status
+from bot.presentation.status_messages import DeferredStatus
+from bot.presentation.streaming import STREAM_INTERRUPTED_NOTICE, StreamingReply
 from bot.services.gemini import GeminiService
+from bot.services.user_turns import user_turns
 from bot.core.logging_setup import get_logger
 
 router = Router()
@@ -17,46 +20,39 @@ logger = get_logger(__name__)
 
 
 @router.message(CommandStart())
-async def command_start_handler(message: Message) -> None:
+async def command_start_handler(message: Message, user_context: UserContext) -> None:
     """Обробляє команду /start."""
-    await register_user_if_not_exists(message.from_user)
-
     user_id = message.from_user.id
     user_name = message.from_user.full_name
     logger.info("Користувач %s (ID: %d) запустив бота.", user_name, user_id)
 
     await message.answer(
         f"Привіт, {user_name}!",
-        reply_markup=await get_main_menu(user_id=user_id),
+        reply_markup=await get_main_menu(user_context=user_context),
     )
 
 
-@router.message(F.text == "⚙️ Налаштування")
+@buttons.button("⚙️ Налаштування")
 async def settings_handler(message: Message) -> None:
     """Обробляє кнопку 'Налаштування'."""
-    await register_user_if_not_exists(message.from_user)
     logger.info("Користувач (ID: %d) перейшов до налаштувань.", message.from_user.id)
     await message.answer("Меню налаштувань:", reply_markup=get_settings_menu())
 
 
-@router.message(F.text == "⬅️ Назад до головного меню")
-async def back_to_main_menu_handler(message: Message) -> None:
+@buttons.button("⬅️ Назад до головного меню")
+async def back_to_main_menu_handler(message: Message, user_context: UserContext) -> None:
     """Обробляє кнопку 'Назад до головного меню'."""
-    await register_user_if_not_exists(message.from_user)
     user_id = message.from_user.id
     logger.info("Користувач (ID: %d) повернувся до головного меню.", user_id)
     await message.answer(
-        "Головне меню:", reply_markup=await get_main_menu(user_id=user_id)
+        "Головне меню:", reply_markup=await get_main_menu(user_context=user_context)
     )
 
 
 @router.message(F.text)
 async def text_message_handler(message: Message, bot: Bot) -> None:
     """Обробляє всі текстові повідомлення."""
-    await register_user_if_not_exists(message.from_user)
-
     user_id = message.from_user.id
-    prompt = message.text
 
     logger.info(
         "Користувач %s (ID: %d) надіслав текстовий запит.",
@@ -64,19 +60,38 @@ async def text_message_handler(message: Message, bot: Bot) -> None:
         user_id,
     )
 
-    status_msg = None
-    try:
-        # Відправляємо статус-повідомлення
-        status_msg = await send_status(message, "Генерація відповіді.")
-
-        await bot.send_chat_action(chat_id=user_id, action=ChatAction.TYPING)
-        gemini_service = GeminiService(user_id=user_id, bot=bot)
-        response_text = await gemini_service.generate_text_response(prompt)
+    # Відповіді одному користувачу генеруються по черзі; близькі за часом
+    # повідомлення об'єднуються в один запит
+    async with user_turns.turn(user_id, message.text) as prompt:
+        if prompt is None:
+            return
+        await _answer_prompt(message, bot, prompt)
 
-        # Оновлюємо статус перед надсиланням
-        await update_status(status_msg, "Відповідь отримана. Надсилання.")
 
-        await send_long_message(message, response_text)
+async def _answer_prompt(message: Message, bot: Bot, prompt: str) -> None:
+    """Генерує відповідь моделі на запит та надсилає її користувачу."""
+    user_id = message.from_user.id
+    try:
+        # Статус з'являється лише для довгих запитів і стає першою частиною відповіді
+        async with DeferredStatus(message, bot, "Генерація відповіді.") as status:
+            gemini_service = GeminiService(user_id=user_id, bot=bot)
+
+            if runtime_config.STREAM_RESPONSES:
+                # Редагування йдуть у фоні, щоб не утримувати слот планувальника Gemini
+                reply = StreamingReply(message, claim=status.claim)
+                try:
+                    response_text = await gemini_service.generate_text_response_stream(
+                        prompt, reply.push
+                    )
+                except Exception:
+                    reply.cancel()
+                    raise
+                if gemini_service.stream_interrupted:
+                    response_text = f"{response_text}\n\n{STREAM_INTERRUPTED_NOTICE}"
+                await reply.finish(response_text)
+            else:
+                response_text = await gemini_service.generate_text_response(prompt)
+                await send_long_message(message, response_text, edit=await status.claim())
         logger.info("Надіслано відповідь від Gemini для користувача (ID: %d).", user_id)
 
     except Exception:
@@ -86,7 +101,3 @@ async def text_message_handler(message: Message, bot: Bot) -> None:
         await message.answer(
             "Виникла помилка під час обробки вашого запиту. Спробуйте пізніше."
         )
-    finally:
-        # Видаляємо статус-повідомлення після завершення
-        if status_msg:
-            await delete_status(status_msg)
@@ -1,24 +1,23 @@
 """Обробники для меню налаштувань."""
 
-from aiogram import F, Router
+from aiogram import Router
 from aiogram.types import Message
 
 from bot.db.user_settings import (
     clear_user_context,
-    register_user_if_not_exists,
     update_user_tts_enabled,
     update_user_tts_voice,
 )
+from bot.handlers.buttons import buttons
 from bot.core.logging_setup import get_logger
 
 router = Router()
 logger = get_logger(__name__)
 
 
-@router.message(F.text.startswith("🗣️ Голос"))
+@buttons.button("🗣️ Голос (Чоловічий)", "🗣️ Голос (Жіночий)")
 async def change_voice_handler(message: Message) -> None:
     """Обробляє кнопки зміни голосу TTS."""
-    await register_user_if_not_exists(message.from_user)
     user_id = message.from_user.id
 
     new_voice = "male" if message.text == "🗣️ Голос (Чоловічий)" else "female"
@@ -29,10 +28,9 @@ async def change_voice_handler(message: Message) -> None:
     await message.answer(f"Голос змінено на {display_voice}.")
 
 
-@router.message(F.text.startswith(("✅ Увімкнути TTS", "❌ Вимкнути TTS")))
+@buttons.button("✅ Увімкнути TTS", "❌ Вимкнути TTS")
 async def toggle_tts_handler(message: Message) -> None:
     """Обробляє кнопки увімкнення/вимкнення TTS."""
-    await register_user_if_not_exists(message.from_user)
     user_id = message.from_user.id
 
     new_status = message.text == "✅ Увімкнути TTS"
@@ -44,10 +42,9 @@ async def toggle_tts_handler(message: Message) -> None:
     await message.answer(f"TTS {display_status}.")
 
 
-@router.message(F.text == "🗑️ Очистити контекст")
+@buttons.button("🗑️ Очистити контекст")
 async def clear_context_handler(message: Message) -> None:
     """Обробляє кнопку очищення контексту."""
-    await register_user_if_not_exists(message.from_user)
     user_id = message.from_user.id
 
     await clear_user_context(user_id)
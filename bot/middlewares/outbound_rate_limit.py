@@ -0,0 +1,304 @@
+"""Планувальник вихідних запитів до Telegram Bot API.
+
+Реєструється як request-middleware сесії бота, тож через нього проходять
+усі надсилання, редагування, видалення та індикатори "друкує...".
+Швидкість обмежується відрами токенів — загальним і окремим для кожного
+чату, — а черга поділена на смуги пріоритету:
+
+- відповіді (надсилання повідомлень і файлів) йдуть першими;
+- редагування одного повідомлення об'єднуються: в черзі лишається лише
+  найновіший текст;
+- індикатори дії та видалення йдуть останніми, а застарілі індикатори
+  відкидаються.
+
+Після TelegramRetryAfter чат призупиняється на вказаний час, а запит
+повторюється автоматично.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Hashable, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+
+from bot.config import runtime_config
+from bot.core.logging_setup import get_logger
+
+logger = get_logger(__name__)
+
+# Смуги пріоритету: менше значення — вищий пріоритет
+LANE_ANSWER = 0
+LANE_EDIT = 1
+LANE_BACKGROUND = 2
+
+EDIT_METHODS = frozenset({"editMessageText", "editMessageCaption", "editMessageReplyMarkup"})
+BACKGROUND_METHODS = frozenset({"sendChatAction", "deleteMessage"})
+
+# Скільки відер чатів зберігати, перш ніж прибрати повні (неактивні)
+CHAT_BUCKETS_PRUNE_THRESHOLD = 10_000
+
+
+class TokenBucket:
+    """Відро токенів: `rate` токенів на секунду, не більше `capacity`."""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'blocked_until')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def ready_at(self, now: float) -> float:
+        """Момент, коли в відрі буде токен (now — якщо вже є)."""
+        self._refill(now)
+        ready = now if self.tokens >= 1 else now + (1 - self.tokens) / self.rate
+        return max(ready, self.blocked_until)
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, until: float):
+        """Призупиняє відро до вказаного моменту (TelegramRetryAfter)."""
+        self.blocked_until = max(self.blocked_until, until)
+        self.tokens = min(self.tokens, 0)
+
+    def is_idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+
+class _Request:
+    """Запит, що чекає своєї черги на надсилання."""
+
+    __slots__ = ('chat_id', 'lane', 'key', 'future', 'enqueued_at')
+
+    def __init__(self, chat_id: Hashable, lane: int, key: Optional[Hashable], future: asyncio.Future):
+        self.chat_id = chat_id
+        self.lane = lane
+        self.key = key
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+def _classify(api_method: str, method: TelegramMethod) -> Tuple[int, Optional[Hashable]]:
+    """Повертає смугу запиту та ключ об'єднання (None — не об'єднується)."""
+    chat_id = getattr(method, "chat_id", None)
+    if api_method in EDIT_METHODS:
+        return LANE_EDIT, (api_method, chat_id, getattr(method, "message_id", None))
+    if api_method == "sendChatAction":
+        return LANE_BACKGROUND, (api_method, chat_id)
+    if api_method in BACKGROUND_METHODS:
+        return LANE_BACKGROUND, None
+    return LANE_ANSWER, None
+
+
+class OutboundRateLimiter(BaseRequestMiddleware):
+    """Обмежує швидкість вихідних запитів бота до лімітів Telegram."""
+
+    def __init__(
+        self,
+        global_rate: float,
+        chat_rate: float,
+        chat_burst: float,
+        group_rate: float,
+        retry_attempts: int,
+        chat_action_max_age: float,
+    ):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.retry_attempts = retry_attempts
+        self.chat_action_max_age = chat_action_max_age
+
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: Dict[Hashable, TokenBucket] = {}
+        self._lanes: List[Deque[_Request]] = [deque(), deque(), deque()]
+        self._by_key: Dict[Hashable, _Request] = {}
+        self._wakeup = asyncio.Event()
+        self._worker: Optional[asyncio.Task] = None
+
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.retried = 0
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType,
+        bot: Bot,
+        method: TelegramMethod,
+    ) -> Any:
+        api_method = method.__api_method__
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or api_method.startswith("get"):
+            return await make_request(bot, method)
+
+        lane, key = _classify(api_method, method)
+        for attempt in range(self.retry_attempts + 1):
+            if not await self._acquire(chat_id, lane, key):
+                # Запит замінено новішим редагуванням або відкинуто як застарілий
+                return True
+            try:
+                result = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt >= self.retry_attempts:
+                    raise
+                self.retried += 1
+                logger.warning(
+                    "Telegram попросив зачекати %d сек (%s, чат %s), повторюємо автоматично.",
+                    e.retry_after,
+                    api_method,
+                    chat_id,
+                )
+                self._chat_bucket(chat_id).block(time.monotonic() + e.retry_after)
+                continue
+            self.sent += 1
+            return result
+
+    def _chat_bucket(self, chat_id: Hashable) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= CHAT_BUCKETS_PRUNE_THRESHOLD:
+                self._prune_chat_buckets()
+            # Від'ємний ідентифікатор — група або канал з нижчим лімітом
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            rate = self.group_rate if is_group else self.chat_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, self.chat_burst)
+        return bucket
+
+    def _prune_chat_buckets(self):
+        now = time.monotonic()
+        waiting = {request.chat_id for lane in self._lanes for request in lane}
+        for chat_id in [c for c, b in self._chats.items() if c not in waiting and b.is_idle(now)]:
+            del self._chats[chat_id]
+
+    async def _acquire(self, chat_id: Hashable, lane: int, key: Optional[Hashable]) -> bool:
+        """Чекає дозволу на надсилання; False — запит більше не потрібно надсилати."""
+        now = time.monotonic()
+        chat_bucket = self._chat_bucket(chat_id)
+        if (
+            not any(self._lanes)
+            and self._global.ready_at(now) <= now
+            and chat_bucket.ready_at(now) <= now
+        ):
+            self._global.take(now)
+            chat_bucket.take(now)
+            return True
+
+        future = asyncio.get_running_loop().create_future()
+        pending = self._by_key.get(key) if key is not None else None
+        if pending is not None:
+            # Новіший вміст займає місце в черзі попереднього запиту
+            pending.future.set_result(False)
+            pending.future = future
+            self.coalesced += 1
+            request = pending
+        else:
+            request = _Request(chat_id, lane, key, future)
+            self._lanes[lane].append(request)
+            if key is not None:
+                self._by_key[key] = request
+        self._wake()
+
+        try:
+            return await future
+        except asyncio.CancelledError:
+            if request.future is future:
+                self._remove(request)
+            raise
+
+    def _remove(self, request: _Request):
+        lane = self._lanes[request.lane]
+        if request in lane:
+            lane.remove(request)
+        if request.key is not None and self._by_key.get(request.key) is request:
+            del self._by_key[request.key]
+
+    def _wake(self):
+        self._wakeup.set()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run(), name="telegram-outbound")
+
+    def _next_grantable(self, now: float) -> Tuple[Optional[_Request], float]:
+        """Знаходить запит з найвищим пріоритетом, чий чат готовий, або час очікування."""
+        earliest = float("inf")
+        for lane in self._lanes:
+            for request in list(lane):
+                if request.future.done():
+                    self._remove(request)
+                    continue
+                if (
+                    request.lane == LANE_BACKGROUND
+                    and request.key is not None
+                    and now - request.enqueued_at > self.chat_action_max_age
+                ):
+                    self._remove(request)
+                    request.future.set_result(False)
+                    self.dropped += 1
+                    continue
+                ready_at = self._chat_bucket(request.chat_id).ready_at(now)
+                if ready_at <= now:
+                    return request, now
+                earliest = min(earliest, ready_at)
+        return None, earliest
+
+    async def _run(self):
+        """Видає дозволи на надсилання в порядку пріоритету, доки черга не спорожніє."""
+        while any(self._lanes):
+            self._wakeup.clear()
+            now = time.monotonic()
+            global_ready = self._global.ready_at(now)
+            if global_ready > now:
+                await self._sleep_until(global_ready)
+                continue
+
+            request, ready_at = self._next_grantable(now)
+            if request is None:
+                if any(self._lanes):
+                    await self._sleep_until(ready_at)
+                continue
+
+            self._remove(request)
+            self._global.take(now)
+            self._chat_bucket(request.chat_id).take(now)
+            request.future.set_result(True)
+        self._worker = None
+
+    async def _sleep_until(self, moment: float):
+        """Чекає до моменту або до появи нового запиту в черзі."""
+        timeout = None if moment == float("inf") else max(0.0, moment - time.monotonic())
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": sum(len(lane) for lane in self._lanes),
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+            "retried": self.retried,
+        }
+
+
+outbound_rate_limiter = OutboundRateLimiter(
+    global_rate=runtime_config.TG_GLOBAL_RATE,
+    chat_rate=runtime_config.TG_CHAT_RATE,
+    chat_burst=runtime_config.TG_CHAT_BURST,
+    group_rate=runtime_config.TG_GROUP_RATE,
+    retry_attempts=runtime_config.TG_RETRY_AFTER_ATTEMPTS,
+    chat_action_max_age=runtime_config.TG_CHAT_ACTION_MAX_AGE,
+)
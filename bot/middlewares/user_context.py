@@ -0,0 +1,31 @@
+"""Middleware, що визначає користувача та його роль один раз на оновлення."""
+
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, User
+
+from bot.db.user_settings import resolve_user_context
+from bot.core.logging_setup import get_logger
+
+logger = get_logger(__name__)
+
+
+class UserContextMiddleware(BaseMiddleware):
+    """Додає до даних обробника `user_context` (роль, налаштування TTS).
+
+    Реєструється як outer-middleware, тому виконується до фільтрів роутерів:
+    AdminFilter, клавіатури та обробники читають готовий об'єкт замість
+    повторних звернень до кешу чи БД.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        tg_user: User | None = data.get("event_from_user")
+        if tg_user is not None and not tg_user.is_bot:
+            data["user_context"] = await resolve_user_context(tg_user)
+        return await handler(event, data)
@@ -0,0 +1,296 @@
+"""
+Перетворення відповідей моделі на HTML Telegram та розбиття на повідомлення.
+
+Бот працює з ParseMode.HTML, а Gemini відповідає у Markdown. markdown_to_html
+екранує спецсимволи і переводить основну розмітку (жирний, курсив,
+закреслений, код, посилання, заголовки, списки, цитати) у теги, які
+підтримує Telegram. split_html за один прохід ділить HTML на частини,
+довжина яких рахується так само, як це робить Telegram: у кодових одиницях
+UTF-16 видимого тексту (теги не враховуються, сутність — один символ).
+Теги, відкриті на межі частини, закриваються в ній і повторно
+відкриваються в наступній, тож кожна частина — коректний HTML.
+"""
+
+import html
+import re
+from typing import List, Optional, Tuple
+
+# Telegram message length limit
+MAX_MESSAGE_LENGTH = 4096
+
+# --- Markdown → HTML ---
+
+_FENCE_RE = re.compile(r"^[ \t]*```[ \t]*([\w+#.-]*)[^\n]*\n(.*?)^[ \t]*```[ \t]*$", re.M | re.S)
+_HEADING_RE = re.compile(r"^#{1,6}[ \t]+(.+?)[ \t]*#*[ \t]*$")
+_BULLET_RE = re.compile(r"^([ \t]*)[*+-][ \t]+")
+_INLINE_RE = re.compile(
+    r"`([^`\n]+)`"
+    r"|\*\*(?=\S)([^\n]+?)(?<=\S)\*\*"
+    r"|__(?=\S)([^\n]+?)(?<=\S)__"
+    r"|~~(?=\S)([^\n]+?)(?<=\S)~~"
+    r"|(?<![\w*])\*(?=[^\s*])([^*\n]+?)(?<=\S)\*(?![\w*])"
+    r"|(?<![\w_])_(?=[^\s_])([^_\n]+?)(?<=\S)_(?![\w_])"
+    r"|\[([^\]\n]+)\]\((https?://[^\s)\"]+)\)"
+)
+_TAG_RE = re.compile(r"<[^<>]*>")
+_INLINE_TAGS = {2: "b", 3: "b", 4: "s", 5: "i", 6: "i"}
+
+
+def _escape(text: str) -> str:
+    return html.escape(text, quote=False)
+
+
+def _inline(text: str) -> str:
+    """Перетворює рядкову розмітку; `text` ще не екранований."""
+    out = []
+    pos = 0
+    for match in _INLINE_RE.finditer(text):
+        out.append(_escape(text[pos:match.start()]))
+        pos = match.end()
+        group = match.lastindex
+        if group == 1:
+            out.append(f"<code>{_escape(match.group(1))}</code>")
+        elif group in _INLINE_TAGS:
+            tag = _INLINE_TAGS[group]
+            out.append(f"<{tag}>{_inline(match.group(group))}</{tag}>")
+        else:
+            url = html.escape(match.group(8))
+            out.append(f'<a href="{url}">{_inline(match.group(7))}</a>')
+    out.append(_escape(text[pos:]))
+    return "".join(out)
+
+
+def _blocks(text: str, out: List[str]) -> None:
+    """Перетворює рядки поза блоками коду: заголовки, списки, цитати."""
+    quote: List[str] = []
+    for line in text.split("\n"):
+        if line.startswith(">"):
+            quote.append(_inline(line[1:].lstrip(" ")))
+            continue
+        if quote:
+            out.append("<blockquote>" + "\n".join(quote) + "</blockquote>\n")
+            quote = []
+        heading = _HEADING_RE.match(line)
+        if heading:
+            out.append(f"<b>{_inline(heading.group(1))}</b>\n")
+            continue
+        bullet = _BULLET_RE.match(line)
+        if bullet:
+            line = f"{bullet.group(1)}• {line[bullet.end():]}"
+        out.append(_inline(line) + "\n")
+    if quote:
+        out.append("<blockquote>" + "\n".join(quote) + "</blockquote>\n")
+
+
+def markdown_to_html(text: str) -> str:
+    """
+    Перетворює Markdown відповіді моделі на HTML, який приймає Telegram.
+
+    Args:
+        text: Текст у Markdown
+
+    Returns:
+        str: Текст з екранованими спецсимволами та тегами Telegram
+    """
+    out: List[str] = []
+    pos = 0
+    for fence in _FENCE_RE.finditer(text):
+        if fence.start() > pos:
+            # Без переносу рядка перед блоком коду — його додає _blocks
+            _blocks(text[pos:fence.start() - 1], out)
+        code = _escape(fence.group(2).rstrip("\n"))
+        language = fence.group(1)
+        if language:
+            out.append(f'<pre><code class="language-{_escape(language)}">{code}</code></pre>\n')
+        else:
+            out.append(f"<pre>{code}</pre>\n")
+        pos = fence.end() + 1
+    if pos <= len(text):
+        _blocks(text[pos:], out)
+    # Кожен блок закінчується переносом рядка — останній зайвий
+    result = "".join(out)
+    return result[:-1] if result.endswith("\n") else result
+
+
+def html_to_text(text: str) -> str:
+    """Прибирає теги та розкриває сутності — запасний варіант без розмітки."""
+    return html.unescape(_TAG_RE.sub("", text))
+
+
+# --- Розбиття HTML на повідомлення ---
+
+_TOKEN_RE = re.compile(r"<[^<>]*>|&(?:#\d+|#x[0-9a-fA-F]+|[a-zA-Z]+);")
+_TAG_NAME_RE = re.compile(r"</?\s*([a-zA-Z][a-zA-Z0-9-]*)")
+# Усередині цих тегів пробіли на початку частини значущі
+_PREFORMATTED = frozenset({"pre", "code"})
+
+_TEXT, _TAG, _ENTITY = 0, 1, 2
+
+# Відкриті теги: (назва, відкривальний тег); кортеж, щоб знімок стану був O(1)
+_Stack = Tuple[Tuple[str, str], ...]
+
+
+def utf16_len(text: str) -> int:
+    """Довжина тексту в кодових одиницях UTF-16, як її рахує Telegram."""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def fit_utf16(text: str, room: int) -> int:
+    """Скільки перших символів `text` вміщуються в `room` одиниць UTF-16."""
+    used = 0
+    for index, char in enumerate(text):
+        used += 2 if ord(char) > 0xFFFF else 1
+        if used > room:
+            return index
+    return len(text)
+
+
+def _tokenize(text: str) -> List[Tuple[int, int, int]]:
+    """Ділить HTML на відрізки (початок, кінець, тип): текст, теги та сутності."""
+    tokens = []
+    pos = 0
+    for match in _TOKEN_RE.finditer(text):
+        if match.start() > pos:
+            tokens.append((pos, match.start(), _TEXT))
+        tokens.append((match.start(), match.end(), _TAG if text[match.start()] == "<" else _ENTITY))
+        pos = match.end()
+    if pos < len(text):
+        tokens.append((pos, len(text), _TEXT))
+    return tokens
+
+
+def _apply_tag(stack: _Stack, tag: str) -> _Stack:
+    """Повертає стек відкритих тегів після тегу `tag`."""
+    match = _TAG_NAME_RE.match(tag)
+    if match is None:
+        return stack
+    name = match.group(1).lower()
+    if not tag.startswith("</"):
+        return stack + ((name, tag),)
+    for depth in range(len(stack) - 1, -1, -1):
+        if stack[depth][0] == name:
+            return stack[:depth]
+    return stack
+
+
+def _close(stack: _Stack) -> str:
+    return "".join(f"</{name}>" for name, _ in reversed(stack))
+
+
+def _reopen(stack: _Stack) -> str:
+    return "".join(tag for _, tag in stack)
+
+
+class _Break:
+    """Місце, де можна розрізати текст: символ-роздільник за позицією `pos` відкидається."""
+
+    __slots__ = ('pos', 'token', 'stack')
+
+    def __init__(self, pos: int, token: int, stack: _Stack):
+        self.pos = pos
+        self.token = token
+        self.stack = stack
+
+
+def split_html(text: str, limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """
+    Ділить HTML на частини, що вміщуються в одне повідомлення Telegram.
+
+    Частина закінчується на останньому переносі рядка перед лімітом, інакше
+    на останньому пробілі, інакше точно на ліміті. Час роботи лінійний:
+    текст переглядається за один прохід, а після розрізу повторно
+    переглядається лише залишок поточної частини.
+
+    Args:
+        text: HTML з тегами Telegram
+        limit: Максимальна довжина частини в одиницях UTF-16 видимого тексту
+
+    Returns:
+        List[str]: Частини зі збалансованими тегами
+    """
+    tokens = _tokenize(text)
+    parts: List[str] = []
+    stack: _Stack = ()
+    prefix = ""  # Теги, повторно відкриті на початку поточної частини
+    chunk_start = 0
+    units = 0
+    newline: Optional[_Break] = None
+    space: Optional[_Break] = None
+
+    index = 0
+    pos = 0
+    while index < len(tokens):
+        start, end, kind = tokens[index]
+        pos = max(pos, start)
+
+        if kind == _TAG:
+            stack = _apply_tag(stack, text[start:end])
+            pos = end
+            index += 1
+            continue
+
+        if kind == _ENTITY:
+            # Лише числова сутність може позначати символ поза BMP
+            size = utf16_len(html.unescape(text[start:end])) if text[start + 1] == "#" else 1
+            if units + size <= limit or units == 0:
+                units += size
+                pos = end
+                index += 1
+                continue
+            cut_end = pos
+        else:
+            room = limit - units
+            segment_end = min(end, pos + room)
+            segment = text[pos:segment_end]
+            size = utf16_len(segment)
+            if size > room:
+                segment_end = pos + fit_utf16(segment, room)
+            if segment_end == end:
+                # Увесь залишок текстового відрізка вміщується
+                newline = _last_break(text, "\n", pos, end, index, stack) or newline
+                if newline is None:
+                    # Пробіл потрібен, лише доки в частині немає переносу рядка
+                    space = _last_break(text, " ", pos, end, index, stack) or space
+                units += size
+                pos = end
+                index += 1
+                continue
+            if segment_end == pos and units == 0:
+                segment_end = pos + 1  # Символ ширший за ліміт — надсилаємо як є
+            # Символ одразу за лімітом теж може бути роздільником
+            newline = _last_break(text, "\n", pos, segment_end + 1, index, stack) or newline
+            space = _last_break(text, " ", pos, segment_end + 1, index, stack) or space
+            cut_end = segment_end
+
+        best = newline or space
+        if best is not None and best.pos > chunk_start:
+            body_end, resume, cut_stack, index = best.pos, best.pos + 1, best.stack, best.token
+        else:
+            body_end, resume, cut_stack = cut_end, cut_end, stack
+        body = text[chunk_start:body_end]
+        if _TAG_RE.sub("", body).strip():
+            parts.append(prefix + body + _close(cut_stack))
+
+        # Наступна частина починається з тих самих відкритих тегів
+        stack = cut_stack
+        prefix = _reopen(stack)
+        if not any(name in _PREFORMATTED for name, _ in stack):
+            while resume < len(text) and text[resume] in " \t\n":
+                resume += 1
+        chunk_start = pos = resume
+        while index < len(tokens) and tokens[index][1] <= pos:
+            index += 1
+        units = 0
+        newline = space = None
+
+    body = text[chunk_start:]
+    if _TAG_RE.sub("", body).strip() or not parts:
+        parts.append(prefix + body + _close(stack))
+    return parts
+
+
+def _last_break(
+    text: str, separator: str, start: int, end: int, token: int, stack: _Stack
+) -> Optional[_Break]:
+    position = text.rfind(separator, start, end)
+    return _Break(position, token, stack) if position >= 0 else None
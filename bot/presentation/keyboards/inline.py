@@ -1,14 +1,26 @@
 """Модуль для створення інлайн-клавіатур."""
 
+from typing import Hashable, Optional, Tuple
+
 from aiogram.types import InlineKeyboardMarkup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
+from bot.db import cache
+
+# Остання побудована клавіатура вибору моделі: (ключ, клавіатура).
+# Ключ містить лічильники інвалідацій кешів моделей і налаштувань, тож
+# invalidate_models_cache та set_setting скидають її.
+_model_keyboard: Optional[Tuple[Hashable, InlineKeyboardMarkup]] = None
+
 
 def get_model_selection_keyboard(
     models: list[str], current_model: str
 ) -> InlineKeyboardMarkup:
     """
-    Створює динамічну інлайн-клавіатуру для вибору моделі AI.
+    Повертає інлайн-клавіатуру для вибору моделі AI.
+
+    Клавіатура будується заново лише тоді, коли змінився список моделей
+    або поточна модель; повернутий об'єкт не можна змінювати.
 
     Args:
         models: Список доступних імен моделей.
@@ -17,6 +29,16 @@ def get_model_selection_keyboard(
     Returns:
         Інлайн-клавіатура для вибору моделі.
     """
+    global _model_keyboard
+    key = (
+        cache.models_cache.generation,
+        cache.settings_cache.generation,
+        tuple(models),
+        current_model,
+    )
+    if _model_keyboard is not None and _model_keyboard[0] == key:
+        return _model_keyboard[1]
+
     builder = InlineKeyboardBuilder()
     for model_name in models:
         text = model_name.replace("models/", "")
@@ -26,4 +48,6 @@ def get_model_selection_keyboard(
         builder.button(text=text, callback_data=f"set_model:{model_name}")
 
     builder.adjust(1)
-    return builder.as_markup()
+    markup = builder.as_markup()
+    _model_keyboard = (key, markup)
+    return markup
@@ -1,70 +1,81 @@
-"""Модуль для створення reply-клавіатур."""
+"""Модуль для створення reply-клавіатур.
 
-from typing import Optional
+Клавіатури не залежать від користувача, окрім ролі, тому всі варіанти
+будуються один раз під час імпорту, а функції повертають готові об'єкти.
+Повернуті клавіатури спільні для всіх викликів — їх не можна змінювати.
+"""
+
+from typing import List, Optional
 
 from aiogram.types import KeyboardButton, ReplyKeyboardMarkup
 
 from bot.db.admin_store import is_admin
+from bot.db.user_settings import UserContext
+
+
+def _markup(rows: List[List[str]]) -> ReplyKeyboardMarkup:
+    """Будує клавіатуру з рядків текстів кнопок."""
+    keyboard = [[KeyboardButton(text=text) for text in row] for row in rows]
+    return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
+
+
+_MAIN_MENU_ROWS = [
+    ["⚙️ Налаштування"],
+]
+# Для адміна кнопка адмін-панелі стоїть на початку
+_MAIN_MENU = _markup(_MAIN_MENU_ROWS)
+_MAIN_MENU_ADMIN = _markup([["👑 Адмін-панель"], *_MAIN_MENU_ROWS])
+
+_SETTINGS_MENU = _markup([
+    ["🗣️ Голос (Чоловічий)", "🗣️ Голос (Жіночий)"],
+    ["✅ Увімкнути TTS", "❌ Вимкнути TTS"],
+    ["🗑️ Очистити контекст"],
+    ["⬅️ Назад до головного меню"],
+])
+
+_ADMIN_MENU_ROWS = [
+    ["🤖 Змінити модель AI", "ℹ️ Інфо про кеш"],
+    ["🩺 Стан API"],
+    ["⬅️ Назад до головного меню"],
+]
+_ADMIN_MENU = _markup(_ADMIN_MENU_ROWS)
+# Для власника кнопка "Редагувати адмінів" стоїть на другій позиції
+_ADMIN_MENU_OWNER = _markup([_ADMIN_MENU_ROWS[0], ["👥 Редагувати адмінів"], *_ADMIN_MENU_ROWS[1:]])
 
+_ADMIN_MANAGEMENT_KEYBOARD = _markup([
+    ["➕ Додати адміна", "➖ Видалити адміна"],
+    ["📋 Список адмінів"],
+    ["⬅️ Назад до адмін-панелі"],
+])
 
-async def get_main_menu(user_id: Optional[int] = None) -> ReplyKeyboardMarkup:
+
+async def get_main_menu(
+    user_id: Optional[int] = None, user_context: Optional[UserContext] = None
+) -> ReplyKeyboardMarkup:
     """
     Повертає клавіатуру головного меню.
 
-    Додає кнопку адмін-панелі, якщо користувач є адміном.
+    Додає кнопку адмін-панелі, якщо користувач є адміном. Якщо передано
+    `user_context`, роль береться з нього без звернення до кешу чи БД.
     """
-    keyboard = [
-        [KeyboardButton(text="⚙️ Налаштування")],
-    ]
-
-    if user_id and await is_admin(user_id):
-        # Вставляємо кнопку адмін-панелі на початок
-        keyboard.insert(0, [KeyboardButton(text="👑 Адмін-панель")])
+    if user_context is not None:
+        show_admin_panel = user_context.is_admin
+    else:
+        show_admin_panel = bool(user_id) and await is_admin(user_id)
 
-    return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
+    return _MAIN_MENU_ADMIN if show_admin_panel else _MAIN_MENU
 
 
 def get_settings_menu() -> ReplyKeyboardMarkup:
     """Повертає клавіатуру меню налаштувань."""
-    keyboard = [
-        [
-            KeyboardButton(text="🗣️ Голос (Чоловічий)"),
-            KeyboardButton(text="🗣️ Голос (Жіночий)"),
-        ],
-        [
-            KeyboardButton(text="✅ Увімкнути TTS"),
-            KeyboardButton(text="❌ Вимкнути TTS"),
-        ],
-        [KeyboardButton(text="🗑️ Очистити контекст")],
-        [KeyboardButton(text="⬅️ Назад до головного меню")],
-    ]
-    return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
+    return _SETTINGS_MENU
 
 
 def get_admin_menu(is_owner: bool) -> ReplyKeyboardMarkup:
     """Повертає клавіатуру адмін-панелі."""
-    keyboard = [
-        [
-            KeyboardButton(text="🤖 Змінити модель AI"),
-            KeyboardButton(text="ℹ️ Інфо про кеш"),
-        ],
-        [KeyboardButton(text="⬅️ Назад до головного меню")],
-    ]
-    if is_owner:
-        # Вставляємо кнопку "Редагувати адмінів" на другу позицію для власника
-        keyboard.insert(1, [KeyboardButton(text="👥 Редагувати адмінів")])
-    return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
+    return _ADMIN_MENU_OWNER if is_owner else _ADMIN_MENU
 
 
 def get_admin_management_keyboard() -> ReplyKeyboardMarkup:
     """Повертає клавіатуру для керування адмінами."""
-    keyboard = [
-        [
-            KeyboardButton(text="➕ Додати адміна"),
-            KeyboardButton(text="➖ Видалити адміна"),
-        ],
-        [KeyboardButton(text="📋 Список адмінів")],
-        [KeyboardButton(text="⬅️ Назад до адмін-панелі")],
-    ]
-    return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
-
+    return _ADMIN_MANAGEMENT_KEYBOARD
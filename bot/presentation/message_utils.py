@@ -2,50 +2,78 @@
 Утиліти для роботи з повідомленнями Telegram.
 """
 
+from typing import Optional
+
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import Message
 from bot.core.logging_setup import get_logger
+from bot.presentation.formatting import MAX_MESSAGE_LENGTH, html_to_text, markdown_to_html, split_html
 
 logger = get_logger(__name__)
 
-# Telegram message length limit
-MAX_MESSAGE_LENGTH = 4096
-
 
-async def send_long_message(message: Message, text: str) -> None:
+def find_split_position(text: str, limit: int = MAX_MESSAGE_LENGTH) -> int:
     """
-    Відправляє довге повідомлення, розбиваючи його на частини якщо потрібно.
+    Повертає позицію, на якій варто розрізати текст, щоб перша частина вмістилась у ліміт.
 
     Args:
-        message: Об'єкт вхідного повідомлення
-        text: Текст для відправки
+        text: Текст, довший за ліміт
+        limit: Максимальна довжина першої частини
+
+    Returns:
+        int: Позиція останнього переносу рядка або пробілу перед лімітом, інакше сам ліміт
     """
-    if len(text) <= MAX_MESSAGE_LENGTH:
-        await message.answer(text)
-        return
+    # Шукаємо останній перенос рядка перед лімітом
+    split_pos = text.rfind('\n', 0, limit)
+
+    # Якщо не знайшли перенос рядка, шукаємо пробіл
+    if split_pos <= 0:
+        split_pos = text.rfind(' ', 0, limit)
+
+    # Якщо і пробіл не знайшли, просто ріжемо по ліміту
+    if split_pos <= 0:
+        split_pos = limit
 
-    # Розбиваємо на частини
-    parts = []
-    while text:
-        if len(text) <= MAX_MESSAGE_LENGTH:
-            parts.append(text)
-            break
+    return split_pos
 
-        # Шукаємо останній перенос рядка перед лімітом
-        split_pos = text.rfind('\n', 0, MAX_MESSAGE_LENGTH)
 
-        # Якщо не знайшли перенос рядка, шукаємо пробіл
-        if split_pos == -1:
-            split_pos = text.rfind(' ', 0, MAX_MESSAGE_LENGTH)
+async def send_long_message(message: Message, text: str, edit: Optional[Message] = None) -> None:
+    """
+    Відправляє відповідь моделі, розбиваючи її на частини якщо потрібно.
 
-        # Якщо і пробіл не знайшли, просто ріжемо по ліміту
-        if split_pos == -1:
-            split_pos = MAX_MESSAGE_LENGTH
+    Markdown перетворюється на HTML, а частини мають збалансовані теги і
+    вміщуються в ліміт Telegram (див. bot.presentation.formatting).
+    Частини надсилаються послідовно, тож порядок зберігається.
 
-        parts.append(text[:split_pos])
-        text = text[split_pos:].lstrip()
+    Args:
+        message: Об'єкт вхідного повідомлення
+        text: Текст для відправки
+        edit: Повідомлення бота (наприклад, статус), яке замінюється першою частиною
+    """
+    parts = split_html(markdown_to_html(text))
+    if len(parts) > 1:
+        logger.info("Розбито довге повідомлення на %d частин", len(parts))
 
-    # Відправляємо частини
-    logger.info("Розбито довге повідомлення на %d частин", len(parts))
     for i, part in enumerate(parts, 1):
-        await message.answer(part)
+        await _send_part(message, part, edit if i == 1 else None)
         logger.debug("Відправлено частину %d/%d", i, len(parts))
+
+
+async def _send_part(message: Message, text: str, edit: Optional[Message]) -> None:
+    """Редагує `edit` у текст частини або, якщо його немає, надсилає нове повідомлення."""
+    if edit is not None:
+        try:
+            await edit.edit_text(text)
+            return
+        except TelegramBadRequest as e:
+            logger.warning("Не вдалося замінити повідомлення відповіддю: %s", e)
+        try:
+            await edit.delete()
+        except Exception:
+            logger.exception("Помилка при видаленні повідомлення")
+    try:
+        await message.answer(text)
+    except TelegramBadRequest as e:
+        # Telegram відхилив розмітку — надсилаємо частину простим текстом
+        logger.warning("Не вдалося надіслати частину з розміткою: %s", e)
+        await message.answer(html_to_text(text), parse_mode=None)
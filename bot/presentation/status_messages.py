@@ -4,9 +4,21 @@
 Статус-повідомлення складається з двох рядків:
 - Рядок 1: Завжди "**Очікуйте...**"
 - Рядок 2: Етап обробки (динамічний)
+
+DeferredStatus показує статус лише тоді, коли генерація триває довше за
+STATUS_MESSAGE_DELAY, а вже показаний статус стає першою частиною відповіді
+замість окремих редагування та видалення.
 """
 
+import asyncio
+import time
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.enums.chat_action import ChatAction
 from aiogram.types import Message
+
+from bot.config import runtime_config
 from bot.core.logging_setup import get_logger
 
 logger = get_logger(__name__)
@@ -57,3 +69,108 @@ async def delete_status(status_msg: Message) -> None:
         logger.debug("Видалено статус-повідомлення")
     except Exception:
         logger.exception("Помилка при видаленні статус-повідомлення")
+
+
+class DeferredStatus:
+    """
+    Відкладене статус-повідомлення з індикатором "друкує...".
+
+    Поки триває робота, індикатор оновлюється кожні TYPING_REFRESH_INTERVAL
+    секунд, а статус надсилається, лише якщо робота триває довше за
+    STATUS_MESSAGE_DELAY. Використовується як асинхронний контекстний
+    менеджер: на виході непотрібний статус видаляється.
+    """
+
+    def __init__(self, message: Message, bot: Bot, stage: str):
+        """
+        Args:
+            message: Вхідне повідомлення користувача
+            bot: Бот для надсилання індикатора дії
+            stage: Опис етапу для статус-повідомлення
+        """
+        self._message = message
+        self._bot = bot
+        self._stage = stage
+        self._status_msg: Optional[Message] = None
+        self._posting: Optional[asyncio.Future] = None
+        self._task: Optional[asyncio.Task] = None
+        self._claimed = False
+
+    async def __aenter__(self) -> "DeferredStatus":
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.stop()
+        if self._status_msg is not None and not self._claimed:
+            await delete_status(self._status_msg)
+
+    @property
+    def status_msg(self) -> Optional[Message]:
+        """Статус-повідомлення, якщо його вже надіслано."""
+        return self._status_msg
+
+    async def update(self, stage: str) -> None:
+        """Змінює етап; якщо статус ще не показано, він з'явиться вже з новим етапом."""
+        self._stage = stage
+        if self._status_msg is not None and not self._claimed:
+            await update_status(self._status_msg, stage)
+
+    async def claim(self) -> Optional[Message]:
+        """
+        Завершує очікування і передає статус-повідомлення відповіді.
+
+        Returns:
+            Optional[Message]: Статус-повідомлення для редагування у відповідь
+                або None, якщо статус так і не знадобився
+        """
+        await self.stop()
+        self._claimed = True
+        return self._status_msg
+
+    async def stop(self) -> None:
+        """Зупиняє індикатор та таймер статусу."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._posting is not None:
+            # Статус, що саме надсилався, дочікуємося, щоб не лишити його в чаті
+            try:
+                self._status_msg = await self._posting
+            except Exception:
+                logger.exception("Помилка при надсиланні статус-повідомлення")
+            self._posting = None
+
+    async def _run(self) -> None:
+        """Оновлює індикатор дії та надсилає статус після затримки."""
+        status_at = time.monotonic() + runtime_config.STATUS_MESSAGE_DELAY
+        interval = runtime_config.TYPING_REFRESH_INTERVAL
+        next_typing = 0.0
+        while True:
+            now = time.monotonic()
+            if now >= next_typing:
+                next_typing = now + interval
+                try:
+                    await self._bot.send_chat_action(
+                        chat_id=self._message.chat.id, action=ChatAction.TYPING
+                    )
+                except Exception:
+                    logger.warning("Не вдалося надіслати індикатор дії", exc_info=True)
+
+            if self._status_msg is None and time.monotonic() >= status_at:
+                status_at = float("inf")
+                self._posting = asyncio.ensure_future(send_status(self._message, self._stage))
+                try:
+                    self._status_msg = await asyncio.shield(self._posting)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    logger.exception("Помилка при надсиланні статус-повідомлення")
+                self._posting = None
+
+            wake_at = next_typing if self._status_msg is not None else min(next_typing, status_at)
+            await asyncio.sleep(max(0.0, wake_at - time.monotonic()))
@@ -0,0 +1,191 @@
+"""
+Потокове відображення відповіді моделі в Telegram.
+
+Відповідь показується в статус-повідомленні (або, якщо статус не
+надсилався, в новому повідомленні), яке поступово редагується
+в міру надходження тексту. Редагування обмежені за частотою
+(runtime_config.STREAM_EDIT_INTERVAL), а текст, що не вміщується в одне
+повідомлення, переноситься в нові повідомлення. Проміжний текст
+показується без розмітки; після завершення вся відповідь перетворюється
+на HTML і заново ділиться на частини.
+
+Генерація не чекає на Telegram: push() лише запам'ятовує останній текст,
+а редагування виконує фонова задача відображення.
+"""
+
+import asyncio
+import time
+from typing import Awaitable, Callable, List, Optional
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message
+
+from bot.config import runtime_config
+from bot.core.logging_setup import get_logger
+from bot.presentation.formatting import fit_utf16, html_to_text, markdown_to_html, split_html, utf16_len
+from bot.presentation.message_utils import MAX_MESSAGE_LENGTH, find_split_position
+
+logger = get_logger(__name__)
+
+# Додається до відповіді, потік якої обірвався після отримання частини тексту
+STREAM_INTERRUPTED_NOTICE = "⚠️ Відповідь перервано через помилку. Спробуйте ще раз."
+
+
+class StreamingReply:
+    """Відображає накопичуваний текст відповіді у повідомленнях Telegram."""
+
+    def __init__(
+        self,
+        message: Message,
+        status_msg: Optional[Message] = None,
+        claim: Optional[Callable[[], Awaitable[Optional[Message]]]] = None,
+    ):
+        """
+        Args:
+            message: Вхідне повідомлення користувача (для надсилання нових частин)
+            status_msg: Статус-повідомлення, яке стане першою частиною відповіді,
+                або None, щоб надіслати відповідь новим повідомленням
+            claim: Функція, що повертає статус-повідомлення при першому
+                відображенні (замість `status_msg`, якщо статус ще може з'явитися)
+        """
+        self._message = message
+        self._current: Optional[Message] = status_msg
+        # Усі повідомлення відповіді по порядку (для остаточного відображення)
+        self._messages: List[Message] = [status_msg] if status_msg is not None else []
+        self._claim = claim
+        self._offset = 0  # Початок поточної частини в повному тексті
+        self._shown = ""  # Текст, який зараз відображає поточне повідомлення
+        self._last_edit = 0.0
+        self._pending: Optional[str] = None  # Найновіший ще не показаний текст
+        self._renderer: Optional[asyncio.Task] = None
+
+    def push(self, text: str) -> None:
+        """
+        Передає проміжний текст фоновій задачі відображення, не чекаючи на Telegram.
+
+        Якщо задача ще показує попередню версію, проміжні версії пропускаються —
+        наступною буде показано лише найновіший текст.
+
+        Args:
+            text: Увесь отриманий на цей момент текст відповіді
+        """
+        self._pending = text
+        if self._renderer is None or self._renderer.done():
+            self._renderer = asyncio.create_task(self._render())
+
+    def cancel(self) -> None:
+        """Зупиняє фонове відображення (наприклад, якщо генерація завершилася помилкою)."""
+        self._pending = None
+        if self._renderer is not None:
+            self._renderer.cancel()
+            self._renderer = None
+
+    async def update(self, text: str) -> None:
+        """
+        Оновлює відображення проміжного тексту.
+
+        Поточне повідомлення редагується не частіше за STREAM_EDIT_INTERVAL.
+        Проміжні версії надсилаються без розмітки, бо незавершений текст
+        може містити незакриті теги.
+
+        Args:
+            text: Увесь отриманий на цей момент текст відповіді
+        """
+        await self._claim_status()
+        await self._roll_over(text)
+        tail = text[self._offset:]
+        if not tail or tail == self._shown:
+            return
+        if time.monotonic() - self._last_edit < runtime_config.STREAM_EDIT_INTERVAL:
+            return
+        await self._show(tail, final=False)
+
+    async def finish(self, text: str) -> None:
+        """
+        Показує повний текст відповіді з розміткою (Markdown моделі → HTML).
+
+        Під час потоку текст ділився на повідомлення без розмітки, тож уся
+        відповідь ділиться заново за HTML: наявні повідомлення редагуються,
+        бракуючі надсилаються, а зайві видаляються.
+
+        Args:
+            text: Остаточний текст відповіді
+        """
+        # Проміжні версії вже не потрібні — лише дочікуємося поточного редагування
+        self._pending = None
+        if self._renderer is not None:
+            await self._renderer
+            self._renderer = None
+        await self._claim_status()
+        if not text.strip():
+            return
+        parts = split_html(markdown_to_html(text))
+        for i, part in enumerate(parts):
+            self._current = self._messages[i] if i < len(self._messages) else None
+            await self._show(part, final=True)
+
+        for extra in self._messages[len(parts):]:
+            try:
+                await extra.delete()
+            except Exception:
+                logger.exception("Помилка при видаленні зайвої частини відповіді")
+        del self._messages[len(parts):]
+
+    async def _render(self) -> None:
+        """Показує найновіший переданий через push() текст, доки він оновлюється."""
+        while self._pending is not None:
+            text, self._pending = self._pending, None
+            try:
+                await self.update(text)
+            except Exception:
+                logger.exception("Не вдалося показати проміжну відповідь")
+
+    async def _claim_status(self) -> None:
+        """Отримує статус-повідомлення при першому відображенні відповіді."""
+        if self._claim is None:
+            return
+        claim, self._claim = self._claim, None
+        status_msg = await claim()
+        if status_msg is not None:
+            self._current = status_msg
+            self._messages.insert(0, status_msg)
+
+    async def _roll_over(self, text: str) -> None:
+        """Завершує поточне повідомлення, якщо текст перевищив ліміт Telegram."""
+        while utf16_len(text[self._offset:]) > MAX_MESSAGE_LENGTH:
+            tail = text[self._offset:]
+            split_pos = find_split_position(tail, fit_utf16(tail, MAX_MESSAGE_LENGTH))
+            # Без розмітки: остаточний вигляд частини задає finish()
+            await self._show(tail[:split_pos], final=False)
+
+            rest = tail[split_pos:]
+            self._offset = len(text) - len(rest.lstrip())
+            self._current = None
+            self._shown = ""
+            logger.debug("Відповідь перенесено в нове повідомлення з позиції %d", self._offset)
+
+    async def _show(self, text: str, final: bool) -> None:
+        """Редагує поточне повідомлення або надсилає нове, якщо його ще немає."""
+        try:
+            await self._send(text, markup=final)
+        except TelegramBadRequest as e:
+            if "message is not modified" in str(e):
+                pass
+            elif final:
+                # Розмітка моделі не завжди коректна — показуємо простим текстом
+                logger.warning("Не вдалося показати відповідь з розміткою: %s", e)
+                await self._send(html_to_text(text), markup=False)
+            else:
+                logger.warning("Не вдалося оновити потокову відповідь: %s", e)
+                return
+        self._shown = text
+        self._last_edit = time.monotonic()
+
+    async def _send(self, text: str, markup: bool) -> None:
+        """Записує текст у поточне повідомлення; без `markup` розмітка вимикається."""
+        kwargs = {} if markup else {"parse_mode": None}
+        if self._current is None:
+            self._current = await self._message.answer(text, **kwargs)
+            self._messages.append(self._current)
+        else:
+            await self._current.edit_text(text, **kwargs)
@@ -0,0 +1,169 @@
+"""Запобіжники (circuit breaker) для моделей та ключів Gemini API.
+
+Запобіжник рахує збої поспіль. Після `failure_threshold` збоїв (або одразу,
+якщо сервер повідомив, скільки чекати) він розмикається: запити до цієї
+моделі чи ключа не надсилаються, а одразу завершуються або йдуть в інше
+місце. Після `recovery_timeout` пропускається один пробний запит
+(напіввідкритий стан): успіх замикає запобіжник, збій знову розмикає.
+"""
+
+import logging
+import time
+from enum import Enum
+from typing import Any, Dict, Iterator, List, Optional
+
+from bot.config import runtime_config
+
+logger = logging.getLogger(__name__)
+
+
+class BreakerState(Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Запобіжник однієї моделі або одного ключа API."""
+
+    def __init__(self, name: str, failure_threshold: int, recovery_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._state = BreakerState.CLOSED
+        self._failures = 0
+        self._open_until = 0.0
+        self._probe_started: Optional[float] = None
+        self.trips = 0
+
+    @property
+    def state(self) -> BreakerState:
+        """Поточний стан; розімкнений запобіжник після паузи вважається напіввідкритим."""
+        if self._state is BreakerState.OPEN and time.monotonic() >= self._open_until:
+            return BreakerState.HALF_OPEN
+        return self._state
+
+    @property
+    def failures(self) -> int:
+        return self._failures
+
+    def is_available(self) -> bool:
+        """Чи пропустить запобіжник запит зараз (без зміни стану)."""
+        state = self.state
+        if state is BreakerState.CLOSED:
+            return True
+        if state is BreakerState.OPEN:
+            return False
+        return not self._probe_in_flight()
+
+    def allow(self) -> bool:
+        """Пропускає запит; у напіввідкритому стані — лише один пробний."""
+        if not self.is_available():
+            return False
+        if self.state is BreakerState.HALF_OPEN:
+            self._state = BreakerState.HALF_OPEN
+            self._probe_started = time.monotonic()
+            logger.info("Запобіжник %s: пробний запит після паузи.", self.name)
+        return True
+
+    def record_success(self):
+        """Замикає запобіжник після успішного запиту."""
+        if self._state is not BreakerState.CLOSED:
+            logger.info("Запобіжник %s замкнено: сервіс знову відповідає.", self.name)
+        self._state = BreakerState.CLOSED
+        self._failures = 0
+        self._probe_started = None
+
+    def release_probe(self):
+        """Повертає пробний запит, що завершився без висновку про стан сервісу.
+
+        Наприклад, запит відхилила черга або він скасований: наступний запит
+        знову зможе стати пробним, не чекаючи recovery_timeout.
+        """
+        if self._state is BreakerState.HALF_OPEN:
+            self._probe_started = None
+
+    def record_failure(self, open_for: Optional[float] = None):
+        """Рахує збій і розмикає запобіжник, якщо досягнуто порогу.
+
+        Args:
+            open_for: Розімкнути одразу на вказану кількість секунд
+                (наприклад, за підказкою сервера retry-after).
+        """
+        self._failures += 1
+        probe_failed = self._state is BreakerState.HALF_OPEN
+        if open_for is None and not probe_failed and self._failures < self.failure_threshold:
+            return
+
+        duration = open_for if open_for is not None else self.recovery_timeout
+        self._state = BreakerState.OPEN
+        self._open_until = time.monotonic() + duration
+        self._probe_started = None
+        self.trips += 1
+        logger.warning(
+            "Запобіжник %s розімкнено на %.0f сек (збоїв поспіль: %d).",
+            self.name,
+            duration,
+            self._failures,
+        )
+
+    def remaining_open(self) -> float:
+        """Скільки секунд запобіжник ще буде розімкнений (0, якщо не розімкнений)."""
+        if self._state is not BreakerState.OPEN:
+            return 0.0
+        return max(0.0, self._open_until - time.monotonic())
+
+    def _probe_in_flight(self) -> bool:
+        # Пробний запит, що не повернувся за recovery_timeout, вважаємо втраченим
+        return (
+            self._probe_started is not None
+            and time.monotonic() - self._probe_started < self.recovery_timeout
+        )
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Повертає стан запобіжника для адмін-панелі."""
+        return {
+            "name": self.name,
+            "state": self.state.value,
+            "failures": self._failures,
+            "remaining": self.remaining_open(),
+            "trips": self.trips,
+        }
+
+
+class BreakerRegistry:
+    """Набір запобіжників з однаковими параметрами, що створюються на вимогу."""
+
+    def __init__(self, failure_threshold: int, recovery_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, name: str) -> CircuitBreaker:
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            breaker = self._breakers[name] = CircuitBreaker(
+                name, self.failure_threshold, self.recovery_timeout
+            )
+        return breaker
+
+    def __iter__(self) -> Iterator[CircuitBreaker]:
+        return iter(list(self._breakers.values()))
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        return [breaker.snapshot() for breaker in self]
+
+    def reset(self):
+        self._breakers.clear()
+
+
+def api_key_label(api_key: str) -> str:
+    """Коротка позначка ключа API для журналів та адмін-панелі (без розкриття ключа)."""
+    return f"…{api_key[-4:]}" if len(api_key) > 4 else "…"
+
+
+# Запобіжники ключів API: розмикаються, коли збоять запити до будь-яких моделей
+key_breakers = BreakerRegistry(
+    failure_threshold=runtime_config.CIRCUIT_FAILURE_THRESHOLD,
+    recovery_timeout=runtime_config.CIRCUIT_RECOVERY_TIMEOUT,
+)
@@ -0,0 +1,151 @@
+"""Класифікація помилок Gemini API.
+
+Замість пошуку підрядків у тексті помилки кожен виняток зводиться до
+ClassifiedError з типом (повторювана, квота, модель не знайдена, ключ
+недійсний, остаточна) та, якщо сервер його надав, часом очікування до
+наступної спроби.
+"""
+
+import asyncio
+import re
+from enum import Enum
+from typing import Any, Optional
+
+from google.api_core import exceptions as google_exceptions
+from google.genai import errors as genai_errors
+
+
+class ErrorKind(Enum):
+    """Тип помилки з погляду політики повторів."""
+
+    RETRYABLE = "retryable"  # Таймаут, 5xx, обрив з'єднання — варто повторити
+    QUOTA = "quota"  # 429 — модель/ключ вичерпали ліміт, повтор після паузи
+    NOT_FOUND = "not_found"  # 404 — модель більше не існує
+    AUTH = "auth"  # 401/403 — проблема з ключем API
+    TERMINAL = "terminal"  # 400, блокування безпеки тощо — повтор не допоможе
+
+
+class ContentBlockedError(Exception):
+    """Модель не повернула тексту через блокування безпеки або порожню відповідь."""
+
+    def __init__(self, reason: str):
+        super().__init__(f"Відповідь заблоковано: {reason}")
+        self.reason = reason
+
+
+class OutputLimitError(Exception):
+    """Модель вичерпала ліміт вихідних токенів, не повернувши тексту."""
+
+    def __init__(self):
+        super().__init__("Відповідь без тексту: вичерпано ліміт вихідних токенів")
+
+
+class ClassifiedError:
+    """Результат класифікації помилки."""
+
+    __slots__ = ('kind', 'retry_after', 'code', 'error')
+
+    def __init__(self, kind: ErrorKind, error: BaseException, code: Optional[int] = None,
+                 retry_after: Optional[float] = None):
+        self.kind = kind
+        self.error = error
+        self.code = code
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        return self.kind in (ErrorKind.RETRYABLE, ErrorKind.QUOTA)
+
+    def __repr__(self) -> str:
+        return f"ClassifiedError({self.kind.value}, code={self.code}, retry_after={self.retry_after})"
+
+
+_RETRY_IN_PATTERN = re.compile(r"retry in ([\d.]+)\s*s", re.IGNORECASE)
+_DURATION_PATTERN = re.compile(r"^([\d.]+)s$")
+
+
+def _parse_duration(value: Any) -> Optional[float]:
+    """Перетворює тривалість protobuf ('17s', '1.5s') або число на секунди."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        match = _DURATION_PATTERN.match(value.strip())
+        if match:
+            return float(match.group(1))
+    return None
+
+
+def _retry_after_hint(error: BaseException) -> Optional[float]:
+    """Шукає підказку сервера, через скільки секунд повторити запит."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers is not None:
+        try:
+            header = headers.get("retry-after")
+        except Exception:
+            header = None
+        if header:
+            try:
+                return float(header)
+            except (TypeError, ValueError):
+                pass
+
+    details = getattr(error, "details", None)
+    if isinstance(details, dict):
+        for item in details.get("error", {}).get("details", []) or []:
+            if isinstance(item, dict) and str(item.get("@type", "")).endswith("RetryInfo"):
+                delay = _parse_duration(item.get("retryDelay"))
+                if delay is not None:
+                    return delay
+
+    match = _RETRY_IN_PATTERN.search(str(error))
+    return float(match.group(1)) if match else None
+
+
+def _kind_for_code(code: Optional[int]) -> Optional[ErrorKind]:
+    if code is None:
+        return None
+    if code == 429:
+        return ErrorKind.QUOTA
+    if code == 404:
+        return ErrorKind.NOT_FOUND
+    if code in (401, 403):
+        return ErrorKind.AUTH
+    if code == 408 or code >= 500:
+        return ErrorKind.RETRYABLE
+    if 400 <= code < 500:
+        return ErrorKind.TERMINAL
+    return None
+
+
+def classify_error(error: BaseException) -> ClassifiedError:
+    """Визначає тип помилки Gemini API та підказку щодо часу повтору."""
+    if isinstance(error, (ContentBlockedError, OutputLimitError)):
+        return ClassifiedError(ErrorKind.TERMINAL, error)
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return ClassifiedError(ErrorKind.RETRYABLE, error)
+
+    code = None
+    if isinstance(error, genai_errors.APIError):
+        code = error.code
+    elif isinstance(error, google_exceptions.GoogleAPICallError):
+        code = error.code
+    else:
+        code = getattr(error, "code", None)
+        if not isinstance(code, int):
+            code = None
+
+    kind = _kind_for_code(code)
+    if kind is None:
+        # Невідомі помилки без коду (мережа, внутрішні збої клієнта) вважаємо тимчасовими,
+        # окрім явних ознак відсутньої моделі
+        text = str(error)
+        if "NOT_FOUND" in text or "is not found" in text:
+            kind = ErrorKind.NOT_FOUND
+        elif "RESOURCE_EXHAUSTED" in text:
+            kind = ErrorKind.QUOTA
+        else:
+            kind = ErrorKind.RETRYABLE
+
+    retry_after = _retry_after_hint(error) if kind in (ErrorKind.QUOTA, ErrorKind.RETRYABLE) else None
+    return ClassifiedError(kind, error, code=code, retry_after=retry_after)
@@ -1,25 +1,43 @@
 import asyncio
+import functools
 import logging
-from typing import Any, Optional
+import time
+from typing import Any, Awaitable, Callable, Optional
 
 from aiogram import Bot
-from google.api_core import exceptions as google_exceptions
-from google import genai
+from google.genai import types
 
 from bot.config import runtime_config
 from bot.config.settings import settings
 from bot.db.config_store import get_api_text_model_name
-from bot.db.model_store import sync_models
+from bot.db.model_store import get_available_models, sync_models
 from bot.db.user_settings import add_message_to_context, get_user_context
+from bot.services.errors import (
+    ClassifiedError,
+    ContentBlockedError,
+    ErrorKind,
+    OutputLimitError,
+    classify_error,
+)
+from bot.services.hedging import HedgeUnavailableError, hedge_delay, hedged
+from bot.services.key_pool import ApiKey, ApiKeyPool
+from bot.services.latency import latency_tracker, request_timeout, retry_delay
+from bot.services.model_health import fallback_chain, model_health
+from bot.services.scheduler import SchedulerBusyError, gemini_scheduler
+from bot.services.tokens import build_context_window, message_text, token_counter
 
 logger = logging.getLogger(__name__)
 
-# Ініціалізація клієнта Gemini API
-try:
-    client = genai.Client(api_key=settings.GEMINI_API_KEY)
-except Exception:
-    logger.exception("Помилка ініціалізації Gemini Client")
-    client = None
+BUSY_MESSAGE = "⏳ Зараз забагато запитів. Будь ласка, зачекайте кілька секунд і спробуйте знову."
+UNAVAILABLE_MESSAGE = "⏳ Сервіс AI тимчасово недоступний. Спробуйте приблизно через {seconds} сек."
+BLOCKED_MESSAGE = "⚠️ Модель відмовилась відповідати на цей запит. Спробуйте переформулювати його."
+OUTPUT_LIMIT_MESSAGE = (
+    "⚠️ Модель не встигла сформулювати відповідь у межах ліміту довжини. "
+    "Спробуйте звузити або розбити запит."
+)
+
+# Клієнти Gemini API — по одному на кожен ключ
+key_pool = ApiKeyPool.from_api_keys(settings.gemini_api_keys)
 
 
 async def _get_owner_contact(bot: Bot) -> str:
@@ -43,33 +61,142 @@ async def _get_owner_contact(bot: Bot) -> str:
         return "адміністратора"
 
 
+# Серіалізує оновлення списку моделей; лічильник показує, скільки оновлень завершено
+_models_refresh_lock = asyncio.Lock()
+_models_refresh_count = 0
+
+
+def _list_api_model_names(client: Any) -> list[str]:
+    """Повертає відфільтровані імена моделей з API (блокуючий виклик)."""
+    mandatory_keyword = "gemini-2.5"
+    excluded_keywords = ["preview", "audio", "image", "embedding", "vision"]
+
+    api_models = []
+    for model in client.models.list():
+        model_name_lower = model.name.lower()
+        if mandatory_keyword in model_name_lower and not any(
+            excluded in model_name_lower for excluded in excluded_keywords
+        ):
+            api_models.append(model.name)
+    return api_models
+
+
 async def refresh_available_models() -> None:
-    """Оновлює список моделей з API та синхронізує його з БД."""
+    """Оновлює список моделей з API та синхронізує його з БД.
+
+    Одночасні виклики (наприклад, кілька NOT_FOUND поспіль) виконують одне
+    оновлення: ті, хто чекав на блокування, поки інше оновлення завершилось,
+    повертаються без повторного запиту до API.
+    """
+    global _models_refresh_count
+
+    client = key_pool.any_client()
     if not client:
         logger.error(
             "Клієнт Gemini не ініціалізовано. Оновлення моделей неможливе."
         )
         return
 
-    logger.info("Оновлення списку доступних моделей Gemini...")
-    try:
-        api_models = []
-        mandatory_keyword = "gemini-2.5"
-        excluded_keywords = ["preview", "audio", "image", "embedding", "vision"]
-
-        for model in client.models.list():
-            model_name_lower = model.name.lower()
-            if mandatory_keyword in model_name_lower and not any(
-                excluded in model_name_lower for excluded in excluded_keywords
-            ):
-                api_models.append(model.name)
-
-        await sync_models(api_models)
-        logger.info("Синхронізовано %d моделей з API до БД.", len(api_models))
-    except Exception:
-        logger.exception(
-            "Не вдалося отримати та синхронізувати список моделей від Gemini API"
+    seen_refresh_count = _models_refresh_count
+    async with _models_refresh_lock:
+        if _models_refresh_count != seen_refresh_count:
+            logger.debug("Список моделей щойно оновлено іншим запитом.")
+            return
+
+        logger.info("Оновлення списку доступних моделей Gemini...")
+        try:
+            # Синхронний пагінатор робить мережеві запити, тому виконуємо його поза event loop
+            api_models = await asyncio.to_thread(_list_api_model_names, client)
+            await sync_models(api_models)
+            logger.info("Синхронізовано %d моделей з API до БД.", len(api_models))
+        except Exception:
+            logger.exception(
+                "Не вдалося отримати та синхронізувати список моделей від Gemini API"
+            )
+        finally:
+            _models_refresh_count += 1
+
+
+def _thinks_by_default(model: str) -> bool:
+    """Чи роздумує модель за замовчуванням (тоді роздуми рахуються в max_output_tokens)."""
+    name = model.removeprefix("models/")
+    return (
+        name.startswith(runtime_config.THINKING_MODEL_PREFIXES)
+        and not name.startswith(runtime_config.NON_THINKING_MODEL_PREFIXES)
+    )
+
+
+def _generation_config(model: str) -> types.GenerateContentConfig:
+    """Параметри генерації: обмеження довжини відповіді TOKEN_LIMIT_OUT.
+
+    Моделі, що роздумують за замовчуванням, витрачають частину
+    max_output_tokens на роздуми, тому для них бюджет роздумів обмежується
+    і додається до ліміту відповіді. Решті моделей роздуми не вмикаються.
+    """
+    if _thinks_by_default(model):
+        budget = runtime_config.TOKEN_THINKING_BUDGET
+        return types.GenerateContentConfig(
+            max_output_tokens=runtime_config.TOKEN_LIMIT_OUT + budget,
+            thinking_config=types.ThinkingConfig(thinking_budget=budget),
         )
+    return types.GenerateContentConfig(max_output_tokens=runtime_config.TOKEN_LIMIT_OUT)
+
+
+def _block_reason(response: Any) -> str:
+    """Пояснює, чому відповідь не містить тексту (блокування безпеки тощо)."""
+    feedback = getattr(response, "prompt_feedback", None)
+    reason = getattr(feedback, "block_reason", None)
+    if reason:
+        return str(reason)
+    candidates = getattr(response, "candidates", None) or []
+    if candidates:
+        finish_reason = getattr(candidates[0], "finish_reason", None)
+        if finish_reason:
+            return str(finish_reason)
+    return "порожня відповідь"
+
+
+def _empty_response_error(response: Any) -> Exception:
+    """Виняток для відповіді без тексту: вичерпаний ліміт токенів чи блокування."""
+    candidates = getattr(response, "candidates", None) or []
+    if candidates and getattr(candidates[0], "finish_reason", None) == types.FinishReason.MAX_TOKENS:
+        return OutputLimitError()
+    return ContentBlockedError(_block_reason(response))
+
+
+def _record_usage(api_key: ApiKey, text: str, usage: Any) -> None:
+    """Запам'ятовує точну кількість токенів відповіді та витрату токенів ключа з usage_metadata."""
+    if usage is None:
+        return
+    key_pool.record_tokens(api_key, getattr(usage, "total_token_count", None))
+    if text:
+        token_counter.record(text, getattr(usage, "candidates_token_count", None))
+
+
+# Посилання на фонові задачі точного підрахунку токенів, щоб їх не прибрав GC
+_token_count_tasks: set[asyncio.Task] = set()
+
+
+def _start_token_count_refresh(model_name: str, texts: list[str]) -> None:
+    """Запускає у фоні точний підрахунок токенів для текстів, яких ще немає в кеші."""
+    unknown = token_counter.unknown(texts)
+    if not unknown:
+        return
+    task = asyncio.create_task(_count_tokens_exactly(model_name, unknown))
+    _token_count_tasks.add(task)
+    task.add_done_callback(_token_count_tasks.discard)
+
+
+async def _count_tokens_exactly(model_name: str, texts: list[str]) -> None:
+    """Рахує токени через count_tokens і зберігає результат у кеші за хешем вмісту."""
+    client = key_pool.any_client()
+    for text in texts:
+        try:
+            result = await client.aio.models.count_tokens(model=model_name, contents=text)
+        except Exception as e:
+            logger.warning("Не вдалося точно порахувати токени: %s", e)
+            return
+        token_counter.record(text, result.total_tokens)
 
 
 class GeminiService:
@@ -79,6 +206,8 @@ class GeminiService:
         """Ініціалізація сервісу."""
         self.user_id = user_id
         self.bot = bot
+        # Чи обірвався потік останньої потокової відповіді після отримання тексту
+        self.stream_interrupted = False
 
     async def _get_error_message(self, error_text: str) -> str:
         """Формує повідомлення про помилку для користувача."""
@@ -88,32 +217,86 @@ class GeminiService:
             f"зверніться до {owner_contact}."
         )
 
-    async def _handle_api_error(self, error: Exception, attempt: int, model_name: str) -> Optional[str]:
-        """Обробляє помилки API та повертає повідомлення для користувача."""
-        if isinstance(error, asyncio.TimeoutError):
+    async def _handle_api_error(
+        self, error: ClassifiedError, attempt: int, model_name: str, api_key: ApiKey
+    ) -> Optional[str]:
+        """Журналює помилку API та повертає повідомлення, якщо повторювати запит не варто."""
+        if error.kind is ErrorKind.NOT_FOUND:
+            logger.error("Помилка Gemini API: Модель '%s' не знайдено.", model_name)
+            await refresh_available_models()
+            return "Помилка: обрану модель не знайдено. Оновлено список, спробуйте знову."
+        if isinstance(error.error, OutputLimitError):
+            logger.warning(
+                "Gemini вичерпав ліміт токенів без тексту для користувача %d (модель %s).",
+                self.user_id,
+                model_name,
+            )
+            return OUTPUT_LIMIT_MESSAGE
+        if isinstance(error.error, ContentBlockedError):
+            logger.warning(
+                "Gemini не повернув відповіді користувачу %d: %s", self.user_id, error.error.reason
+            )
+            return BLOCKED_MESSAGE
+        if error.kind is ErrorKind.AUTH:
+            logger.error("Ключ Gemini API %s відхилено: %s", api_key.label, error.error)
+            # Запит можна повторити з іншим ключем, якщо такий є
+            if key_pool.wait_time():
+                return await self._get_error_message("Сервіс AI відхилив ключ доступу.")
+            return None
+        if error.kind is ErrorKind.TERMINAL:
+            logger.error(
+                "Gemini API відхилив запит користувача %d (код %s): %s",
+                self.user_id,
+                error.code,
+                error.error,
+            )
+            return await self._get_error_message("Не вдалося обробити запит до моделі.")
+
+        if isinstance(error.error, asyncio.TimeoutError):
             logger.warning(
                 "Таймаут Gemini API для користувача %d (спроба %d/%d).",
                 self.user_id,
                 attempt + 1,
                 runtime_config.API_RETRY_ATTEMPTS,
             )
-        elif "NOT_FOUND" in str(error) or "is not found" in str(error):
-            logger.exception("Помилка Gemini API: Модель '%s' не знайдено.", model_name)
-            await refresh_available_models()
-            return "Помилка: обрану модель не знайдено. Оновлено список, спробуйте знову."
         else:
-            logger.exception(
-                "Невідома помилка Gemini API для користувача %d (спроба %d/%d): %s",
+            logger.warning(
+                "Помилка Gemini API (%s) для користувача %d, модель %s (спроба %d/%d): %s",
+                error.kind.value,
                 self.user_id,
+                model_name,
                 attempt + 1,
                 runtime_config.API_RETRY_ATTEMPTS,
-                error
+                error.error,
             )
         return None
 
-    async def generate_text_response(self, prompt: str) -> str:
-        """Надсилає запит до Gemini та повертає текстову відповідь."""
-        if not client:
+    @staticmethod
+    def _record_failure(error: ClassifiedError, model_name: str, api_key: ApiKey):
+        """Передає збій запобіжникам моделі та ключа API."""
+        if error.kind is ErrorKind.AUTH:
+            api_key.breaker.record_failure(open_for=api_key.breaker.recovery_timeout)
+        elif error.kind is ErrorKind.QUOTA:
+            # Ключ вичерпав ліміт: наступні запити йдуть через інші ключі. Модель
+            # вважається перевантаженою, лише коли квоти немає в жодного ключа
+            key_pool.cool_down(api_key, error.retry_after or runtime_config.API_KEY_COOLDOWN)
+            if key_pool.wait_time():
+                model_health.record_failure(model_name)
+        elif error.kind is ErrorKind.RETRYABLE:
+            model_health.record_failure(model_name)
+            api_key.breaker.record_failure()
+
+    @staticmethod
+    def _unavailable_message(seconds: float) -> str:
+        return UNAVAILABLE_MESSAGE.format(seconds=max(1, round(seconds)))
+
+    async def _prepare_request(self, prompt: str) -> tuple[str, list[dict[str, Any]]] | str:
+        """Визначає модель і збирає вміст запиту з контекстом.
+
+        Returns:
+            Кортеж (модель, вміст запиту) або повідомлення про помилку для користувача.
+        """
+        if not key_pool:
             owner_contact = await _get_owner_contact(self.bot)
             return (
                 "Наразі бот не налаштований для роботи з AI-моделями. "
@@ -124,31 +307,91 @@ class GeminiService:
         if not model_name:
             return await self._get_error_message("Не вдалося отримати назву моделі для генерації відповіді.")
 
-        context = await get_user_context(self.user_id)
-        if len(context) > runtime_config.CONTEXT_MESSAGE_LIMIT:
-            context = context[-runtime_config.CONTEXT_MESSAGE_LIMIT :]
+        context = await get_user_context(self.user_id, limit=runtime_config.CONTEXT_MESSAGE_LIMIT)
+
+        # Розмір запиту обмежується бюджетом токенів, а не лише кількістю повідомлень
+        full_contents = build_context_window(context, prompt)
+        if runtime_config.TOKEN_EXACT_COUNT:
+            _start_token_count_refresh(model_name, [message_text(message) for message in full_contents])
+        return model_name, full_contents
 
-        full_contents: list[dict[str, Any]] = [*context, {"role": "user", "parts": [{"text": prompt}]}]
+    async def _model_chain(self, primary: str) -> list[str]:
+        """Повертає ланцюжок моделей для спроб: основна та резервні за пріоритетом."""
+        if not runtime_config.MODEL_FALLBACK_ENABLED:
+            return [primary]
+        try:
+            models = await get_available_models()
+        except Exception:
+            logger.exception("Не вдалося отримати список моделей для резервного ланцюжка")
+            return [primary]
+        return fallback_chain(primary, models)
 
+    async def _generate_with_retries(
+        self,
+        prompt: str,
+        primary_model: str,
+        request: Callable[[ApiKey, str], Awaitable[str]],
+    ) -> str:
+        """Виконує запит з повторними спробами та зберігає успішну відповідь у контекст.
+
+        Помилки класифікуються: остаточні (400, блокування безпеки) не
+        повторюються. Після таймауту чи перевантаження модель тимчасово
+        виключається, і наступна спроба одразу йде до наступної здорової моделі
+        ланцюжка; ключ, що отримав 429 або був відхилений, замінюється іншим
+        ключем пулу. Пауза потрібна лише тоді, коли перейти немає куди. Якщо
+        розімкнені запобіжники всіх моделей чи ключів, запит завершується одразу.
+        """
+        chain = await self._model_chain(primary_model)
         for attempt in range(runtime_config.API_RETRY_ATTEMPTS):
+            model_name = model_health.pick(chain)
+            if model_name is None:
+                logger.warning("Усі моделі ланцюжка %s недоступні, запит відхилено.", chain)
+                return self._unavailable_message(model_health.remaining_open(chain))
+            api_key = key_pool.acquire()
+            if api_key is None:
+                logger.warning("Немає доступних ключів Gemini API, запит відхилено.")
+                return self._unavailable_message(key_pool.wait_time())
+
             try:
-                response = await asyncio.wait_for(
-                    client.aio.models.generate_content(model=model_name, contents=full_contents),
-                    timeout=runtime_config.GEMINI_API_TIMEOUT,
-                )
-                response_text = response.text
+                # Слот утримується лише на час запиту, а не під час пауз між спробами
+                async with gemini_scheduler.slot(self.user_id, model_name):
+                    response_text = await request(api_key, model_name)
+                model_health.record_success(model_name)
+                api_key.breaker.record_success()
                 await add_message_to_context(self.user_id, "user", prompt)
                 await add_message_to_context(self.user_id, "model", response_text)
                 return response_text
+            except SchedulerBusyError:
+                return BUSY_MESSAGE
             except Exception as e:
-                error_message = await self._handle_api_error(e, attempt, model_name)
+                error = classify_error(e)
+                self._record_failure(error, model_name, api_key)
+                error_message = await self._handle_api_error(error, attempt, model_name, api_key)
                 if error_message:
                     return error_message
+            finally:
+                # Пробний запит, який не дав висновку (черга, скасування, помилка
+                # запиту, а не сервісу), не повинен тримати запобіжник напіввідкритим
+                model_health.release_probe(model_name)
+                api_key.breaker.release_probe()
 
-                if attempt < runtime_config.API_RETRY_ATTEMPTS - 1:
-                    delay = runtime_config.API_RETRY_BASE_DELAY * (2**attempt)
-                    logger.info("Повторна спроба через %.2f секунд...", delay)
-                    await asyncio.sleep(delay)
+            if attempt < runtime_config.API_RETRY_ATTEMPTS - 1:
+                next_model = model_health.peek(chain)
+                wait = key_pool.wait_time()
+                if next_model is None:
+                    wait = max(wait, model_health.remaining_open(chain))
+                # Сервер назвав час очікування: чекаємо його, якщо він не надто довгий
+                if wait > runtime_config.CIRCUIT_MAX_RETRY_WAIT:
+                    return self._unavailable_message(wait)
+                if not wait and next_model != model_name:
+                    logger.info("Перемикання з моделі %s на резервну %s.", model_name, next_model)
+                    continue
+                if not wait and error.kind in (ErrorKind.QUOTA, ErrorKind.AUTH):
+                    logger.info("Повтор запиту з іншим ключем API замість %s.", api_key.label)
+                    continue
+                delay = max(retry_delay(model_name, attempt), wait)
+                logger.info("Повторна спроба через %.2f секунд...", delay)
+                await asyncio.sleep(delay)
 
         logger.error(
             "Всі %d спроб запиту до Gemini API для користувача %d завершилися невдачею.",
@@ -158,3 +401,146 @@ class GeminiService:
         return await self._get_error_message(
             "На жаль, сталася помилка під час генерації відповіді після кількох спроб."
         )
+
+    async def generate_text_response(self, prompt: str) -> str:
+        """Надсилає запит до Gemini та повертає текстову відповідь."""
+        prepared = await self._prepare_request(prompt)
+        if isinstance(prepared, str):
+            return prepared
+        model_name, full_contents = prepared
+
+        async def _call(api_key: ApiKey, model: str) -> Any:
+            timeout = request_timeout(model)
+            started = time.monotonic()
+            try:
+                response = await asyncio.wait_for(
+                    api_key.client.aio.models.generate_content(
+                        model=model, contents=full_contents, config=_generation_config(model)
+                    ),
+                    timeout=timeout,
+                )
+            except asyncio.TimeoutError:
+                # Таймаут теж є заміром (нижньою межею затримки): інакше надто тісний
+                # таймаут ніколи б не збільшився
+                latency_tracker.record(model, timeout)
+                raise
+            latency_tracker.record(model, time.monotonic() - started)
+            # Використання рахується для кожної спроби, що отримала відповідь, зокрема хеджованої
+            _record_usage(api_key, response.text, getattr(response, "usage_metadata", None))
+            return response
+
+        async def _hedge_call(model: str) -> Any:
+            # Додатковий запит іде через окремий ключ: він рахується в ліміти
+            # RPM/TPM, а 429 охолоджує саме цей ключ, а не ключ основного запиту
+            hedge_key = key_pool.acquire()
+            if hedge_key is None:
+                raise HedgeUnavailableError("немає вільного ключа API")
+            try:
+                response = await _call(hedge_key, model)
+            except Exception as e:
+                self._record_failure(classify_error(e), model, hedge_key)
+                raise
+            else:
+                hedge_key.breaker.record_success()
+            finally:
+                hedge_key.breaker.release_probe()
+            return response
+
+        async def _request(api_key: ApiKey, model: str) -> str:
+            delay = hedge_delay(model)
+            if delay is None:
+                response = await _call(api_key, model)
+            else:
+                response = await hedged(
+                    functools.partial(_call, api_key),
+                    self.user_id,
+                    model,
+                    delay,
+                    hedge_model=runtime_config.HEDGE_MODEL,
+                    hedge_call=_hedge_call,
+                )
+            if not response.text:
+                raise _empty_response_error(response)
+            return response.text
+
+        return await self._generate_with_retries(prompt, model_name, _request)
+
+    async def generate_text_response_stream(
+        self,
+        prompt: str,
+        on_update: Callable[[str], None],
+    ) -> str:
+        """Надсилає потоковий запит до Gemini та повертає повну текстову відповідь.
+
+        `on_update` викликається з накопиченим текстом після кожного фрагмента.
+        Він не повинен чекати на Telegram: поки триває потік, утримується слот
+        планувальника Gemini, тож відображення має йти у фоні (StreamingReply.push).
+        Увесь потік обмежений STREAM_TOTAL_TIMEOUT, а кожен фрагмент —
+        адаптивним таймаутом моделі. Повторні спроби виконуються лише до отримання першого фрагмента; якщо
+        потік обірвався пізніше, повертається (і зберігається в контекст) вже
+        отриманий текст, а `stream_interrupted` стає True — позначку для
+        користувача додає шар відображення.
+        """
+        self.stream_interrupted = False
+        prepared = await self._prepare_request(prompt)
+        if isinstance(prepared, str):
+            return prepared
+        model_name, full_contents = prepared
+
+        async def _request(api_key: ApiKey, model: str) -> str:
+            timeout = request_timeout(model)
+            started = time.monotonic()
+            try:
+                stream = await asyncio.wait_for(
+                    api_key.client.aio.models.generate_content_stream(
+                        model=model, contents=full_contents, config=_generation_config(model)
+                    ),
+                    timeout=timeout,
+                )
+            except asyncio.TimeoutError:
+                latency_tracker.record(model, timeout)
+                raise
+            chunks = stream.__aiter__()
+            deadline = started + runtime_config.STREAM_TOTAL_TIMEOUT
+            text = ""
+            usage = None
+            chunk = None
+            while True:
+                try:
+                    # Таймаут діє на очікування кожного наступного фрагмента, але не
+                    # довше за загальний термін: інакше повільний потік не мав би межі
+                    chunk = await asyncio.wait_for(
+                        chunks.__anext__(), timeout=min(timeout, deadline - time.monotonic())
+                    )
+                except StopAsyncIteration:
+                    if not text:
+                        raise _empty_response_error(chunk) from None
+                    # Замір — час до завершення потоку, як і для звичайного запиту
+                    latency_tracker.record(model, time.monotonic() - started)
+                    _record_usage(api_key, text, usage)
+                    return text
+                except Exception as e:
+                    if isinstance(e, asyncio.TimeoutError):
+                        latency_tracker.record(model, time.monotonic() - started)
+                    if not text:
+                        raise
+                    logger.exception(
+                        "Потік відповіді Gemini для користувача %d обірвався після %d символів.",
+                        self.user_id,
+                        len(text),
+                    )
+                    self.stream_interrupted = True
+                    return text
+                # Підсумкова статистика токенів приходить в останньому фрагменті
+                usage = getattr(chunk, "usage_metadata", None) or usage
+                if chunk.text:
+                    text += chunk.text
+                    try:
+                        on_update(text)
+                    except Exception:
+                        # Помилка відображення не є помилкою моделі — генерацію не повторюємо
+                        logger.exception(
+                            "Не вдалося показати проміжну відповідь користувачу %d.", self.user_id
+                        )
+
+        return await self._generate_with_retries(prompt, model_name, _request)
@@ -0,0 +1,135 @@
+"""Хеджування запитів до Gemini.
+
+Якщо основний запит не повернувся за типовий для моделі час (перцентиль
+недавніх затримок), надсилається другий запит. Перемагає перша успішна
+відповідь, інший запит скасовується. Кількість других запитів обмежена
+хвилинним бюджетом, а самі вони використовують лише вільні слоти
+планувальника.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+from bot.config import runtime_config
+from bot.services.latency import latency_tracker
+from bot.services.scheduler import gemini_scheduler
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+BUDGET_WINDOW = 60.0
+
+
+class HedgeUnavailableError(Exception):
+    """Додатковий запит не надіслано: для нього немає ресурсу (наприклад, ключа API)."""
+
+
+class HedgeBudget:
+    """Обмежує кількість других запитів за останню хвилину."""
+
+    def __init__(self, per_minute: int):
+        self.per_minute = per_minute
+        self._spent: Deque[float] = deque()
+        self.fired = 0
+        self.won = 0
+
+    def available(self) -> bool:
+        now = time.monotonic()
+        while self._spent and now - self._spent[0] >= BUDGET_WINDOW:
+            self._spent.popleft()
+        return len(self._spent) < self.per_minute
+
+    def spend(self):
+        self._spent.append(time.monotonic())
+        self.fired += 1
+
+    def stats(self) -> Dict[str, int]:
+        self.available()
+        return {"spent": len(self._spent), "limit": self.per_minute, "fired": self.fired, "won": self.won}
+
+    def reset(self):
+        self._spent.clear()
+        self.fired = 0
+        self.won = 0
+
+
+hedge_budget = HedgeBudget(runtime_config.HEDGE_BUDGET_PER_MINUTE)
+
+
+def hedge_delay(model: str) -> Optional[float]:
+    """Через скільки секунд хеджувати запит до моделі, або None, якщо хеджування вимкнено."""
+    if not runtime_config.HEDGE_ENABLED:
+        return None
+    if latency_tracker.count(model) < runtime_config.LATENCY_MIN_SAMPLES:
+        return None
+    return latency_tracker.percentile(model, runtime_config.HEDGE_PERCENTILE)
+
+
+def _try_start_hedge(user_id: int, model: str) -> bool:
+    if not hedge_budget.available():
+        logger.debug("Бюджет хеджування вичерпано, чекаємо на основний запит.")
+        return False
+    if not gemini_scheduler.try_acquire_spare(user_id, model):
+        return False
+    hedge_budget.spend()
+    return True
+
+
+async def _hedge_call(call: Callable[[str], Awaitable[T]], user_id: int, model: str) -> T:
+    try:
+        return await call(model)
+    finally:
+        gemini_scheduler.release_spare(user_id, model)
+
+
+async def hedged(
+    call: Callable[[str], Awaitable[T]],
+    user_id: int,
+    model: str,
+    delay: float,
+    hedge_model: Optional[str] = None,
+    hedge_call: Optional[Callable[[str], Awaitable[T]]] = None,
+) -> T:
+    """Виконує `call(model)`, а після `delay` секунд очікування — ще й `hedge_call(hedge_model)`.
+
+    `hedge_call` (за замовчуванням `call`) дає змогу надіслати додатковий
+    запит іншим шляхом, наприклад через інший ключ API. Повертає першу
+    успішну відповідь; якщо обидва запити завершились помилкою, піднімає
+    помилку основного запиту — саме за нею визначається політика повторів.
+    """
+    hedge_model = hedge_model or model
+    hedge_call = hedge_call or call
+    primary = asyncio.ensure_future(call(model))
+    pending = {primary}
+    hedge = None
+    try:
+        done, pending = await asyncio.wait(pending, timeout=delay)
+        if not done and _try_start_hedge(user_id, hedge_model):
+            logger.info(
+                "Модель %s не відповіла за %.1f сек, надсилаємо додатковий запит до %s.",
+                model,
+                delay,
+                hedge_model,
+            )
+            hedge = asyncio.ensure_future(_hedge_call(hedge_call, user_id, hedge_model))
+            pending.add(hedge)
+
+        while True:
+            winner = None
+            for task in done:
+                if task.exception() is None and winner is None:
+                    winner = task
+            if winner is not None:
+                if winner is hedge:
+                    hedge_budget.won += 1
+                return winner.result()
+            if not pending:
+                raise primary.exception()
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,173 @@
+"""Пул ключів Gemini API.
+
+Кожен ключ має власний клієнт google-genai. Запит отримує найменш
+завантажений ключ: враховуються запити й токени за останню хвилину
+(відносно API_KEY_RPM_LIMIT / API_KEY_TPM_LIMIT, якщо їх задано). Ключ,
+що отримав 429, на час охолодження виводиться з ротації, а ключ із
+розімкненим запобіжником пропускається.
+"""
+
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
+
+from google import genai
+
+from bot.config import runtime_config
+from bot.services.circuit_breaker import CircuitBreaker, api_key_label, key_breakers
+
+logger = logging.getLogger(__name__)
+
+RATE_WINDOW = 60.0
+
+
+class ApiKey:
+    """Ключ API з клієнтом та лічильниками використання."""
+
+    __slots__ = (
+        'label', 'client', '_requests', '_tokens', 'cooldown_until',
+        'requests_total', 'tokens_total', 'rate_limited', 'last_used',
+    )
+
+    def __init__(self, label: str, client: Any):
+        self.label = label
+        self.client = client
+        self._requests: Deque[float] = deque()
+        self._tokens: Deque[Tuple[float, int]] = deque()
+        self.cooldown_until = 0.0
+        self.requests_total = 0
+        self.tokens_total = 0
+        self.rate_limited = 0
+        self.last_used = 0.0
+
+    @property
+    def breaker(self) -> CircuitBreaker:
+        return key_breakers.get(self.label)
+
+    def _purge(self, now: float):
+        while self._requests and now - self._requests[0] >= RATE_WINDOW:
+            self._requests.popleft()
+        while self._tokens and now - self._tokens[0][0] >= RATE_WINDOW:
+            self._tokens.popleft()
+
+    def record_request(self, now: float):
+        self._requests.append(now)
+        self.requests_total += 1
+        self.last_used = now
+
+    def record_tokens(self, now: float, tokens: int):
+        self._tokens.append((now, tokens))
+        self.tokens_total += tokens
+
+    def requests_per_minute(self, now: float) -> int:
+        self._purge(now)
+        return len(self._requests)
+
+    def tokens_per_minute(self, now: float) -> int:
+        self._purge(now)
+        return sum(tokens for _, tokens in self._tokens)
+
+    def utilization(self, now: float) -> float:
+        """Частка хвилинного ліміту, яку вже використано (без лімітів — кількість запитів)."""
+        rpm_limit = runtime_config.API_KEY_RPM_LIMIT
+        tpm_limit = runtime_config.API_KEY_TPM_LIMIT
+        if not rpm_limit and not tpm_limit:
+            return float(self.requests_per_minute(now))
+        shares = []
+        if rpm_limit:
+            shares.append(self.requests_per_minute(now) / rpm_limit)
+        if tpm_limit:
+            shares.append(self.tokens_per_minute(now) / tpm_limit)
+        return max(shares)
+
+    def wait_time(self, now: float) -> float:
+        """Через скільки секунд ключ зможе прийняти запит (0 — вже зараз)."""
+        waits = [self.cooldown_until - now, self.breaker.remaining_open()]
+        self._purge(now)
+        rpm_limit = runtime_config.API_KEY_RPM_LIMIT
+        if rpm_limit and len(self._requests) >= rpm_limit:
+            waits.append(self._requests[0] + RATE_WINDOW - now)
+        tpm_limit = runtime_config.API_KEY_TPM_LIMIT
+        if tpm_limit and self._tokens and self.tokens_per_minute(now) >= tpm_limit:
+            waits.append(self._tokens[0][0] + RATE_WINDOW - now)
+        return max(0.0, *waits)
+
+
+class ApiKeyPool:
+    """Розподіляє запити між ключами Gemini API."""
+
+    def __init__(self, keys: Sequence[Tuple[str, Any]]):
+        self._keys: List[ApiKey] = [ApiKey(label, client) for label, client in keys]
+
+    @classmethod
+    def from_api_keys(cls, api_keys: Sequence[str]) -> "ApiKeyPool":
+        """Створює клієнти для всіх ключів; ключі, для яких клієнт не створився, пропускаються."""
+        keys = []
+        for index, api_key in enumerate(api_keys, start=1):
+            label = f"#{index} {api_key_label(api_key)}"
+            try:
+                keys.append((label, genai.Client(api_key=api_key)))
+            except Exception:
+                logger.exception("Помилка ініціалізації Gemini Client для ключа %s", label)
+        return cls(keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    @property
+    def keys(self) -> List[ApiKey]:
+        return list(self._keys)
+
+    def any_client(self) -> Optional[Any]:
+        """Клієнт для службових запитів (список моделей, підрахунок токенів)."""
+        if not self._keys:
+            return None
+        now = time.monotonic()
+        return min(self._keys, key=lambda key: key.wait_time(now)).client
+
+    def acquire(self) -> Optional[ApiKey]:
+        """Повертає найменш завантажений доступний ключ і рахує запит, або None."""
+        now = time.monotonic()
+        candidates = [key for key in self._keys if not key.wait_time(now) and key.breaker.is_available()]
+        candidates.sort(key=lambda key: (key.utilization(now), key.last_used))
+        for key in candidates:
+            if key.breaker.allow():
+                key.record_request(now)
+                return key
+        return None
+
+    def record_tokens(self, key: ApiKey, tokens: Any):
+        """Додає до лічильника ключа токени запиту (з usage_metadata)."""
+        if isinstance(tokens, int) and not isinstance(tokens, bool) and tokens > 0:
+            key.record_tokens(time.monotonic(), tokens)
+
+    def cool_down(self, key: ApiKey, seconds: float):
+        """Виводить ключ з ротації після 429."""
+        key.rate_limited += 1
+        key.cooldown_until = max(key.cooldown_until, time.monotonic() + seconds)
+        logger.warning("Ключ %s вичерпав ліміт, виведено з ротації на %.0f сек.", key.label, seconds)
+
+    def wait_time(self) -> float:
+        """Через скільки секунд звільниться хоча б один ключ (0 — є доступний зараз)."""
+        if not self._keys:
+            return 0.0
+        now = time.monotonic()
+        return min(key.wait_time(now) for key in self._keys)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """Повертає використання кожного ключа для адмін-панелі."""
+        now = time.monotonic()
+        return [
+            {
+                "label": key.label,
+                "rpm": key.requests_per_minute(now),
+                "tpm": key.tokens_per_minute(now),
+                "requests": key.requests_total,
+                "tokens": key.tokens_total,
+                "rate_limited": key.rate_limited,
+                "cooldown": max(0.0, key.cooldown_until - now),
+                "state": key.breaker.state.value,
+            }
+            for key in self._keys
+        ]
@@ -0,0 +1,156 @@
+"""Облік затримок відповідей моделей Gemini та адаптивні таймаути.
+
+Для кожної моделі ведеться компактна гістограма з фіксованими кошиками
+(межі зростають геометрично, ×1.25), що охоплює останні
+LATENCY_WINDOW_SECONDS. Вікно поділене на частини: коли частина застаріває,
+її лічильники обнуляються, тож гістограма займає сталий обсяг пам'яті.
+"""
+
+import bisect
+import math
+import time
+from typing import Dict, List, Optional, Tuple
+
+from bot.config import runtime_config
+
+# Межі кошиків (в секундах): від 50 мс до ~10 хв; останній кошик — усе, що довше
+BUCKET_BOUNDS: Tuple[float, ...] = tuple(0.05 * 1.25**i for i in range(43))
+
+
+class LatencyHistogram:
+    """Ковзна гістограма затримок однієї моделі."""
+
+    __slots__ = ('slice_seconds', '_slices', '_current', '_epoch')
+
+    def __init__(self, window_seconds: float, slices: int):
+        self.slice_seconds = window_seconds / slices
+        self._slices: List[List[int]] = [[0] * (len(BUCKET_BOUNDS) + 1) for _ in range(slices)]
+        self._current = 0
+        self._epoch = int(time.monotonic() // self.slice_seconds)
+
+    def _advance(self):
+        """Обнуляє частини вікна, що застаріли з часу останнього звернення."""
+        epoch = int(time.monotonic() // self.slice_seconds)
+        steps = epoch - self._epoch
+        if steps <= 0:
+            return
+        for _ in range(min(steps, len(self._slices))):
+            self._current = (self._current + 1) % len(self._slices)
+            slice_counts = self._slices[self._current]
+            for i in range(len(slice_counts)):
+                slice_counts[i] = 0
+        self._epoch = epoch
+
+    def record(self, seconds: float):
+        self._advance()
+        self._slices[self._current][bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+
+    def counts(self) -> List[int]:
+        """Повертає кількість замірів у кожному кошику за все вікно."""
+        self._advance()
+        return [sum(column) for column in zip(*self._slices, strict=True)]
+
+    def percentile(self, quantile: float, counts: Optional[List[int]] = None) -> Optional[float]:
+        """Повертає верхню межу кошика, в який потрапляє перцентиль, або None без замірів."""
+        counts = counts if counts is not None else self.counts()
+        total = sum(counts)
+        if not total:
+            return None
+        rank = max(1, math.ceil(quantile * total))
+        seen = 0
+        for index, count in enumerate(counts):
+            seen += count
+            if seen >= rank:
+                return BUCKET_BOUNDS[min(index, len(BUCKET_BOUNDS) - 1)]
+        return BUCKET_BOUNDS[-1]
+
+
+class LatencyTracker:
+    """Гістограми затримок успішних (та обірваних таймаутом) запитів для кожної моделі."""
+
+    def __init__(self, window_seconds: float, slices: int):
+        self.window_seconds = window_seconds
+        self.slices = slices
+        self._histograms: Dict[str, LatencyHistogram] = {}
+
+    def record(self, model: str, seconds: float):
+        histogram = self._histograms.get(model)
+        if histogram is None:
+            histogram = self._histograms[model] = LatencyHistogram(self.window_seconds, self.slices)
+        histogram.record(seconds)
+
+    def count(self, model: str) -> int:
+        histogram = self._histograms.get(model)
+        return sum(histogram.counts()) if histogram is not None else 0
+
+    def percentile(self, model: str, quantile: float) -> Optional[float]:
+        """Повертає перцентиль затримок моделі або None, якщо замірів ще немає."""
+        histogram = self._histograms.get(model)
+        return histogram.percentile(quantile) if histogram is not None else None
+
+    def snapshot(self) -> List[Dict[str, object]]:
+        """Повертає перцентилі та непорожні кошики кожної моделі для адмін-панелі."""
+        result = []
+        for model, histogram in sorted(self._histograms.items()):
+            counts = histogram.counts()
+            if not any(counts):
+                continue
+            result.append({
+                "model": model,
+                "samples": sum(counts),
+                "p50": histogram.percentile(0.5, counts),
+                "p90": histogram.percentile(0.9, counts),
+                "p99": histogram.percentile(0.99, counts),
+                "timeout": request_timeout(model),
+                "buckets": [
+                    (BUCKET_BOUNDS[min(i, len(BUCKET_BOUNDS) - 1)], count)
+                    for i, count in enumerate(counts)
+                    if count
+                ],
+            })
+        return result
+
+    def reset(self):
+        self._histograms.clear()
+
+
+latency_tracker = LatencyTracker(
+    runtime_config.LATENCY_WINDOW_SECONDS, runtime_config.LATENCY_WINDOW_SLICES
+)
+
+
+def _clamp(value: float, low: float, high: float) -> float:
+    return min(max(value, low), high)
+
+
+def _trusted_percentile(model: str, quantile: float) -> Optional[float]:
+    if latency_tracker.count(model) < runtime_config.LATENCY_MIN_SAMPLES:
+        return None
+    return latency_tracker.percentile(model, quantile)
+
+
+def request_timeout(model: str) -> float:
+    """Таймаут запиту до моделі за її спостереженими затримками."""
+    ceiling = runtime_config.GEMINI_API_TIMEOUT
+    if not runtime_config.ADAPTIVE_TIMEOUTS:
+        return ceiling
+    observed = _trusted_percentile(model, runtime_config.ADAPTIVE_TIMEOUT_PERCENTILE)
+    if observed is None:
+        return ceiling
+    return _clamp(
+        observed * runtime_config.ADAPTIVE_TIMEOUT_MULTIPLIER,
+        runtime_config.ADAPTIVE_TIMEOUT_MIN,
+        ceiling,
+    )
+
+
+def retry_delay(model: str, attempt: int) -> float:
+    """Пауза перед повтором запиту до моделі (експоненційна від медіани затримок)."""
+    base = _trusted_percentile(model, 0.5)
+    if base is None:
+        base = runtime_config.API_RETRY_BASE_DELAY
+    return _clamp(
+        base * (2**attempt),
+        runtime_config.API_RETRY_DELAY_MIN,
+        runtime_config.API_RETRY_DELAY_MAX,
+    )
@@ -0,0 +1,132 @@
+"""Стан здоров'я моделей Gemini для вибору резервної моделі.
+
+Модель, що відповіла таймаутом або перевантаженням (429/503), на час
+MODEL_COOLDOWN вважається деградованою: наступні запити спрямовуються
+до інших моделей ланцюжка, доки період не мине. Якщо інших моделей немає,
+деградована модель використовується далі, поки не розімкнеться її
+запобіжник — тоді запити до неї не надсилаються взагалі.
+"""
+
+import logging
+import time
+from typing import Dict, List, Optional, Sequence
+
+from bot.config import runtime_config
+from bot.services.circuit_breaker import BreakerRegistry
+
+logger = logging.getLogger(__name__)
+
+
+class ModelHealth:
+    """Відстежує збої моделей і тимчасово виключає деградовані моделі."""
+
+    def __init__(
+        self,
+        cooldown: float,
+        failure_threshold: Optional[int] = None,
+        recovery_timeout: Optional[float] = None,
+    ):
+        self.cooldown = cooldown
+        self._degraded_until: Dict[str, float] = {}
+        self._failures: Dict[str, int] = {}
+        self.breakers = BreakerRegistry(
+            failure_threshold=failure_threshold or runtime_config.CIRCUIT_FAILURE_THRESHOLD,
+            recovery_timeout=recovery_timeout or runtime_config.CIRCUIT_RECOVERY_TIMEOUT,
+        )
+
+    def is_healthy(self, model: str) -> bool:
+        """Повертає True, якщо модель не перебуває в періоді охолодження."""
+        until = self._degraded_until.get(model)
+        if until is None:
+            return True
+        if time.monotonic() >= until:
+            del self._degraded_until[model]
+            return True
+        return False
+
+    def record_failure(self, model: str, open_for: Optional[float] = None):
+        """Позначає модель деградованою на час охолодження та рахує збій запобіжника.
+
+        Args:
+            open_for: Розімкнути запобіжник моделі одразу на вказаний час
+                (вичерпана квота, підказка сервера retry-after).
+        """
+        self.breakers.get(model).record_failure(open_for)
+        self._failures[model] = self._failures.get(model, 0) + 1
+        self._degraded_until[model] = time.monotonic() + self.cooldown
+        logger.warning(
+            "Модель %s тимчасово виключена на %d сек (збоїв поспіль: %d).",
+            model,
+            self.cooldown,
+            self._failures[model],
+        )
+
+    def record_success(self, model: str):
+        """Скидає лічильник збоїв моделі після успішної відповіді."""
+        self.breakers.get(model).record_success()
+        self._failures.pop(model, None)
+        self._degraded_until.pop(model, None)
+
+    def release_probe(self, model: str):
+        """Повертає невикористаний пробний запит до моделі (див. CircuitBreaker.release_probe)."""
+        self.breakers.get(model).release_probe()
+
+    def is_available(self, model: str) -> bool:
+        """Чи пропускає запобіжник моделі запити зараз."""
+        return self.breakers.get(model).is_available()
+
+    def peek(self, chain: Sequence[str]) -> Optional[str]:
+        """Повертає модель, яку обрав би pick, не займаючи пробний запит."""
+        for model in chain:
+            if self.is_healthy(model) and self.is_available(model):
+                return model
+        for model in chain:
+            if self.is_available(model):
+                return model
+        return None
+
+    def pick(self, chain: Sequence[str]) -> Optional[str]:
+        """Повертає першу здорову модель ланцюжка.
+
+        Якщо здорових немає, повертає першу деградовану модель із замкненим
+        запобіжником, а якщо розімкнені всі — None.
+        """
+        model = self.peek(chain)
+        if model is not None and not self.breakers.get(model).allow():
+            return None
+        return model
+
+    def remaining_open(self, chain: Sequence[str]) -> float:
+        """Через скільки секунд найшвидше звільниться хоча б одна модель ланцюжка."""
+        return min((self.breakers.get(model).remaining_open() for model in chain), default=0.0)
+
+    def remaining_cooldown(self, model: str) -> Optional[float]:
+        """Повертає, скільки секунд модель ще буде виключена, або None."""
+        if self.is_healthy(model):
+            return None
+        return self._degraded_until[model] - time.monotonic()
+
+    def degraded(self) -> List[str]:
+        """Повертає список моделей, що зараз перебувають в охолодженні."""
+        return [model for model in list(self._degraded_until) if not self.is_healthy(model)]
+
+    def reset(self):
+        self._degraded_until.clear()
+        self._failures.clear()
+        self.breakers.reset()
+
+
+def fallback_chain(primary: str, models_by_priority: Sequence[str]) -> List[str]:
+    """Будує ланцюжок моделей: основна, далі сусідні за пріоритетом.
+
+    Спершу йдуть моделі з меншим значенням priority (швидші та легші),
+    від найближчої до основної, потім — решта в порядку пріоритету.
+    Наприклад, для pro: pro → flash → flash-lite.
+    """
+    if primary not in models_by_priority:
+        return [primary, *models_by_priority]
+    index = list(models_by_priority).index(primary)
+    return [primary, *reversed(models_by_priority[:index]), *models_by_priority[index + 1:]]
+
+
+model_health = ModelHealth(runtime_config.MODEL_COOLDOWN)
@@ -0,0 +1,220 @@
+"""Планувальник одночасних запитів до Gemini API.
+
+Обмежує кількість запитів, що виконуються одночасно: загалом, для кожної
+моделі та для кожного користувача. Запити понад ліміт чекають в обмеженій
+черзі й запускаються по черзі користувачів (round-robin), тож один активний
+користувач не витісняє інших. Якщо черга заповнена, запит одразу
+відхиляється з SchedulerBusyError.
+"""
+
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Mapping, Optional
+
+from bot.config import runtime_config
+
+logger = logging.getLogger(__name__)
+
+
+class SchedulerBusyError(Exception):
+    """Черга запитів заповнена, запит не прийнято."""
+
+
+class _Waiter:
+    """Запит, що очікує вільного слота."""
+
+    __slots__ = ('user_id', 'model', 'future')
+
+    def __init__(self, user_id: int, model: str, future: asyncio.Future):
+        self.user_id = user_id
+        self.model = model
+        self.future = future
+
+
+class GeminiScheduler:
+    """Розподіляє слоти виконання запитів між користувачами та моделями."""
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        per_user_limit: int,
+        max_queue: int,
+        per_user_queue: int,
+        model_limits: Optional[Mapping[str, int]] = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.per_user_limit = per_user_limit
+        self.max_queue = max_queue
+        self.per_user_queue = per_user_queue
+        self.model_limits: Dict[str, int] = dict(model_limits or {})
+
+        self._running = 0
+        self._running_by_user: Dict[int, int] = {}
+        self._running_by_model: Dict[str, int] = {}
+        # Черги очікування по користувачах; порядок ключів задає чергу round-robin
+        self._queues: "OrderedDict[int, Deque[_Waiter]]" = OrderedDict()
+        self._queued = 0
+
+        self.rejected = 0
+        self.waited = 0
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    @asynccontextmanager
+    async def slot(self, user_id: int, model: str) -> AsyncIterator[None]:
+        """Утримує слот виконання запиту користувача до вказаної моделі.
+
+        Raises:
+            SchedulerBusyError: Черга (загальна або користувача) заповнена.
+        """
+        await self._acquire(user_id, model)
+        try:
+            yield
+        finally:
+            self._release(user_id, model)
+
+    async def _acquire(self, user_id: int, model: str):
+        """Займає слот одразу або стає в чергу й чекає на свою чергу."""
+        if not self._queued and self._can_run(user_id, model):
+            self._occupy(user_id, model)
+            return
+
+        user_queue = self._queues.get(user_id)
+        if self._queued >= self.max_queue or (
+            user_queue is not None and len(user_queue) >= self.per_user_queue
+        ):
+            self.rejected += 1
+            logger.warning(
+                "Черга запитів до Gemini заповнена (%d), запит користувача %d відхилено.",
+                self._queued,
+                user_id,
+            )
+            raise SchedulerBusyError()
+
+        waiter = _Waiter(user_id, model, asyncio.get_running_loop().create_future())
+        if user_queue is None:
+            user_queue = self._queues[user_id] = deque()
+        user_queue.append(waiter)
+        self._queued += 1
+        self.waited += 1
+        # Інші запити в черзі можуть чекати на свої ліміти, а цей — ні
+        self._dispatch()
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Слот уже видано, але запит скасовано — повертаємо слот
+                self._release(user_id, model)
+            else:
+                self._remove_waiter(waiter)
+            raise
+
+    def try_acquire_spare(self, user_id: int, model: str) -> bool:
+        """Займає вільний слот для додаткового запиту, якщо ніхто не чекає в черзі.
+
+        Ліміт користувача не враховується: такий запит лише використовує
+        незайняту потужність і не витісняє запити інших користувачів.
+        Слот звільняється через release_spare.
+        """
+        if self._queued or self._running >= self.max_concurrency:
+            return False
+        model_limit = self.model_limits.get(model)
+        if model_limit is not None and self._running_by_model.get(model, 0) >= model_limit:
+            return False
+        self._occupy(user_id, model)
+        return True
+
+    def release_spare(self, user_id: int, model: str):
+        self._release(user_id, model)
+
+    def _can_run(self, user_id: int, model: str) -> bool:
+        """Перевіряє, чи дозволяють ліміти запустити запит зараз."""
+        if self._running >= self.max_concurrency:
+            return False
+        if self._running_by_user.get(user_id, 0) >= self.per_user_limit:
+            return False
+        model_limit = self.model_limits.get(model)
+        return model_limit is None or self._running_by_model.get(model, 0) < model_limit
+
+    def _occupy(self, user_id: int, model: str):
+        self._running += 1
+        self._running_by_user[user_id] = self._running_by_user.get(user_id, 0) + 1
+        self._running_by_model[model] = self._running_by_model.get(model, 0) + 1
+
+    def _release(self, user_id: int, model: str):
+        self._running -= 1
+        for counters, key in ((self._running_by_user, user_id), (self._running_by_model, model)):
+            counters[key] -= 1
+            if not counters[key]:
+                del counters[key]
+        self._dispatch()
+
+    def _remove_waiter(self, waiter: _Waiter):
+        """Прибирає скасований запит з черги."""
+        user_queue = self._queues.get(waiter.user_id)
+        if user_queue is None or waiter not in user_queue:
+            return
+        user_queue.remove(waiter)
+        self._queued -= 1
+        if not user_queue:
+            del self._queues[waiter.user_id]
+        self._dispatch()
+
+    def _dispatch(self):
+        """Видає вільні слоти першим у черзі запитам, по одному на користувача за прохід."""
+        progress = True
+        while progress and self._queued and self._running < self.max_concurrency:
+            progress = False
+            for user_id in list(self._queues):
+                user_queue = self._queues[user_id]
+                # Запити, скасовані в цьому ж проході циклу подій, ще не встигли вийти з черги
+                while user_queue and user_queue[0].future.done():
+                    user_queue.popleft()
+                    self._queued -= 1
+                if not user_queue:
+                    del self._queues[user_id]
+                    continue
+                waiter = user_queue[0]
+                if not self._can_run(user_id, waiter.model):
+                    continue
+
+                user_queue.popleft()
+                self._queued -= 1
+                self._occupy(user_id, waiter.model)
+                waiter.future.set_result(None)
+                progress = True
+
+                # Користувач переходить у кінець черги round-robin
+                if user_queue:
+                    self._queues.move_to_end(user_id)
+                else:
+                    del self._queues[user_id]
+                if self._running >= self.max_concurrency:
+                    return
+
+    def stats(self) -> Dict[str, int]:
+        """Повертає поточне навантаження та лічильники планувальника."""
+        return {
+            "running": self._running,
+            "queued": self._queued,
+            "waited": self.waited,
+            "rejected": self.rejected,
+        }
+
+
+gemini_scheduler = GeminiScheduler(
+    max_concurrency=runtime_config.GEMINI_MAX_CONCURRENCY,
+    per_user_limit=runtime_config.GEMINI_USER_CONCURRENCY,
+    max_queue=runtime_config.GEMINI_QUEUE_SIZE,
+    per_user_queue=runtime_config.GEMINI_USER_QUEUE_SIZE,
+    model_limits=runtime_config.GEMINI_MODEL_CONCURRENCY,
+)
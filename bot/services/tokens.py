@@ -0,0 +1,97 @@
+"""Оцінка кількості токенів та збирання контексту в межах бюджету TOKEN_LIMIT_IN."""
+
+import hashlib
+import logging
+import math
+from typing import Any, Dict, Iterable, List, Optional
+
+from bot.config import runtime_config
+from bot.db.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Умовна ціна службових полів одного повідомлення (роль, розмітка частин)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def _content_key(text: str) -> bytes:
+    """Ключ кешу точних підрахунків — хеш вмісту, а не сам текст."""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+class TokenCounter:
+    """Рахує токени тексту: точно, якщо підрахунок уже відомий, інакше евристикою.
+
+    Евристика рахує байти UTF-8 (≈4 байти на токен), тож кирилиця, яка займає
+    вдвічі більше байтів, оцінюється відповідно дорожче, і оцінка лишається
+    консервативною. Точні значення (з usage_metadata відповідей або
+    count_tokens) зберігаються в обмеженому кеші за хешем вмісту.
+    """
+
+    def __init__(self, max_entries: int):
+        self._exact = TTLCache('token_count_cache', ttl=None, max_entries=max_entries)
+
+    @staticmethod
+    def estimate(text: str) -> int:
+        """Швидка локальна оцінка кількості токенів."""
+        return math.ceil(len(text.encode("utf-8")) / runtime_config.TOKEN_ESTIMATE_BYTES_PER_TOKEN)
+
+    def count(self, text: str) -> int:
+        """Повертає точну кількість токенів, якщо вона відома, інакше оцінку."""
+        exact = self._exact.get(_content_key(text))
+        return exact if exact is not None else self.estimate(text)
+
+    def record(self, text: str, tokens: Any):
+        """Запам'ятовує точну кількість токенів тексту (нечислові значення ігноруються)."""
+        if isinstance(tokens, int) and not isinstance(tokens, bool) and tokens >= 0:
+            self._exact.set(_content_key(text), tokens)
+
+    def unknown(self, texts: Iterable[str]) -> List[str]:
+        """Повертає тексти, для яких ще немає точного підрахунку."""
+        return [text for text in texts if _content_key(text) not in self._exact]
+
+    @property
+    def cache(self) -> TTLCache:
+        return self._exact
+
+
+token_counter = TokenCounter(runtime_config.TOKEN_COUNT_CACHE_MAX_ENTRIES)
+
+
+def message_text(message: Dict[str, Any]) -> str:
+    """Повертає текст повідомлення у форматі контексту Gemini."""
+    return "".join(part.get("text", "") for part in message.get("parts", ()))
+
+
+def build_context_window(
+    history: List[Dict[str, Any]],
+    prompt: str,
+    budget: Optional[int] = None,
+    counter: TokenCounter = token_counter,
+) -> List[Dict[str, Any]]:
+    """Збирає вміст запиту: найновіші повідомлення історії, що вміщуються в бюджет, і запит.
+
+    Історія заповнюється від найновішого повідомлення до найстарішого, доки
+    сума токенів разом із запитом не перевищить `budget` (за замовчуванням
+    TOKEN_LIMIT_IN). Запит користувача включається завжди.
+    """
+    if budget is None:
+        budget = runtime_config.TOKEN_LIMIT_IN
+
+    used = counter.count(prompt) + MESSAGE_OVERHEAD_TOKENS
+    start = len(history)
+    while start > 0:
+        cost = counter.count(message_text(history[start - 1])) + MESSAGE_OVERHEAD_TOKENS
+        if used + cost > budget:
+            break
+        used += cost
+        start -= 1
+
+    if start:
+        logger.debug(
+            "Контекст обрізано за бюджетом токенів: відкинуто %d з %d повідомлень (~%d токенів).",
+            start,
+            len(history),
+            used,
+        )
+    return [*history[start:], {"role": "user", "parts": [{"text": prompt}]}]
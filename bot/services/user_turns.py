@@ -0,0 +1,109 @@
+"""Послідовна обробка повідомлень одного користувача.
+
+Кожен користувач має власну чергу ходів: поки генерується відповідь на одне
+повідомлення, наступне чекає, тож контекст читається й доповнюється
+по черзі. Якщо задано вікно debounce, повідомлення, що надходять одне за
+одним з інтервалом менше за вікно (або поки попередня відповідь ще
+генерується), об'єднуються в один запит.
+"""
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional
+
+from bot.config import runtime_config
+
+logger = logging.getLogger(__name__)
+
+# Роздільник між об'єднаними повідомленнями в одному запиті
+MERGED_MESSAGES_SEPARATOR = "\n\n"
+
+
+class _UserState:
+    """Черга ходів одного користувача."""
+
+    __slots__ = ('lock', 'pending', 'collecting', 'last_message_at', 'refs')
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.pending: List[str] = []
+        self.collecting = False  # Чи є обробник, що збирає наступний запит
+        self.last_message_at = 0.0
+        self.refs = 0  # Скільки обробників зараз працюють з цим станом
+
+
+class UserTurns:
+    """Серіалізує генерацію відповідей для кожного користувача."""
+
+    def __init__(self, debounce: float):
+        """
+        Args:
+            debounce: Вікно об'єднання повідомлень у секундах (0 — без об'єднання)
+        """
+        self.debounce = debounce
+        self._states: Dict[int, _UserState] = {}
+        self.merged = 0
+
+    @asynccontextmanager
+    async def turn(self, user_id: int, text: str) -> AsyncIterator[Optional[str]]:
+        """Чекає на чергу користувача та повертає запит для обробки.
+
+        Повертає None, якщо повідомлення приєднано до запиту іншого обробника —
+        тоді відповідати на нього окремо не потрібно.
+        """
+        state = self._states.get(user_id)
+        if state is None:
+            state = self._states[user_id] = _UserState()
+        state.refs += 1
+        try:
+            if self.debounce <= 0:
+                async with state.lock:
+                    yield text
+                return
+
+            loop = asyncio.get_running_loop()
+            state.pending.append(text)
+            state.last_message_at = loop.time()
+            if state.collecting:
+                self.merged += 1
+                logger.debug("Повідомлення користувача %d об'єднано з попереднім.", user_id)
+                yield None
+                return
+
+            state.collecting = True
+            try:
+                # Вікно зсувається з кожним новим повідомленням
+                while (delay := state.last_message_at + self.debounce - loop.time()) > 0:
+                    await asyncio.sleep(delay)
+                await state.lock.acquire()
+            except BaseException:
+                # Приєднані обробники вже повернули None — без очищення їхні
+                # тексти потрапили б у наступний, не пов'язаний запит
+                if state.pending:
+                    logger.warning(
+                        "Збір запиту користувача %d перервано, відкинуто повідомлень: %d.",
+                        user_id, len(state.pending),
+                    )
+                state.pending.clear()
+                state.collecting = False
+                raise
+
+            try:
+                prompt = MERGED_MESSAGES_SEPARATOR.join(state.pending)
+                state.pending.clear()
+                state.collecting = False
+                yield prompt
+            finally:
+                state.lock.release()
+        finally:
+            state.refs -= 1
+            if not state.refs:
+                del self._states[user_id]
+
+    @property
+    def active_users(self) -> int:
+        return len(self._states)
+
+
+user_turns = UserTurns(runtime_config.MESSAGE_DEBOUNCE_WINDOW)
@@ -1,8 +1,11 @@
+import asyncio
 from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 
 from bot.db.cache import (
+    TTLCache,
+    _warm_up_known_users,
     _warm_up_models_cache,
     _warm_up_settings_cache,
     _warm_up_users_cache,
@@ -31,65 +34,352 @@ async def test_warm_up_settings_cache(mock_get_text_model_name):
     mock_get_text_model_name.assert_called_once()
 
 
-@pytest.mark.asyncio
-@patch("bot.db.cache.get_db_connection")
-@patch("bot.db.user_settings.get_user_role", new_callable=AsyncMock)
-@patch("bot.db.user_settings.get_user_tts_settings", new_callable=AsyncMock)
-async def test_warm_up_users_cache(mock_get_user_tts_settings, mock_get_user_role, mock_get_db_connection):
-    """Тестує _warm_up_users_cache."""
+def _mock_cursor_connection(mock_get_db_connection, batches):
+    """Налаштовує мок з'єднання з серверним курсором, що повертає пакети рядків."""
+    mock_cursor = MagicMock()
+    mock_cursor.fetch = AsyncMock(side_effect=[*batches, []])
     mock_conn = MagicMock()
-    mock_conn.fetch = AsyncMock(return_value=[{"user_id": USER_ID}])
+    mock_conn.cursor = AsyncMock(return_value=mock_cursor)
+    mock_conn.transaction.return_value.__aenter__ = AsyncMock()
+    mock_conn.transaction.return_value.__aexit__ = AsyncMock(return_value=False)
     mock_get_db_connection.return_value.__aenter__.return_value = mock_conn
+    return mock_conn
+
+
+@pytest.mark.asyncio
+@patch("bot.db.cache.get_db_connection")
+async def test_warm_up_users_cache(mock_get_db_connection):
+    """Тестує, що _warm_up_users_cache заповнює кеш одним запитом без звернень на кожного користувача."""
+    from bot.db import cache
+    cache.user_cache.clear()
+    row = {"user_id": USER_ID, "role": "admin", "tts_enabled": False, "tts_voice": "male"}
+    mock_conn = _mock_cursor_connection(mock_get_db_connection, [[row]])
+
+    await _warm_up_users_cache()
+
+    mock_conn.cursor.assert_awaited_once()
+    assert "LIMIT $1" in mock_conn.cursor.call_args[0][0]
+    assert cache.user_cache.get((USER_ID, "role")) == "admin"
+    assert cache.user_cache.get((USER_ID, "tts_settings")) == {"tts_enabled": False, "tts_voice": "male"}
+
+
+@pytest.mark.asyncio
+@patch("bot.db.cache.get_db_connection")
+async def test_warm_up_users_cache_keeps_fresher_entries(mock_get_db_connection):
+    """Тестує, що прогрів не перезаписує вже закешовані дані користувача."""
+    from bot.db import cache
+    cache.user_cache.clear()
+    cache.user_cache.set((USER_ID, "role"), "user")
+    row = {"user_id": USER_ID, "role": "admin", "tts_enabled": True, "tts_voice": "female"}
+    _mock_cursor_connection(mock_get_db_connection, [[row]])
 
     await _warm_up_users_cache()
 
-    mock_get_user_role.assert_called_once_with(USER_ID)
-    mock_get_user_tts_settings.assert_called_once_with(USER_ID)
+    assert cache.user_cache.get((USER_ID, "role")) == "user"
+
+
+@pytest.mark.asyncio
+@patch("bot.db.cache.get_db_connection")
+async def test_warm_up_known_users(mock_get_db_connection):
+    """Тестує, що прогрів завантажує ID усіх користувачів пакетами."""
+    from bot.db import cache
+    cache.known_users.clear()
+    _mock_cursor_connection(mock_get_db_connection, [[{"user_id": 1}, {"user_id": 2}], [{"user_id": 3}]])
+
+    await _warm_up_known_users()
+
+    assert all(cache.is_user_known(user_id) for user_id in (1, 2, 3))
+    assert not cache.is_user_known(4)
+    cache.known_users.clear()
 
 
 @pytest.mark.asyncio
 @patch("bot.db.cache._warm_up_models_cache", new_callable=AsyncMock)
 @patch("bot.db.cache._warm_up_settings_cache", new_callable=AsyncMock)
+@patch("bot.db.cache._warm_up_known_users", new_callable=AsyncMock)
 @patch("bot.db.cache._warm_up_users_cache", new_callable=AsyncMock)
-async def test_warm_up_caches(mock_warm_up_users_cache, mock_warm_up_settings_cache, mock_warm_up_models_cache):
-    """Тестує warm_up_caches."""
+async def test_warm_up_caches(
+    mock_warm_up_users_cache, mock_warm_up_known_users, mock_warm_up_settings_cache, mock_warm_up_models_cache
+):
+    """Тестує warm_up_caches: кеш користувачів прогрівається у фоновій задачі."""
+    from bot.db.cache import stop_cache_tasks
     await warm_up_caches()
     mock_warm_up_models_cache.assert_called_once()
     mock_warm_up_settings_cache.assert_called_once()
-    mock_warm_up_users_cache.assert_called_once()
+
+    await asyncio.sleep(0)
+    mock_warm_up_known_users.assert_awaited_once()
+    mock_warm_up_users_cache.assert_awaited_once()
+    await stop_cache_tasks()
 
 
 def test_invalidate_settings_cache():
     """Тестує invalidate_settings_cache."""
     from bot.db import cache
-    cache.settings_cache = {"test_key": "test_value"}
+    cache.settings_cache.set("test_key", "test_value")
     invalidate_settings_cache("test_key")
     assert "test_key" not in cache.settings_cache
 
-    cache.settings_cache = {"test_key": "test_value"}
+    cache.settings_cache.set("test_key", "test_value")
     invalidate_settings_cache("non_existent_key")
     assert "test_key" in cache.settings_cache
 
-    cache.settings_cache = {"test_key": "test_value"}
     invalidate_settings_cache()
-    assert not cache.settings_cache
+    assert len(cache.settings_cache) == 0
 
 
 def test_invalidate_models_cache():
     """Тестує invalidate_models_cache."""
     from bot.db import cache
-    cache.models_cache = {"test": "test"}
+    cache.models_cache.set(cache.MODELS_CACHE_KEY, ["test"])
     invalidate_models_cache()
-    assert cache.models_cache is None
+    assert cache.MODELS_CACHE_KEY not in cache.models_cache
 
 
 def test_invalidate_user_cache():
     """Тестує invalidate_user_cache."""
     from bot.db import cache
-    cache.user_cache = {USER_ID: {"test_key": "test_value"}}
-    invalidate_user_cache(USER_ID, "test_key")
-    assert "test_key" not in cache.user_cache[USER_ID]
+    cache.user_cache.set((USER_ID, "role"), "user")
+    cache.user_cache.set((USER_ID, "tts_settings"), {"tts_enabled": True})
+    invalidate_user_cache(USER_ID, "role")
+    assert (USER_ID, "role") not in cache.user_cache
+    assert (USER_ID, "tts_settings") in cache.user_cache
 
-    cache.user_cache = {USER_ID: {"test_key": "test_value"}}
+    cache.user_cache.set((USER_ID, "role"), "user")
     invalidate_user_cache(USER_ID)
-    assert USER_ID not in cache.user_cache
\ No newline at end of file
+    assert (USER_ID, "role") not in cache.user_cache
+    assert (USER_ID, "tts_settings") not in cache.user_cache
+
+
+class TestTTLCache:
+    """Тести для класу TTLCache."""
+
+    def test_get_set_and_counters(self):
+        """Тестує базові операції та лічильники влучань/промахів."""
+        ttl_cache = TTLCache("test", ttl=60)
+        assert ttl_cache.get("a") is None
+        ttl_cache.set("a", 1)
+        assert ttl_cache.get("a") == 1
+
+        stats = ttl_cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["hit_rate"] == 0.5
+
+    def test_none_value_with_missing_sentinel(self):
+        """Тестує, що None можна закешувати й відрізнити від промаху."""
+        from bot.db.cache import MISSING
+        ttl_cache = TTLCache("test", ttl=60)
+        assert ttl_cache.get("a", MISSING) is MISSING
+        ttl_cache.set("a", None)
+        assert ttl_cache.get("a", MISSING) is None
+
+    def test_lazy_expiry(self):
+        """Тестує, що прострочений запис видаляється при зверненні."""
+        ttl_cache = TTLCache("test", ttl=10)
+        with patch("bot.db.cache.time.monotonic", return_value=100.0):
+            ttl_cache.set("a", 1)
+        with patch("bot.db.cache.time.monotonic", return_value=111.0):
+            assert ttl_cache.get("a") is None
+        assert len(ttl_cache) == 0
+        assert ttl_cache.expirations == 1
+
+    def test_purge_expired(self):
+        """Тестує періодичне видалення прострочених записів."""
+        ttl_cache = TTLCache("test", ttl=10)
+        with patch("bot.db.cache.time.monotonic", return_value=100.0):
+            ttl_cache.set("a", 1)
+        with patch("bot.db.cache.time.monotonic", return_value=105.0):
+            ttl_cache.set("b", 2)
+        with patch("bot.db.cache.time.monotonic", return_value=112.0):
+            assert ttl_cache.purge_expired() == 1
+            assert [key for key, _, _ in ttl_cache.items()] == ["b"]
+
+    def test_max_entries_lru_eviction(self):
+        """Тестує витіснення найдавніше використаного запису."""
+        ttl_cache = TTLCache("test", ttl=None, max_entries=2)
+        ttl_cache.set("a", 1)
+        ttl_cache.set("b", 2)
+        ttl_cache.get("a")  # "a" тепер найнещодавніший
+        ttl_cache.set("c", 3)
+
+        assert "a" in ttl_cache
+        assert "b" not in ttl_cache
+        assert ttl_cache.evictions == 1
+
+    def test_max_bytes_eviction(self):
+        """Тестує витіснення при перевищенні бюджету пам'яті."""
+        from bot.db.cache import estimate_size
+        value = "x" * 100
+        ttl_cache = TTLCache("test", ttl=None, max_bytes=estimate_size(value) * 2)
+        for key in ("a", "b", "c"):
+            ttl_cache.set(key, value)
+
+        assert len(ttl_cache) == 2
+        assert ttl_cache.bytes == estimate_size(value) * 2
+        ttl_cache.clear()
+        assert ttl_cache.bytes == 0
+
+    def test_forgotten_invalidations_are_treated_as_recent(self, monkeypatch):
+        """Тестує, що обмежена історія інвалідацій не пропускає застарілі завантаження."""
+        monkeypatch.setattr("bot.db.cache.INVALIDATION_HISTORY_SIZE", 2)
+        ttl_cache = TTLCache("test", ttl=60)
+        generation = ttl_cache.generation
+
+        for key in ("a", "b", "c"):
+            ttl_cache.delete(key)
+
+        assert not ttl_cache.is_valid_since("a", generation)
+        assert not ttl_cache.is_valid_since("untouched", generation)
+        assert ttl_cache.is_valid_since("untouched", ttl_cache.generation)
+
+
+@pytest.mark.asyncio
+class TestTTLCacheSingleFlight:
+    """Тести для об'єднання промахів та stale-while-revalidate."""
+
+    async def test_concurrent_misses_share_one_load(self):
+        """Тестує, що одночасні промахи за одним ключем викликають loader один раз."""
+        ttl_cache = TTLCache("test", ttl=60)
+        release = asyncio.Event()
+        calls = []
+
+        async def _load():
+            calls.append(1)
+            await release.wait()
+            return "value"
+
+        waiters = [asyncio.create_task(ttl_cache.get_or_load("key", _load)) for _ in range(5)]
+        await asyncio.sleep(0)
+        release.set()
+
+        assert await asyncio.gather(*waiters) == ["value"] * 5
+        assert len(calls) == 1
+        assert ttl_cache.coalesced == 4
+        assert ttl_cache.get("key") == "value"
+
+    async def test_loader_error_propagates_and_is_not_cached(self):
+        """Тестує, що помилка завантаження отримують усі очікувачі, а кеш лишається порожнім."""
+        ttl_cache = TTLCache("test", ttl=60)
+        loader = AsyncMock(side_effect=OSError("db down"))
+
+        with pytest.raises(OSError):
+            await ttl_cache.get_or_load("key", loader)
+        assert "key" not in ttl_cache
+
+    async def test_cache_none_disabled(self):
+        """Тестує, що None не кешується при cache_none=False."""
+        ttl_cache = TTLCache("test", ttl=60)
+        loader = AsyncMock(return_value=None)
+
+        assert await ttl_cache.get_or_load("key", loader, cache_none=False) is None
+        assert await ttl_cache.get_or_load("key", loader, cache_none=False) is None
+        assert loader.await_count == 2
+
+    async def test_invalidation_during_load_discards_result(self):
+        """Тестує, що результат завантаження, розпочатого до інвалідації, не кешується."""
+        ttl_cache = TTLCache("test", ttl=60)
+        release = asyncio.Event()
+
+        async def _load():
+            await release.wait()
+            return "old"
+
+        waiter = asyncio.create_task(ttl_cache.get_or_load("key", _load))
+        await asyncio.sleep(0)
+        ttl_cache.delete("key")
+        release.set()
+
+        assert await waiter == "old"
+        assert "key" not in ttl_cache
+
+    async def test_invalidating_other_key_keeps_load(self):
+        """Тестує, що інвалідація іншого ключа не відкидає завантаження, що триває."""
+        ttl_cache = TTLCache("test", ttl=60)
+        release = asyncio.Event()
+
+        async def _load():
+            await release.wait()
+            return "value"
+
+        waiter = asyncio.create_task(ttl_cache.get_or_load("key", _load))
+        await asyncio.sleep(0)
+        ttl_cache.delete("other")
+        release.set()
+
+        assert await waiter == "value"
+        assert ttl_cache.get("key") == "value"
+
+    async def test_clear_during_load_discards_result(self):
+        """Тестує, що clear відкидає завантаження всіх ключів, розпочаті до нього."""
+        ttl_cache = TTLCache("test", ttl=60)
+        release = asyncio.Event()
+
+        async def _load():
+            await release.wait()
+            return "old"
+
+        waiter = asyncio.create_task(ttl_cache.get_or_load("key", _load))
+        await asyncio.sleep(0)
+        ttl_cache.clear()
+        release.set()
+
+        assert await waiter == "old"
+        assert "key" not in ttl_cache
+
+    async def test_stale_while_revalidate(self):
+        """Тестує, що застаріле значення віддається одразу, а оновлення йде у фоні."""
+        ttl_cache = TTLCache("test", ttl=10, stale_ttl=30)
+        with patch("bot.db.cache.time.monotonic", return_value=100.0):
+            ttl_cache.set("key", "old")
+
+        loader = AsyncMock(return_value="new")
+        with patch("bot.db.cache.time.monotonic", return_value=115.0):
+            assert await ttl_cache.get_or_load("key", loader) == "old"
+            await asyncio.sleep(0)  # Даємо фоновій задачі завершитись
+            await asyncio.sleep(0)
+            assert await ttl_cache.get_or_load("key", loader) == "new"
+
+        loader.assert_awaited_once()
+        assert ttl_cache.stale_hits == 1
+
+    async def test_stale_window_exceeded_reloads(self):
+        """Тестує, що за межами stale_ttl значення завантажується синхронно."""
+        ttl_cache = TTLCache("test", ttl=10, stale_ttl=30)
+        with patch("bot.db.cache.time.monotonic", return_value=100.0):
+            ttl_cache.set("key", "old")
+
+        loader = AsyncMock(return_value="new")
+        with patch("bot.db.cache.time.monotonic", return_value=150.0):
+            assert await ttl_cache.get_or_load("key", loader) == "new"
+
+
+def test_context_cache_ring_buffer():
+    """Тестує кільцевий буфер кешу контексту."""
+    from bot.db import cache
+    cache.invalidate_context_cache()
+
+    with patch("bot.db.cache.runtime_config") as mock_config:
+        mock_config.CONTEXT_MESSAGE_LIMIT = 2
+
+        assert cache.get_cached_context(USER_ID) is None
+        cache.set_cached_context(USER_ID, [("user", "a"), ("model", "b"), ("user", "c")])
+        cache.append_cached_context(USER_ID, "model", "d")
+
+        assert cache.get_cached_context(USER_ID) == [("user", "c"), ("model", "d")]
+
+    cache.invalidate_context_cache()
+    assert cache.context_cache.bytes == 0
+
+
+def test_append_to_uncached_context_invalidates_only_that_user():
+    """Тестує, що запис для користувача поза кешем інвалідує лише його ключ кешу контексту."""
+    from bot.db import cache
+    cache.invalidate_context_cache()
+    generation = cache.context_cache.generation
+
+    cache.append_cached_context(USER_ID, "user", "a")
+
+    assert not cache.context_cache.is_valid_since(USER_ID, generation)
+    assert cache.context_cache.is_valid_since(USER_ID + 1, generation)
+    assert cache.get_cached_context(USER_ID) is None
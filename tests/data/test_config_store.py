@@ -9,7 +9,7 @@ from unittest.mock import AsyncMock, patch
 @pytest.fixture(autouse=True)
 def reset_cache():
     from bot.db import cache
-    cache.settings_cache = {}
+    cache.settings_cache.clear()
 
 from bot.db.config_store import (
     get_setting,
@@ -39,3 +39,85 @@ async def test_init_db_fails_after_all_retries(mock_get_db_connection, mock_slee
 
     # Перевіряємо, що було 5 спроб підключення (за замовчуванням)
     assert mock_get_db_connection.call_count == 5
+
+
+@pytest.fixture
+def reset_pool():
+    from bot.db import database
+    database._pool = None
+    yield
+    database._pool = None
+
+
+@pytest.mark.asyncio
+@patch('bot.db.database.asyncpg.create_pool', new_callable=AsyncMock)
+async def test_create_pool_uses_runtime_config(mock_create_pool, reset_pool):
+    """Тестує, що пул створюється один раз з параметрами з runtime_config."""
+    from bot.config import runtime_config
+    from bot.db.database import create_pool, get_db_pool
+
+    pool = await create_pool()
+    again = await create_pool()
+
+    assert pool is again
+    assert get_db_pool() is pool
+    mock_create_pool.assert_awaited_once()
+    kwargs = mock_create_pool.call_args.kwargs
+    assert kwargs['min_size'] == runtime_config.DB_POOL_MIN_SIZE
+    assert kwargs['max_size'] == runtime_config.DB_POOL_MAX_SIZE
+    assert kwargs['statement_cache_size'] == runtime_config.DB_STATEMENT_CACHE_SIZE
+    assert kwargs['server_settings'] == {'search_path': runtime_config.DB_SEARCH_PATH}
+
+
+@pytest.mark.asyncio
+async def test_get_db_connection_acquires_from_pool(reset_pool):
+    """Тестує, що get_db_connection бере з'єднання з пулу і повертає його."""
+    from bot.db import database
+    from bot.db.database import get_db_connection
+
+    mock_conn = AsyncMock()
+    mock_pool = AsyncMock()
+    mock_pool.acquire = AsyncMock(return_value=mock_conn)
+    database._pool = mock_pool
+
+    with patch('bot.db.database.asyncpg.connect', new_callable=AsyncMock) as mock_connect:
+        async with get_db_connection() as conn:
+            assert conn is mock_conn
+        mock_connect.assert_not_called()
+
+    mock_pool.acquire.assert_awaited_once()
+    mock_pool.release.assert_awaited_once_with(mock_conn)
+
+
+@pytest.mark.asyncio
+async def test_get_db_connection_releases_on_error(reset_pool):
+    """Тестує, що з'єднання повертається в пул навіть при помилці в запиті."""
+    from bot.db import database
+    from bot.db.database import get_db_connection
+
+    mock_conn = AsyncMock()
+    mock_pool = AsyncMock()
+    mock_pool.acquire = AsyncMock(return_value=mock_conn)
+    database._pool = mock_pool
+
+    with pytest.raises(RuntimeError):
+        async with get_db_connection():
+            raise RuntimeError("query failed")
+
+    mock_pool.release.assert_awaited_once_with(mock_conn)
+
+
+@pytest.mark.asyncio
+async def test_close_pool(reset_pool):
+    """Тестує закриття пулу."""
+    from bot.db import database
+    from bot.db.database import close_pool, get_db_pool
+
+    mock_pool = AsyncMock()
+    database._pool = mock_pool
+
+    await close_pool()
+    await close_pool()  # Повторний виклик нічого не робить
+
+    mock_pool.close.assert_awaited_once()
+    assert get_db_pool() is None
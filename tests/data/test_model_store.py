@@ -2,13 +2,13 @@
 Unit tests for bot.db.model_store module.
 """
 import pytest
-from unittest.mock import AsyncMock, patch, MagicMock
+from unittest.mock import AsyncMock, patch
 
 # Очищення кешу перед кожним тестом
 @pytest.fixture(autouse=True)
 def reset_cache():
     from bot.db import cache
-    cache.models_cache = None
+    cache.models_cache.clear()
 
 from bot.db.model_store import sync_models, get_available_models, _get_model_priority
 
@@ -45,8 +45,8 @@ class TestSyncModels:
         """Test sync when models are already up to date."""
         mock_conn = AsyncMock()
         mock_conn.fetch = AsyncMock(return_value=[
-            {'model_name': 'models/gemini-2.5-flash'},
-            {'model_name': 'models/gemini-2.5-pro'}
+            {'model_name': 'models/gemini-2.5-flash', 'is_available': True},
+            {'model_name': 'models/gemini-2.5-pro', 'is_available': True}
         ])
 
         with patch('bot.db.model_store.get_db_connection') as mock_get_conn:
@@ -55,23 +55,17 @@ class TestSyncModels:
             api_models = ['models/gemini-2.5-flash', 'models/gemini-2.5-pro']
             await sync_models(api_models)
 
-            # Should not delete or insert since models match
+            # Should not write anything since models match
             assert mock_conn.execute.call_count == 0
+            mock_conn.executemany.assert_not_called()
 
     async def test_sync_models_with_changes(self):
-        """Test sync when models need updating."""
+        """Test sync writes only the difference in a single executemany."""
         mock_conn = AsyncMock()
         mock_conn.fetch = AsyncMock(return_value=[
-            {'model_name': 'models/old-model'}
+            {'model_name': 'models/old-model', 'is_available': True},
+            {'model_name': 'models/gemini-2.5-flash', 'is_available': True},
         ])
-        mock_conn.execute = AsyncMock()
-        mock_conn.transaction = MagicMock()
-
-        # Mock transaction context manager
-        mock_transaction = AsyncMock()
-        mock_transaction.__aenter__ = AsyncMock()
-        mock_transaction.__aexit__ = AsyncMock()
-        mock_conn.transaction.return_value = mock_transaction
 
         with patch('bot.db.model_store.get_db_connection') as mock_get_conn:
             mock_get_conn.return_value.__aenter__ = AsyncMock(return_value=mock_conn)
@@ -79,8 +73,31 @@ class TestSyncModels:
             api_models = ['models/gemini-2.5-flash', 'models/gemini-2.5-pro']
             await sync_models(api_models)
 
-            # Should delete old models and insert new ones
-            assert mock_conn.execute.call_count == 3  # 1 DELETE + 2 INSERTs
+            # No DELETE, no per-model INSERT: one batched upsert for the difference
+            mock_conn.execute.assert_not_called()
+            mock_conn.executemany.assert_called_once()
+            query, rows = mock_conn.executemany.call_args[0]
+            assert "ON CONFLICT (model_name) DO UPDATE SET is_available" in query
+            assert "priority" not in query.split("DO UPDATE")[1]
+            assert rows == [
+                ('models/gemini-2.5-pro', 3, True),
+                ('models/old-model', 100, False),
+            ]
+
+    async def test_sync_models_restores_returned_model(self):
+        """Test a model that reappears in the API becomes available again."""
+        mock_conn = AsyncMock()
+        mock_conn.fetch = AsyncMock(return_value=[
+            {'model_name': 'models/gemini-2.5-pro', 'is_available': False},
+        ])
+
+        with patch('bot.db.model_store.get_db_connection') as mock_get_conn:
+            mock_get_conn.return_value.__aenter__ = AsyncMock(return_value=mock_conn)
+
+            await sync_models(['models/gemini-2.5-pro'])
+
+            rows = mock_conn.executemany.call_args[0][1]
+            assert rows == [('models/gemini-2.5-pro', 3, True)]
 
 @pytest.mark.asyncio
 class TestGetAvailableModels:
@@ -137,13 +154,8 @@ class TestGetAvailableModels:
         """Test that available models are cached."""
         mock_conn = AsyncMock()
         mock_conn.fetch = AsyncMock(return_value=[
-            {'model_name': 'models/gemini-2.5-flash'}
+            {'model_name': 'models/gemini-2.5-flash', 'is_available': True}
         ])
-        mock_conn.transaction = MagicMock()
-        mock_transaction = AsyncMock()
-        mock_transaction.__aenter__ = AsyncMock()
-        mock_transaction.__aexit__ = AsyncMock()
-        mock_conn.transaction.return_value = mock_transaction
 
         with patch('bot.db.model_store.get_db_connection') as mock_get_conn:
             mock_get_conn.return_value.__aenter__ = AsyncMock(return_value=mock_conn)
@@ -1,6 +1,8 @@
 """
 Unit tests for data.user_settings module.
 """
+import asyncio
+
 import pytest
 from unittest.mock import AsyncMock, patch, MagicMock
 from aiogram.types import User
@@ -9,10 +11,13 @@ from aiogram.types import User
 @pytest.fixture(autouse=True)
 def reset_cache():
     from bot.db import cache
-    cache.user_cache = {}
+    cache.user_cache.clear()
+    cache.profile_cache.clear()
+    cache.known_users.clear()
+    cache.invalidate_context_cache()
 
 from bot.db.user_settings import (
-    register_user_if_not_exists,
+    resolve_user_context,
     get_user_role,
     update_user_role,
     get_user_tts_settings,
@@ -20,76 +25,162 @@ from bot.db.user_settings import (
     update_user_tts_voice,
     get_user_context,
     add_message_to_context,
-    clear_user_context
+    clear_user_context,
+    _ChatHistoryWriter,
 )
 
 
+def _tg_user(user_id):
+    """Створює мок користувача Telegram."""
+    user = MagicMock(spec=User)
+    user.id = user_id
+    user.username = "user"
+    user.full_name = "Test User"
+    user.last_name = "User"
+    return user
+
+
 @pytest.mark.asyncio
-class TestUserRegistration:
-    """Tests for user registration and role management."""
+class TestResolveUserContext:
+    """Tests for resolving the per-update user context."""
 
-    async def test_register_new_user(self, mock_settings):
-        """Test registering a new user."""
+    async def test_resolves_with_one_query_and_fills_cache(self):
+        """A cache miss for a known user costs one read and fills role and TTS caches."""
+        from bot.db import cache
+        cache.mark_user_known(555)
         mock_conn = AsyncMock()
-        mock_conn.fetchrow = AsyncMock(return_value=None)
-        mock_conn.execute = AsyncMock()
-
-        mock_user = MagicMock(spec=User)
-        mock_user.id = 987654321
-        mock_user.username = "testuser"
-        mock_user.full_name = "Test User"
-        mock_user.last_name = "User"
+        mock_conn.fetchrow = AsyncMock(return_value={
+            'role': 'admin', 'tts_enabled': False, 'tts_voice': 'male',
+        })
 
         with patch('bot.db.user_settings.get_db_connection') as mock_get_conn:
             mock_get_conn.return_value.__aenter__ = AsyncMock(return_value=mock_conn)
 
-            await register_user_if_not_exists(mock_user)
+            context = await resolve_user_context(_tg_user(555))
 
-            mock_conn.execute.assert_called_once()
-            call_args = mock_conn.execute.call_args[0]
-            assert "INSERT INTO users" in call_args[0]
-            assert call_args[1] == 987654321
-            assert call_args[5] == "user"  # role should be 'user'
+            mock_conn.fetchrow.assert_awaited_once()
+            assert mock_conn.fetchrow.call_args[0][0].lstrip().startswith("SELECT")
+            assert context.is_admin and not context.is_owner
+            assert context.tts_settings == {"tts_enabled": False, "tts_voice": "male"}
+            assert cache.user_cache.get((555, 'role')) == 'admin'
+
+            # Наступне оновлення обслуговується з кешу
+            mock_get_conn.reset_mock()
+            again = await resolve_user_context(_tg_user(555))
+            assert again == context
+            mock_get_conn.assert_not_called()
 
-    async def test_register_owner(self, mock_settings):
-        """Test registering owner gets 'owner' role."""
+    async def test_new_user_registered_by_same_query(self):
+        """Unknown users are inserted by a single INSERT ... RETURNING."""
+        from bot.db import cache
         mock_conn = AsyncMock()
-        mock_conn.fetchrow = AsyncMock(return_value=None)
-        mock_conn.execute = AsyncMock()
+        mock_conn.fetchrow = AsyncMock(return_value={
+            'role': 'user', 'tts_enabled': True, 'tts_voice': 'female',
+        })
 
-        mock_user = MagicMock(spec=User)
-        mock_user.id = 123456789  # Same as mock_settings.OWNER_ID
-        mock_user.username = "owner"
-        mock_user.full_name = "Owner"
-        mock_user.last_name = "User"
+        with patch('bot.db.user_settings.get_db_connection') as mock_get_conn:
+            mock_get_conn.return_value.__aenter__ = AsyncMock(return_value=mock_conn)
 
-        with patch('bot.db.user_settings.settings') as patched_settings:
-            patched_settings.OWNER_ID = 123456789
+            context = await resolve_user_context(_tg_user(777))
+
+            mock_conn.fetchrow.assert_awaited_once()
+            args = mock_conn.fetchrow.call_args[0]
+            assert "ON CONFLICT (user_id) DO NOTHING" in args[0]
+            assert args[1] == 777
+            assert args[5] == 'user'
+            assert context.role == 'user'
+            assert cache.is_user_known(777)
+            mock_conn.execute.assert_not_called()
+
+    async def test_new_owner_registered_as_owner(self):
+        """The owner is inserted with the 'owner' role."""
+        mock_conn = AsyncMock()
+        mock_conn.fetchrow = AsyncMock(return_value={
+            'role': 'owner', 'tts_enabled': True, 'tts_voice': 'female',
+        })
 
+        with patch('bot.db.user_settings.settings') as patched_settings:
+            patched_settings.OWNER_ID = 42
             with patch('bot.db.user_settings.get_db_connection') as mock_get_conn:
                 mock_get_conn.return_value.__aenter__ = AsyncMock(return_value=mock_conn)
 
-                await register_user_if_not_exists(mock_user)
+                context = await resolve_user_context(_tg_user(42))
 
-                call_args = mock_conn.execute.call_args[0]
-                assert call_args[5] == "owner"  # role should be 'owner'
+                assert mock_conn.fetchrow.call_args[0][5] == 'owner'
+                assert context.is_owner
 
-    async def test_existing_user_not_reregistered(self, mock_settings):
-        """Test that existing users are not re-registered."""
+    async def test_existing_user_not_reregistered(self):
+        """An unknown id that already exists is read after a no-op insert and becomes known."""
+        from bot.db import cache
         mock_conn = AsyncMock()
-        mock_conn.fetchrow = AsyncMock(return_value={'user_id': 123, 'role': 'user'})
-        mock_conn.execute = AsyncMock()
+        mock_conn.fetchrow = AsyncMock(side_effect=[
+            None,  # INSERT ... ON CONFLICT DO NOTHING: рядок вже існує
+            {'role': 'user', 'tts_enabled': True, 'tts_voice': 'female'},
+        ])
+
+        with patch('bot.db.user_settings.get_db_connection') as mock_get_conn:
+            mock_get_conn.return_value.__aenter__ = AsyncMock(return_value=mock_conn)
+
+            context = await resolve_user_context(_tg_user(123))
+
+            assert context.role == 'user'
+            assert cache.is_user_known(123)
+            # Лише умовне оновлення профілю, без повторної вставки
+            mock_conn.execute.assert_called_once()
+            assert "UPDATE users SET username" in mock_conn.execute.call_args[0][0]
 
-        mock_user = MagicMock(spec=User)
-        mock_user.id = 123
-        mock_user.username = "existing"
+    async def test_known_user_costs_no_queries(self):
+        """A cached user with an unchanged profile touches no connection."""
+        from bot.db import cache
+        cache.mark_user_known(321)
+        cache.user_cache.set((321, 'role'), 'user')
+        cache.user_cache.set((321, 'tts_settings'), {"tts_enabled": True, "tts_voice": "female"})
+        cache.profile_cache.set(321, ("user", "Test User", "User"))
+
+        with patch('bot.db.user_settings.get_db_connection') as mock_get_conn:
+            for _ in range(3):
+                await resolve_user_context(_tg_user(321))
+
+            mock_get_conn.assert_not_called()
+
+    async def test_profile_refresh_when_name_changes(self):
+        """A renamed cached user gets exactly one profile update."""
+        from bot.db import cache
+        cache.user_cache.set((321, 'role'), 'user')
+        cache.user_cache.set((321, 'tts_settings'), {"tts_enabled": True, "tts_voice": "female"})
+        cache.profile_cache.set(321, ("old", "Test User", "User"))
+        mock_conn = AsyncMock()
 
         with patch('bot.db.user_settings.get_db_connection') as mock_get_conn:
             mock_get_conn.return_value.__aenter__ = AsyncMock(return_value=mock_conn)
 
-            await register_user_if_not_exists(mock_user)
+            await resolve_user_context(_tg_user(321))
+            await resolve_user_context(_tg_user(321))
 
-            mock_conn.execute.assert_not_called()
+            mock_conn.execute.assert_called_once()
+            assert mock_conn.execute.call_args[0][1:] == (321, "user", "Test User", "User")
+
+    async def test_owner_role_restored(self):
+        """The owner's role is restored if the database says otherwise."""
+        mock_conn = AsyncMock()
+        mock_conn.fetchrow = AsyncMock(return_value={
+            'role': 'user', 'tts_enabled': True, 'tts_voice': 'female',
+        })
+        from bot.db import cache
+        cache.mark_user_known(42)
+
+        with patch('bot.db.user_settings.settings') as patched_settings:
+            patched_settings.OWNER_ID = 42
+            with patch('bot.db.user_settings.get_db_connection') as mock_get_conn:
+                mock_get_conn.return_value.__aenter__ = AsyncMock(return_value=mock_conn)
+
+                context = await resolve_user_context(_tg_user(42))
+
+                assert context.role == 'owner'
+                assert context.is_owner
+                update_call = mock_conn.execute.call_args_list[0][0]
+                assert "UPDATE users SET role" in update_call[0]
+                assert update_call[1] == 'owner'
 
 
 @pytest.mark.asyncio
@@ -221,9 +312,10 @@ class TestChatContext:
     async def test_get_user_context(self):
         """Test retrieving user context."""
         mock_conn = AsyncMock()
+        # БД повертає найновіші записи першими
         mock_conn.fetch = AsyncMock(return_value=[
-            {'role': 'user', 'content': 'Hello'},
-            {'role': 'model', 'content': 'Hi there!'}
+            {'role': 'model', 'content': 'Hi there!'},
+            {'role': 'user', 'content': 'Hello'}
         ])
 
         with patch('bot.db.user_settings.get_db_connection') as mock_get_conn:
@@ -237,6 +329,22 @@ class TestChatContext:
             assert context[0]['parts'][0]['text'] == 'Hello'
             assert context[1]['role'] == 'model'
 
+    async def test_get_user_context_limit_in_sql(self):
+        """Test that the context window limit is pushed into the SQL query."""
+        mock_conn = AsyncMock()
+        mock_conn.fetch = AsyncMock(return_value=[])
+
+        with patch('bot.db.user_settings.get_db_connection') as mock_get_conn:
+            mock_get_conn.return_value.__aenter__ = AsyncMock(return_value=mock_conn)
+            mock_get_conn.return_value.__aexit__ = AsyncMock()
+
+            await get_user_context(123, limit=50)
+
+            query, user_id, limit = mock_conn.fetch.call_args[0]
+            assert "ORDER BY timestamp DESC, id DESC LIMIT $2" in query
+            assert user_id == 123
+            assert limit == 50
+
     async def test_add_message_to_context(self):
         """Test adding message to context."""
         mock_conn = AsyncMock()
@@ -271,3 +379,210 @@ class TestChatContext:
             assert "DELETE FROM chat_history" in call_args[0]
             assert call_args[1] == 123
 
+
+@pytest.fixture
+def history_writer():
+    """Окремий екземпляр write-behind черги для кожного тесту."""
+    writer = _ChatHistoryWriter(batch_size=100, flush_interval=60)
+    with patch('bot.db.user_settings._history_writer', writer):
+        yield writer
+
+
+def _patch_conn(mock_get_conn, mock_conn):
+    mock_get_conn.return_value.__aenter__ = AsyncMock(return_value=mock_conn)
+    mock_get_conn.return_value.__aexit__ = AsyncMock(return_value=False)
+
+
+@pytest.mark.asyncio
+class TestChatHistoryWriter:
+    """Tests for write-behind persistence of chat turns."""
+
+    async def test_add_message_is_queued_when_running(self, history_writer):
+        """Messages are only queued while the writer is running."""
+        mock_conn = AsyncMock()
+        with patch('bot.db.user_settings.get_db_connection') as mock_get_conn:
+            _patch_conn(mock_get_conn, mock_conn)
+            history_writer.start()
+            try:
+                await add_message_to_context(123, 'user', 'Hello')
+                await add_message_to_context(123, 'model', 'Hi')
+                mock_conn.execute.assert_not_called()
+            finally:
+                await history_writer.stop()
+
+            # stop() записує чергу одним запитом
+            mock_conn.execute.assert_called_once()
+            query, user_ids, roles, contents, timestamps = mock_conn.execute.call_args[0]
+            assert "unnest" in query
+            assert user_ids == [123, 123]
+            assert roles == ['user', 'model']
+            assert contents == ['Hello', 'Hi']
+            assert len(timestamps) == 2
+
+    async def test_get_user_context_sees_pending_messages(self, history_writer):
+        """Queued messages are appended to the DB window (read-your-writes)."""
+        mock_conn = AsyncMock()
+        mock_conn.fetch = AsyncMock(return_value=[{'role': 'model', 'content': 'old'}])
+        history_writer.enqueue(123, 'user', 'new question')
+        history_writer.enqueue(456, 'user', 'other user')
+
+        with patch('bot.db.user_settings.get_db_connection') as mock_get_conn:
+            _patch_conn(mock_get_conn, mock_conn)
+            context = await get_user_context(123, limit=10)
+
+        assert [m['parts'][0]['text'] for m in context] == ['old', 'new question']
+
+    async def test_get_user_context_pending_respects_limit(self, history_writer):
+        """The combined window never exceeds the limit."""
+        mock_conn = AsyncMock()
+        mock_conn.fetch = AsyncMock(return_value=[
+            {'role': 'model', 'content': 'b'},
+            {'role': 'user', 'content': 'a'},
+        ])
+        history_writer.enqueue(123, 'user', 'c')
+
+        with patch('bot.db.user_settings.get_db_connection') as mock_get_conn:
+            _patch_conn(mock_get_conn, mock_conn)
+            context = await get_user_context(123, limit=2)
+
+        assert [m['parts'][0]['text'] for m in context] == ['b', 'c']
+
+    async def test_failed_flush_keeps_messages(self, history_writer):
+        """A failed flush puts the batch back into the queue."""
+        mock_conn = AsyncMock()
+        mock_conn.execute = AsyncMock(side_effect=OSError("db down"))
+        history_writer.enqueue(123, 'user', 'Hello')
+
+        with patch('bot.db.user_settings.get_db_connection') as mock_get_conn:
+            _patch_conn(mock_get_conn, mock_conn)
+            await history_writer.flush()
+
+        assert [r[2] for r in history_writer.pending_for(123)] == ['Hello']
+
+    async def test_repeated_failures_isolate_bad_rows(self, history_writer):
+        """After max_retries the batch is written row by row and bad rows are dropped."""
+        history_writer.max_retries = 2
+        mock_conn = AsyncMock()
+
+        async def execute(query, *args):
+            if "unnest" in query or args[2] == 'bad':
+                raise ValueError("invalid row")
+
+        mock_conn.execute = AsyncMock(side_effect=execute)
+        history_writer.enqueue(123, 'user', 'good')
+        history_writer.enqueue(123, 'user', 'bad')
+
+        with patch('bot.db.user_settings.get_db_connection') as mock_get_conn:
+            _patch_conn(mock_get_conn, mock_conn)
+            await history_writer.flush()
+            assert len(history_writer.pending_for(123)) == 2
+            await history_writer.flush()
+
+        assert history_writer.pending_for(123) == []
+        single_rows = [c.args[3] for c in mock_conn.execute.call_args_list if "VALUES" in c.args[0]]
+        assert single_rows == ['good', 'bad']
+
+    async def test_stop_during_flush_does_not_lose_batch(self, history_writer):
+        """stop() lets an in-progress flush finish instead of cancelling it."""
+        mock_conn = AsyncMock()
+        write_started = asyncio.Event()
+        finish_write = asyncio.Event()
+
+        async def slow_execute(*args):
+            write_started.set()
+            await finish_write.wait()
+
+        mock_conn.execute = AsyncMock(side_effect=slow_execute)
+        with patch('bot.db.user_settings.get_db_connection') as mock_get_conn:
+            _patch_conn(mock_get_conn, mock_conn)
+            history_writer.start()
+            history_writer.enqueue(123, 'user', 'Hello')
+            history_writer._wakeup.set()
+            await write_started.wait()
+
+            stop_task = asyncio.create_task(history_writer.stop())
+            await asyncio.sleep(0.01)
+            assert not stop_task.done()
+            finish_write.set()
+            await stop_task
+
+        mock_conn.execute.assert_called_once()
+        assert history_writer.pending_for(123) == []
+
+    async def test_clear_user_context_discards_pending(self, history_writer):
+        """Clearing context drops the user's queued messages."""
+        mock_conn = AsyncMock()
+        history_writer.enqueue(123, 'user', 'Hello')
+        history_writer.enqueue(456, 'user', 'Keep me')
+
+        with patch('bot.db.user_settings.get_db_connection') as mock_get_conn:
+            _patch_conn(mock_get_conn, mock_conn)
+            await clear_user_context(123)
+
+        assert history_writer.pending_for(123) == []
+        assert len(history_writer.pending_for(456)) == 1
+
+
+@pytest.mark.asyncio
+class TestContextCache:
+    """Tests for the in-process conversation window cache."""
+
+    async def test_second_read_served_from_cache(self):
+        """Only the first read touches the DB."""
+        mock_conn = AsyncMock()
+        mock_conn.fetch = AsyncMock(return_value=[{'role': 'user', 'content': 'Hello'}])
+
+        with patch('bot.db.user_settings.get_db_connection') as mock_get_conn:
+            _patch_conn(mock_get_conn, mock_conn)
+            first = await get_user_context(123)
+            second = await get_user_context(123)
+
+        assert first == second
+        mock_conn.fetch.assert_called_once()
+
+    async def test_add_message_appends_to_cached_window(self):
+        """New turns extend the cached window without a DB read."""
+        mock_conn = AsyncMock()
+        mock_conn.fetch = AsyncMock(return_value=[])
+
+        with patch('bot.db.user_settings.get_db_connection') as mock_get_conn:
+            _patch_conn(mock_get_conn, mock_conn)
+            await get_user_context(123)
+            await add_message_to_context(123, 'user', 'Q')
+            await add_message_to_context(123, 'model', 'A')
+            context = await get_user_context(123)
+
+        assert [m['parts'][0]['text'] for m in context] == ['Q', 'A']
+        mock_conn.fetch.assert_called_once()
+
+    async def test_other_users_write_does_not_block_cache_fill(self):
+        """A write for another uncached user during the read still lets this read fill the cache."""
+        from bot.db import cache
+        mock_conn = AsyncMock()
+
+        async def _fetch(*args):
+            cache.append_cached_context(456, 'user', 'elsewhere')
+            return [{'role': 'user', 'content': 'Hello'}]
+
+        mock_conn.fetch = AsyncMock(side_effect=_fetch)
+
+        with patch('bot.db.user_settings.get_db_connection') as mock_get_conn:
+            _patch_conn(mock_get_conn, mock_conn)
+            await get_user_context(123)
+
+        assert cache.get_cached_context(123) == [('user', 'Hello')]
+
+    async def test_clear_context_drops_cached_window(self):
+        """Clearing the context forces the next read to hit the DB."""
+        mock_conn = AsyncMock()
+        mock_conn.fetch = AsyncMock(return_value=[{'role': 'user', 'content': 'Hello'}])
+
+        with patch('bot.db.user_settings.get_db_connection') as mock_get_conn:
+            _patch_conn(mock_get_conn, mock_conn)
+            await get_user_context(123)
+            await clear_user_context(123)
+            mock_conn.fetch.return_value = []
+            context = await get_user_context(123)
+
+        assert context == []
+        assert mock_conn.fetch.call_count == 2
@@ -1,5 +1,4 @@
 import os
-import time
 from unittest.mock import AsyncMock, MagicMock, mock_open, patch
 
 import pytest
@@ -12,6 +11,7 @@ from bot.handlers.admin import (
     OwnerFilter,
     add_admin_start_handler,
     admin_panel_handler,
+    api_status_handler,
     back_to_admin_panel_handler,
     cache_info_handler,
     cancel_fsm_handler,
@@ -23,7 +23,11 @@ from bot.handlers.admin import (
     remove_admin_start_handler,
     set_model_callback_handler,
 )
+from bot.db.cache import TTLCache
+from bot.handlers.buttons import buttons
 from bot.presentation.keyboards.reply import get_admin_menu
+from bot.services.latency import LatencyTracker
+from bot.services.model_health import ModelHealth
 
 # pytest_plugins = ("pytest_asyncio",)
 
@@ -32,6 +36,29 @@ ADMIN_ID = 67890
 USER_ID = 54321
 
 
+def _fill_mock_cache(mock_cache, settings_data=None, models=None, user_data=None):
+    """Підставляє в мок модуля cache справжні екземпляри TTLCache з даними."""
+    mock_cache.settings_cache = TTLCache("settings_cache", ttl=3600)
+    mock_cache.models_cache = TTLCache("models_cache", ttl=3600)
+    mock_cache.user_cache = TTLCache("user_cache", ttl=3600)
+    for key, value in (settings_data or {}).items():
+        mock_cache.settings_cache.set(key, value)
+    if models is not None:
+        mock_cache.models_cache.set("models", models)
+    for key, value in (user_data or {}).items():
+        mock_cache.user_cache.set(key, value)
+    mock_cache.ALL_CACHES = (mock_cache.settings_cache, mock_cache.models_cache, mock_cache.user_cache)
+
+
+def _user_context(user_id):
+    """Створює мок UserContext, який middleware передає обробникам."""
+    return MagicMock(
+        user_id=user_id,
+        is_owner=user_id == OWNER_ID,
+        is_admin=user_id in (OWNER_ID, ADMIN_ID),
+    )
+
+
 @pytest.fixture
 def mock_message():
     """Створює мок об'єкта Message."""
@@ -71,7 +98,7 @@ async def test_admin_panel_handler(mock_logger, mock_is_admin, mock_message):
     mock_message.from_user.id = OWNER_ID
     mock_is_admin.return_value = True
 
-    await admin_panel_handler(mock_message)
+    await admin_panel_handler(mock_message, _user_context(OWNER_ID))
 
     mock_message.answer.assert_called_once()
     assert "Ви в адмін-панелі." in mock_message.answer.call_args[0]
@@ -92,20 +119,17 @@ async def test_cache_info_handler_sends_file_owner(
     mock_message.from_user.id = OWNER_ID
     mock_aio_open.return_value.__aenter__.return_value.write = AsyncMock()
 
-    mock_cache.settings_cache = {}
-    mock_cache.models_cache = {}
-    mock_cache.user_cache = {
-        ADMIN_ID: {"some_data": {"value": "admin_value", "timestamp": time.time()}},
-        USER_ID: {"some_data": {"value": "user_value", "timestamp": time.time()}},
-    }
-    mock_cache.USER_CACHE_TTL = 3600
+    _fill_mock_cache(mock_cache, user_data={
+        (ADMIN_ID, "some_data"): "admin_value",
+        (USER_ID, "some_data"): "user_value",
+    })
 
     async def is_admin_side_effect(user_id):
         return user_id == ADMIN_ID or user_id == OWNER_ID
 
     mock_is_admin.side_effect = is_admin_side_effect
 
-    await cache_info_handler(mock_message)
+    await cache_info_handler(mock_message, _user_context(mock_message.from_user.id))
 
     mock_message.answer_document.assert_called_once()
     mock_logger.info.assert_called()
@@ -132,21 +156,18 @@ async def test_cache_info_handler_sends_file_admin(
     mock_message.from_user.id = ADMIN_ID  # Запит від адміна
     mock_aio_open.return_value.__aenter__.return_value.write = AsyncMock()
 
-    mock_cache.settings_cache = {}
-    mock_cache.models_cache = {}
-    mock_cache.user_cache = {
-        OWNER_ID: {"some_data": {"value": "owner_value", "timestamp": time.time()}},
-        ADMIN_ID: {"some_data": {"value": "admin_value", "timestamp": time.time()}},
-        USER_ID: {"some_data": {"value": "user_value", "timestamp": time.time()}},
-    }
-    mock_cache.USER_CACHE_TTL = 3600
+    _fill_mock_cache(mock_cache, user_data={
+        (OWNER_ID, "some_data"): "owner_value",
+        (ADMIN_ID, "some_data"): "admin_value",
+        (USER_ID, "some_data"): "user_value",
+    })
 
     async def is_admin_side_effect(user_id):
         return user_id == OWNER_ID or user_id == ADMIN_ID
 
     mock_is_admin.side_effect = is_admin_side_effect
 
-    await cache_info_handler(mock_message)
+    await cache_info_handler(mock_message, _user_context(mock_message.from_user.id))
 
     mock_message.answer_document.assert_called_once()
     mock_logger.info.assert_called()
@@ -170,6 +191,19 @@ async def test_admin_filter(mock_is_admin, mock_message):
     assert await admin_filter(mock_message) is False
 
 
+@pytest.mark.asyncio
+@patch("bot.handlers.admin.is_admin", new_callable=AsyncMock)
+async def test_filters_use_user_context(mock_is_admin, mock_message):
+    """Фільтри беруть роль з user_context без звернення до кешу чи БД."""
+    mock_message.from_user.id = ADMIN_ID
+
+    assert await AdminFilter()(mock_message, user_context=_user_context(ADMIN_ID)) is True
+    assert await AdminFilter()(mock_message, user_context=_user_context(USER_ID)) is False
+    assert await OwnerFilter()(mock_message, user_context=_user_context(ADMIN_ID)) is False
+    assert await OwnerFilter()(mock_message, user_context=_user_context(OWNER_ID)) is True
+    mock_is_admin.assert_not_called()
+
+
 @pytest.mark.asyncio
 @patch("bot.handlers.admin.settings", MagicMock(OWNER_ID=OWNER_ID))
 async def test_owner_filter(mock_message):
@@ -196,16 +230,15 @@ async def test_cache_info_handler_empty_cache(
     mock_is_admin.return_value = True
     mock_aio_open.return_value.__aenter__.return_value.write = AsyncMock()
 
-    mock_cache.settings_cache = {}
-    mock_cache.models_cache = {}
-    mock_cache.user_cache = {}
+    _fill_mock_cache(mock_cache)
 
-    await cache_info_handler(mock_message)
+    await cache_info_handler(mock_message, _user_context(mock_message.from_user.id))
 
     mock_message.answer_document.assert_called_once()
     mock_aio_open.return_value.__aenter__.return_value.write.assert_awaited_once()
     file_content = mock_aio_open.return_value.__aenter__.return_value.write.await_args[0][0]
     assert "- Порожньо" in file_content
+    assert "settings_cache: 0 записів" in file_content
 
 @pytest.mark.asyncio
 @patch("bot.handlers.admin.is_admin", new_callable=AsyncMock)
@@ -221,13 +254,9 @@ async def test_cache_info_handler_with_data(
     mock_is_admin.return_value = True
     mock_aio_open.return_value.__aenter__.return_value.write = AsyncMock()
 
-    mock_cache.settings_cache = {"key": {"value": "value", "timestamp": time.time()}}
-    mock_cache.models_cache = {"models": ["model1"], "timestamp": time.time()}
-    mock_cache.user_cache = {}
-    mock_cache.SETTINGS_CACHE_TTL = 3600
-    mock_cache.MODELS_CACHE_TTL = 3600
+    _fill_mock_cache(mock_cache, settings_data={"key": "value"}, models=["model1"])
 
-    await cache_info_handler(mock_message)
+    await cache_info_handler(mock_message, _user_context(mock_message.from_user.id))
 
     mock_message.answer_document.assert_called_once()
     mock_aio_open.return_value.__aenter__.return_value.write.assert_awaited_once()
@@ -244,7 +273,7 @@ async def test_back_to_admin_panel_handler(mock_logger, mock_message, fsm_contex
     mock_message.from_user.id = OWNER_ID
     await fsm_context.set_state(AdminActions.waiting_for_admin_to_add)
 
-    await back_to_admin_panel_handler(mock_message, fsm_context)
+    await back_to_admin_panel_handler(mock_message, fsm_context, _user_context(OWNER_ID))
 
     mock_message.answer.assert_called_once()
     assert "Ви в адмін-панелі." in mock_message.answer.call_args[0]
@@ -252,6 +281,27 @@ async def test_back_to_admin_panel_handler(mock_logger, mock_message, fsm_contex
     assert state is None
     mock_logger.info.assert_called_once()
 
+@pytest.mark.asyncio
+@patch("bot.handlers.admin.logger")
+async def test_api_status_handler(mock_logger, mock_message):
+    """Тестує звіт про стан запобіжників Gemini API."""
+    health = ModelHealth(cooldown=60, failure_threshold=1, recovery_timeout=30)
+    health.record_failure("models/gemini-pro")
+    health.record_success("models/gemini-flash")
+
+    latency = LatencyTracker(window_seconds=60, slices=6)
+    latency.record("models/gemini-flash", 1.0)
+
+    with patch("bot.handlers.admin.model_health", health), patch("bot.handlers.admin.latency_tracker", latency):
+        await api_status_handler(mock_message)
+
+    text = mock_message.answer.call_args[0][0]
+    assert "models/gemini-pro: 🔴 вимкнено" in text
+    assert "models/gemini-flash: 🟢 працює" in text
+    assert "Ключі API" in text
+    assert "models/gemini-flash: p50 ≤1.1с" in text
+
+
 @pytest.mark.asyncio
 @patch("bot.handlers.admin.get_text_model_name", new_callable=AsyncMock)
 @patch("bot.handlers.admin.get_available_models", new_callable=AsyncMock)
@@ -325,16 +375,6 @@ async def test_manage_admins_handler(mock_logger, mock_message):
     assert "Меню керування адміністраторами:" in mock_message.answer.call_args[0]
     mock_logger.info.assert_called_once()
 
-@pytest.mark.asyncio
-async def test_manage_admins_handler_not_owner(mock_message):
-    """Тестує manage_admins_handler, коли користувач не є власником."""
-    mock_message.from_user.id = ADMIN_ID
-
-    await manage_admins_handler(mock_message)
-
-    mock_message.answer.assert_not_called()
-
-
 @pytest.mark.asyncio
 @patch("bot.handlers.admin.settings", MagicMock(OWNER_ID=OWNER_ID))
 @patch("bot.handlers.admin.logger")
@@ -349,18 +389,6 @@ async def test_add_admin_start_handler(mock_logger, mock_message, fsm_context):
     mock_message.answer.assert_called_once()
     mock_logger.info.assert_called_once()
 
-@pytest.mark.asyncio
-async def test_add_admin_start_handler_not_owner(mock_message, fsm_context):
-    """Тестує add_admin_start_handler, коли користувач не є власником."""
-    mock_message.from_user.id = ADMIN_ID
-
-    await add_admin_start_handler(mock_message, fsm_context)
-
-    state = await fsm_context.get_state()
-    assert state is None
-    mock_message.answer.assert_not_called()
-
-
 @pytest.mark.asyncio
 @patch("bot.handlers.admin.settings", MagicMock(OWNER_ID=OWNER_ID))
 @patch("bot.handlers.admin.logger")
@@ -375,18 +403,6 @@ async def test_remove_admin_start_handler(mock_logger, mock_message, fsm_context
     mock_message.answer.assert_called_once()
     mock_logger.info.assert_called_once()
 
-@pytest.mark.asyncio
-async def test_remove_admin_start_handler_not_owner(mock_message, fsm_context):
-    """Тестує remove_admin_start_handler, коли користувач не є власником."""
-    mock_message.from_user.id = ADMIN_ID
-
-    await remove_admin_start_handler(mock_message, fsm_context)
-
-    state = await fsm_context.get_state()
-    assert state is None
-    mock_message.answer.assert_not_called()
-
-
 @pytest.mark.asyncio
 @patch("bot.handlers.admin.list_admins", new_callable=AsyncMock)
 @patch("bot.handlers.admin.settings", MagicMock(OWNER_ID=OWNER_ID))
@@ -402,17 +418,6 @@ async def test_list_admins_handler(mock_logger, mock_list_admins, mock_message):
     assert f"<code>{ADMIN_ID}</code>" in mock_message.answer.call_args[0][0]
     mock_logger.info.assert_called_once()
 
-@pytest.mark.asyncio
-@patch("bot.handlers.admin.logger")
-async def test_list_admins_handler_not_owner(mock_logger, mock_message):
-    """Тестує list_admins_handler, коли користувач не є власником."""
-    mock_message.from_user.id = ADMIN_ID
-
-    await list_admins_handler(mock_message)
-
-    mock_message.answer.assert_not_called()
-    
-
 @pytest.mark.asyncio
 @patch("bot.handlers.admin.list_admins", new_callable=AsyncMock)
 @patch("bot.handlers.admin.settings", MagicMock(OWNER_ID=OWNER_ID))
@@ -434,7 +439,7 @@ async def test_cancel_fsm_handler(mock_logger, mock_message, fsm_context):
     mock_message.from_user.id = OWNER_ID
     await fsm_context.set_state(AdminActions.waiting_for_admin_to_add)
 
-    await cancel_fsm_handler(mock_message, fsm_context)
+    await cancel_fsm_handler(mock_message, fsm_context, _user_context(OWNER_ID))
 
     state = await fsm_context.get_state()
     assert state is None
@@ -448,7 +453,7 @@ async def test_cancel_fsm_handler_no_state(mock_logger, mock_message, fsm_contex
     """Тестує cancel_fsm_handler, коли немає стану."""
     mock_message.from_user.id = OWNER_ID
 
-    await cancel_fsm_handler(mock_message, fsm_context)
+    await cancel_fsm_handler(mock_message, fsm_context, _user_context(OWNER_ID))
 
     mock_message.answer.assert_not_called()
     mock_logger.info.assert_not_called()
@@ -577,3 +582,16 @@ async def test_process_remove_admin_handler_invalid(mock_logger, mock_message, f
 
     mock_message.answer.assert_called_once_with("Невірний формат. Надішліть ID користувача.")
     mock_logger.warning.assert_called_once()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "text", ["👥 Редагувати адмінів", "➕ Додати адміна", "➖ Видалити адміна", "📋 Список адмінів"]
+)
+async def test_owner_buttons_reject_non_owner(text, mock_message):
+    """Кнопки власника не спрацьовують для адміна: права перевіряє OwnerFilter таблиці кнопок."""
+    mock_message.text = text
+    mock_message.from_user.id = ADMIN_ID
+
+    assert await buttons.match(mock_message, user_context=_user_context(ADMIN_ID)) is False
+    assert await buttons.match(mock_message, user_context=_user_context(OWNER_ID)) is not False
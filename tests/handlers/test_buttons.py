@@ -0,0 +1,86 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from bot.handlers import admin, general, settings  # noqa: F401 — реєструють кнопки
+from bot.handlers.admin import AdminFilter
+from bot.handlers.buttons import ButtonTable, buttons, dispatch_button
+
+ADMIN_ID = 67890
+USER_ID = 54321
+
+
+def _message(text):
+    message = MagicMock()
+    message.text = text
+    message.from_user.id = USER_ID
+    return message
+
+
+def _user_context(is_admin):
+    return MagicMock(is_admin=is_admin, is_owner=False)
+
+
+def test_menu_buttons_are_registered():
+    """Усі кнопки reply-клавіатур мають обробник у таблиці."""
+    for text in (
+        "⚙️ Налаштування",
+        "⬅️ Назад до головного меню",
+        "🗣️ Голос (Чоловічий)",
+        "✅ Увімкнути TTS",
+        "🗑️ Очистити контекст",
+        "👑 Адмін-панель",
+        "🩺 Стан API",
+        "👥 Редагувати адмінів",
+        "📋 Список адмінів",
+    ):
+        assert text in buttons
+
+
+def test_duplicate_button_is_rejected():
+    table = ButtonTable()
+    table.button("A")(AsyncMock())
+
+    with pytest.raises(ValueError):
+        table.button("A")(AsyncMock())
+
+
+@pytest.mark.asyncio
+async def test_free_text_skips_permission_checks():
+    """Довільний текст не викликає перевірку прав жодної кнопки."""
+    table = ButtonTable()
+    permission = AsyncMock(return_value=True)
+    table.button("🔒", permission=permission)(AsyncMock())
+
+    assert await table.match(_message("Привіт, як справи?"), user_context=_user_context(False)) is False
+    permission.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_permission_is_checked_for_matched_button():
+    """Кнопка адміна від звичайного користувача не спрацьовує."""
+    table = ButtonTable()
+    table.button("👑", permission=AdminFilter())(AsyncMock())
+
+    assert await table.match(_message("👑"), user_context=_user_context(False)) is False
+    assert await table.match(_message("👑"), user_context=_user_context(True)) is not False
+
+
+@pytest.mark.asyncio
+async def test_dispatch_passes_only_expected_arguments():
+    """Обробник кнопки отримує лише ті дані, які оголошує."""
+    table = ButtonTable()
+    calls = []
+
+    async def handler(message, user_context):
+        calls.append((message, user_context))
+
+    table.button("⚙️")(handler)
+    message = _message("⚙️")
+    user_context = _user_context(False)
+    data = {"user_context": user_context, "state": MagicMock(), "bot": MagicMock()}
+
+    matched = await table.match(message, **data)
+    await dispatch_button(message, **matched, **data)
+
+    assert calls == [(message, user_context)]
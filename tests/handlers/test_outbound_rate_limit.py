@@ -0,0 +1,140 @@
+"""
+Unit tests for middlewares.outbound_rate_limit module.
+"""
+import asyncio
+from unittest.mock import MagicMock, patch
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import DeleteMessage, EditMessageText, GetMe, SendChatAction, SendMessage
+
+from bot.middlewares.outbound_rate_limit import OutboundRateLimiter, TokenBucket
+
+
+def _limiter(**overrides):
+    params = dict(
+        global_rate=1000, chat_rate=1000, chat_burst=1, group_rate=1000,
+        retry_attempts=2, chat_action_max_age=5,
+    )
+    params.update(overrides)
+    return OutboundRateLimiter(**params)
+
+
+def _recorder(sent):
+    """Імітує make_request, записуючи надіслані методи."""
+    async def _make_request(bot, method):
+        sent.append(method)
+        return method
+    return _make_request
+
+
+class TestTokenBucket:
+    """Tests for the token bucket math."""
+
+    def test_refill_and_block(self):
+        with patch('bot.middlewares.outbound_rate_limit.time.monotonic', return_value=0.0):
+            bucket = TokenBucket(rate=1, capacity=2)
+        bucket.take(0.0)
+        bucket.take(0.0)
+        assert bucket.ready_at(0.0) == 1.0
+        assert bucket.ready_at(1.0) == 1.0
+
+        bucket.block(10.0)
+        assert bucket.ready_at(2.0) == 10.0
+        assert bucket.is_idle(20.0)
+
+
+@pytest.mark.asyncio
+class TestOutboundRateLimiter:
+    """Tests for the outbound Telegram scheduler."""
+
+    async def test_unbound_methods_pass_through(self):
+        sent = []
+        limiter = _limiter()
+        await limiter(_recorder(sent), MagicMock(), GetMe())
+        assert limiter.stats()["sent"] == 0
+        assert len(sent) == 1
+
+    async def test_answers_go_before_edits_and_actions(self):
+        sent = []
+        limiter = _limiter(chat_rate=50)
+        make_request = _recorder(sent)
+        # Перший запит займає єдиний токен чату, решта стають у чергу
+        await limiter(make_request, MagicMock(), SendMessage(chat_id=1, text="first"))
+        await asyncio.gather(
+            limiter(make_request, MagicMock(), SendChatAction(chat_id=1, action="typing")),
+            limiter(make_request, MagicMock(), EditMessageText(chat_id=1, message_id=5, text="edit")),
+            limiter(make_request, MagicMock(), SendMessage(chat_id=1, text="answer")),
+        )
+
+        assert [type(m).__name__ for m in sent] == [
+            "SendMessage", "SendMessage", "EditMessageText", "SendChatAction",
+        ]
+
+    async def test_edits_of_one_message_are_coalesced(self):
+        sent = []
+        limiter = _limiter(chat_rate=50)
+        make_request = _recorder(sent)
+        await limiter(make_request, MagicMock(), SendMessage(chat_id=1, text="first"))
+        results = await asyncio.gather(*(
+            limiter(make_request, MagicMock(), EditMessageText(chat_id=1, message_id=5, text=f"v{i}"))
+            for i in range(4)
+        ))
+
+        assert [m.text for m in sent[1:]] == ["v3"]
+        assert results[:3] == [True, True, True]
+        assert limiter.stats()["coalesced"] == 3
+
+    async def test_other_chats_are_not_blocked(self):
+        """A chat that is out of tokens does not hold back other chats."""
+        sent = []
+        limiter = _limiter(chat_rate=1)
+        make_request = _recorder(sent)
+        await limiter(make_request, MagicMock(), SendMessage(chat_id=1, text="a"))
+
+        slow = asyncio.create_task(limiter(make_request, MagicMock(), SendMessage(chat_id=1, text="b")))
+        await asyncio.wait_for(
+            limiter(make_request, MagicMock(), SendMessage(chat_id=2, text="c")), timeout=0.5
+        )
+        assert [m.text for m in sent] == ["a", "c"]
+        slow.cancel()
+        await asyncio.gather(slow, return_exceptions=True)
+        assert limiter.stats()["queued"] == 0
+
+    async def test_stale_chat_action_is_dropped(self):
+        sent = []
+        limiter = _limiter(chat_rate=50, chat_action_max_age=0)
+        make_request = _recorder(sent)
+        await limiter(make_request, MagicMock(), SendMessage(chat_id=1, text="first"))
+        await asyncio.sleep(0.001)
+
+        result = await limiter(make_request, MagicMock(), SendChatAction(chat_id=1, action="typing"))
+        await limiter(make_request, MagicMock(), DeleteMessage(chat_id=1, message_id=3))
+
+        assert result is True
+        assert [type(m).__name__ for m in sent] == ["SendMessage", "DeleteMessage"]
+        assert limiter.stats()["dropped"] == 1
+
+    async def test_retry_after_is_honored(self):
+        calls = []
+
+        async def _make_request(bot, method):
+            calls.append(method)
+            if len(calls) == 1:
+                raise TelegramRetryAfter(method=method, message="Flood control", retry_after=0)
+            return "ok"
+
+        limiter = _limiter()
+        result = await limiter(_make_request, MagicMock(), SendMessage(chat_id=1, text="x"))
+
+        assert result == "ok"
+        assert len(calls) == 2
+        assert limiter.stats()["retried"] == 1
+
+    async def test_retry_after_gives_up_after_attempts(self):
+        async def _make_request(bot, method):
+            raise TelegramRetryAfter(method=method, message="Flood control", retry_after=0)
+
+        limiter = _limiter(retry_attempts=1)
+        with pytest.raises(TelegramRetryAfter):
+            await limiter(_make_request, MagicMock(), SendMessage(chat_id=1, text="x"))
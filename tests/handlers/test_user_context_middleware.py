@@ -0,0 +1,38 @@
+"""
+Unit tests for middlewares.user_context module.
+"""
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from bot.middlewares.user_context import UserContextMiddleware
+
+
+@pytest.mark.asyncio
+@patch("bot.middlewares.user_context.resolve_user_context", new_callable=AsyncMock)
+async def test_middleware_injects_user_context(mock_resolve):
+    """Middleware resolves the user once and passes the context to the handler."""
+    user_context = MagicMock()
+    mock_resolve.return_value = user_context
+    tg_user = MagicMock(is_bot=False)
+    handler = AsyncMock(return_value="handled")
+    data = {"event_from_user": tg_user}
+
+    result = await UserContextMiddleware()(handler, MagicMock(), data)
+
+    assert result == "handled"
+    mock_resolve.assert_awaited_once_with(tg_user)
+    assert handler.await_args[0][1]["user_context"] is user_context
+
+
+@pytest.mark.asyncio
+@patch("bot.middlewares.user_context.resolve_user_context", new_callable=AsyncMock)
+async def test_middleware_skips_updates_without_user(mock_resolve):
+    """Updates without a sender are passed through untouched."""
+    handler = AsyncMock()
+    data = {}
+
+    await UserContextMiddleware()(handler, MagicMock(), data)
+
+    mock_resolve.assert_not_called()
+    assert "user_context" not in data
+    handler.assert_awaited_once()
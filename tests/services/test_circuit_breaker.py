@@ -0,0 +1,117 @@
+"""
+Unit tests for services.circuit_breaker and services.errors modules.
+"""
+import asyncio
+from unittest.mock import patch
+
+from google.api_core import exceptions as google_exceptions
+from google.genai import errors as genai_errors
+
+from bot.services.circuit_breaker import BreakerState, CircuitBreaker, api_key_label
+from bot.services.errors import ContentBlockedError, ErrorKind, classify_error
+
+
+def _at(seconds):
+    return patch('bot.services.circuit_breaker.time.monotonic', return_value=seconds)
+
+
+class TestCircuitBreaker:
+    """Tests for the breaker state machine."""
+
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker("m", failure_threshold=3, recovery_timeout=30)
+        with _at(100.0):
+            breaker.record_failure()
+            breaker.record_failure()
+            assert breaker.allow()
+            breaker.record_failure()
+            assert breaker.state is BreakerState.OPEN
+            assert not breaker.allow()
+
+    def test_open_for_trips_immediately(self):
+        breaker = CircuitBreaker("m", failure_threshold=3, recovery_timeout=30)
+        with _at(100.0):
+            breaker.record_failure(open_for=5)
+            assert not breaker.allow()
+            assert breaker.remaining_open() == 5
+        with _at(105.0):
+            assert breaker.state is BreakerState.HALF_OPEN
+
+    def test_half_open_allows_single_probe(self):
+        breaker = CircuitBreaker("m", failure_threshold=1, recovery_timeout=30)
+        with _at(100.0):
+            breaker.record_failure()
+        with _at(131.0):
+            assert breaker.allow()
+            assert not breaker.allow()
+            breaker.record_success()
+            assert breaker.state is BreakerState.CLOSED
+            assert breaker.allow()
+
+    def test_failed_probe_reopens(self):
+        breaker = CircuitBreaker("m", failure_threshold=5, recovery_timeout=30)
+        with _at(100.0):
+            breaker.record_failure(open_for=1)
+        with _at(102.0):
+            assert breaker.allow()
+            breaker.record_failure()
+            assert breaker.state is BreakerState.OPEN
+            assert breaker.trips == 2
+
+    def test_lost_probe_is_replaced(self):
+        breaker = CircuitBreaker("m", failure_threshold=1, recovery_timeout=30)
+        with _at(100.0):
+            breaker.record_failure()
+        with _at(130.0):
+            assert breaker.allow()
+        with _at(161.0):
+            assert breaker.allow()
+
+    def test_released_probe_is_replaced(self):
+        breaker = CircuitBreaker("m", failure_threshold=1, recovery_timeout=30)
+        with _at(100.0):
+            breaker.record_failure()
+        with _at(131.0):
+            assert breaker.allow()
+            breaker.release_probe()
+            assert breaker.state is BreakerState.HALF_OPEN
+            assert breaker.allow()
+
+    def test_api_key_label_hides_key(self):
+        assert api_key_label("AIzaSecretKey1234") == "…1234"
+        assert "Secret" not in api_key_label("AIzaSecretKey1234")
+
+
+class TestClassifyError:
+    """Tests for typed error classification."""
+
+    def test_timeout_is_retryable(self):
+        assert classify_error(asyncio.TimeoutError()).kind is ErrorKind.RETRYABLE
+
+    def test_status_codes(self):
+        assert classify_error(genai_errors.APIError(400, {})).kind is ErrorKind.TERMINAL
+        assert classify_error(genai_errors.APIError(403, {})).kind is ErrorKind.AUTH
+        assert classify_error(genai_errors.APIError(404, {})).kind is ErrorKind.NOT_FOUND
+        assert classify_error(genai_errors.APIError(429, {})).kind is ErrorKind.QUOTA
+        assert classify_error(genai_errors.APIError(503, {})).kind is ErrorKind.RETRYABLE
+        assert classify_error(google_exceptions.ResourceExhausted("quota")).kind is ErrorKind.QUOTA
+
+    def test_retry_info_delay(self):
+        error = genai_errors.APIError(429, {"error": {"details": [
+            {"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": "17s"},
+        ]}})
+        classified = classify_error(error)
+
+        assert classified.retry_after == 17.0
+        assert classified.retryable
+
+    def test_retry_delay_from_message(self):
+        error = google_exceptions.ResourceExhausted("Quota exceeded. Please retry in 2.5s.")
+        assert classify_error(error).retry_after == 2.5
+
+    def test_blocked_content_is_terminal(self):
+        assert classify_error(ContentBlockedError("SAFETY")).kind is ErrorKind.TERMINAL
+
+    def test_unknown_errors(self):
+        assert classify_error(Exception("Model is not found")).kind is ErrorKind.NOT_FOUND
+        assert classify_error(RuntimeError("connection reset")).kind is ErrorKind.RETRYABLE
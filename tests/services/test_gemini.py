@@ -3,10 +3,48 @@ Unit tests for services.gemini module.
 """
 import pytest
 import asyncio
+from contextlib import contextmanager
 from unittest.mock import AsyncMock, MagicMock, patch
 from google.api_core import exceptions as google_exceptions
-
-from bot.services.gemini import GeminiService, refresh_available_models
+from google.genai import errors as genai_errors
+from google.genai import types
+
+from bot.services.key_pool import ApiKeyPool
+from bot.services.gemini import (
+    BLOCKED_MESSAGE,
+    BUSY_MESSAGE,
+    OUTPUT_LIMIT_MESSAGE,
+    GeminiService,
+    _generation_config,
+    refresh_available_models,
+)
+from bot.services.scheduler import SchedulerBusyError
+from bot.config import runtime_config
+
+
+@contextmanager
+def _gemini_client():
+    """Підставляє пул з одним ключем, клієнт якого — мок."""
+    mock_client = MagicMock()
+    with patch('bot.services.gemini.key_pool', ApiKeyPool([("#1 …test", mock_client)])):
+        yield mock_client
+
+
+@pytest.fixture(autouse=True)
+def isolate_model_chain():
+    """Ізолює тести від БД (список моделей) та стану здоров'я моделей."""
+    from bot.services.circuit_breaker import key_breakers
+    from bot.services.latency import latency_tracker
+    from bot.services.model_health import model_health
+    model_health.reset()
+    key_breakers.reset()
+    latency_tracker.reset()
+    with patch('bot.services.gemini.get_available_models', new_callable=AsyncMock) as mock_models:
+        mock_models.return_value = []
+        yield mock_models
+    model_health.reset()
+    key_breakers.reset()
+    latency_tracker.reset()
 
 
 @pytest.mark.asyncio
@@ -20,7 +58,7 @@ class TestRefreshAvailableModels:
         mock_model2 = MagicMock()
         mock_model2.name = "models/gemini-2.5-pro"
 
-        with patch('bot.services.gemini.client') as mock_client:
+        with _gemini_client() as mock_client:
             mock_client.models.list = MagicMock(return_value=[mock_model1, mock_model2])
 
             with patch('bot.services.gemini.sync_models') as mock_sync:
@@ -38,7 +76,7 @@ class TestRefreshAvailableModels:
         mock_model2 = MagicMock()
         mock_model2.name = "models/gemini-2.5-preview"  # Should be filtered
 
-        with patch('bot.services.gemini.client') as mock_client:
+        with _gemini_client() as mock_client:
             mock_client.models.list = MagicMock(return_value=[mock_model1, mock_model2])
 
             with patch('bot.services.gemini.sync_models') as mock_sync:
@@ -55,7 +93,7 @@ class TestRefreshAvailableModels:
         mock_model2 = MagicMock()
         mock_model2.name = "models/gemini-2.5-audio"  # Should be filtered
 
-        with patch('bot.services.gemini.client') as mock_client:
+        with _gemini_client() as mock_client:
             mock_client.models.list = MagicMock(return_value=[mock_model1, mock_model2])
 
             with patch('bot.services.gemini.sync_models') as mock_sync:
@@ -65,9 +103,28 @@ class TestRefreshAvailableModels:
                 assert "models/gemini-2.5-flash" in call_args
                 assert "models/gemini-2.5-audio" not in call_args
 
+    async def test_concurrent_refreshes_share_one_request(self):
+        """Test that concurrent refreshes hit the API only once."""
+        mock_model = MagicMock()
+        mock_model.name = "models/gemini-2.5-flash"
+
+        with _gemini_client() as mock_client:
+            mock_client.models.list = MagicMock(return_value=[mock_model])
+
+            with patch('bot.services.gemini.sync_models', new_callable=AsyncMock) as mock_sync:
+                await asyncio.gather(*(refresh_available_models() for _ in range(5)))
+
+                mock_client.models.list.assert_called_once()
+                mock_sync.assert_awaited_once()
+
+            # A later refresh is not suppressed
+            with patch('bot.services.gemini.sync_models', new_callable=AsyncMock):
+                await refresh_available_models()
+            assert mock_client.models.list.call_count == 2
+
     async def test_refresh_client_not_initialized(self):
         """Test refresh when client is not initialized."""
-        with patch('bot.services.gemini.client', None):
+        with patch('bot.services.gemini.key_pool', ApiKeyPool([])):
             with patch('bot.services.gemini.sync_models') as mock_sync:
                 await refresh_available_models()
 
@@ -88,7 +145,7 @@ class TestGeminiService:
         mock_response = MagicMock()
         mock_response.text = "Test response"
 
-        with patch('bot.services.gemini.client') as mock_client:
+        with _gemini_client() as mock_client:
             mock_client.aio.models.generate_content = AsyncMock(return_value=mock_response)
 
             with patch('bot.services.gemini.get_api_text_model_name', new_callable=AsyncMock) as mock_get_model:
@@ -98,6 +155,10 @@ class TestGeminiService:
                         response = await service.generate_text_response("Test prompt")
 
                         assert response == "Test response"
+                        config = mock_client.aio.models.generate_content.call_args[1]['config']
+                        assert config.max_output_tokens == (
+                            runtime_config.TOKEN_LIMIT_OUT + runtime_config.TOKEN_THINKING_BUDGET
+                        )
 
     async def test_generate_text_response_no_client(self, mock_settings):
         """Test generation when client is not initialized."""
@@ -106,7 +167,7 @@ class TestGeminiService:
 
         service = GeminiService(user_id=123, bot=mock_bot)
 
-        with patch('bot.services.gemini.client', None):
+        with patch('bot.services.gemini.key_pool', ApiKeyPool([])):
             response = await service.generate_text_response("Test")
 
             assert "не налаштований для роботи з AI-моделями" in response
@@ -118,7 +179,7 @@ class TestGeminiService:
 
         service = GeminiService(user_id=123, bot=mock_bot)
 
-        with patch('bot.services.gemini.client'):
+        with _gemini_client():
             with patch('bot.services.gemini.get_api_text_model_name', new_callable=AsyncMock) as mock_get_model:
                 mock_get_model.return_value = ""
                 response = await service.generate_text_response("Test")
@@ -132,7 +193,7 @@ class TestGeminiService:
 
         service = GeminiService(user_id=123, bot=mock_bot)
 
-        with patch('bot.services.gemini.client'):
+        with _gemini_client():
             with patch('bot.services.gemini.get_api_text_model_name', new_callable=AsyncMock) as mock_get_model:
                 mock_get_model.return_value = "models/gemini-2.5-flash"
                 with patch('bot.services.gemini.get_user_context', return_value=[]):
@@ -145,21 +206,23 @@ class TestGeminiService:
                                 assert "помилка під час генерації відповіді" in response
 
     async def test_generate_text_response_resource_exhausted(self, mock_settings):
-        """Test handling of ResourceExhausted error."""
+        """Exhausted quota opens the model breaker and fails fast without sleeping."""
         mock_bot = AsyncMock()
         mock_bot.get_chat = AsyncMock(return_value=MagicMock(username="owner"))
 
         service = GeminiService(user_id=123, bot=mock_bot)
 
-        with patch('bot.services.gemini.client'):
+        with _gemini_client():
             with patch('bot.services.gemini.get_api_text_model_name', new_callable=AsyncMock) as mock_get_model:
                 mock_get_model.return_value = "models/gemini-2.5-flash"
                 with patch('bot.services.gemini.get_user_context', return_value=[]):
-                    with patch('asyncio.wait_for', side_effect=google_exceptions.ResourceExhausted("Quota exceeded")):
-                        with patch('asyncio.sleep', new_callable=AsyncMock):
+                    with patch('asyncio.wait_for', side_effect=google_exceptions.ResourceExhausted("Quota exceeded")) as mock_wait:
+                        with patch('asyncio.sleep', new_callable=AsyncMock) as mock_sleep:
                             response = await service.generate_text_response("Test")
 
-                            assert "помилка під час генерації відповіді" in response
+                            assert "тимчасово недоступний" in response
+                            assert mock_wait.call_count == 1
+                            mock_sleep.assert_not_called()
 
     async def test_generate_text_response_model_not_found(self, mock_settings):
         """Test handling of model not found error."""
@@ -168,7 +231,7 @@ class TestGeminiService:
 
         service = GeminiService(user_id=123, bot=mock_bot)
 
-        with patch('bot.services.gemini.client'):
+        with _gemini_client():
             with patch('bot.services.gemini.get_api_text_model_name', new_callable=AsyncMock) as mock_get_model:
                 mock_get_model.return_value = "models/invalid"
                 with patch('bot.services.gemini.get_user_context', return_value=[]):
@@ -179,33 +242,499 @@ class TestGeminiService:
                             assert "модель не знайдено" in response
 
     async def test_generate_text_context_trimming(self, mock_settings):
-        """Test that context is trimmed to CONTEXT_MESSAGE_LIMIT."""
+        """Test that context is requested with CONTEXT_MESSAGE_LIMIT."""
         mock_bot = AsyncMock()
         service = GeminiService(user_id=123, bot=mock_bot)
 
         mock_response = MagicMock()
         mock_response.text = "Response"
 
-        # Create context with more messages than limit
-        large_context = [{'role': 'user', 'parts': [{'text': f'msg{i}'}]} for i in range(15)]
+        # Кількість повідомлень обмежує SQL-запит, тож контекст уже не довший за ліміт
+        large_context = [{'role': 'user', 'parts': [{'text': f'msg{i}'}]} for i in range(10)]
 
-        with patch('bot.services.gemini.client') as mock_client:
+        with _gemini_client() as mock_client:
             mock_client.aio.models.generate_content = AsyncMock(return_value=mock_response)
 
             with patch('bot.services.gemini.get_api_text_model_name', new_callable=AsyncMock) as mock_get_model:
                 mock_get_model.return_value = "models/gemini-2.5-flash"
-                with patch('bot.services.gemini.get_user_context', return_value=large_context):
+                with patch('bot.services.gemini.get_user_context', return_value=large_context) as mock_get_context:
                     with patch('bot.services.gemini.add_message_to_context'):
                         with patch('bot.services.gemini.runtime_config') as mock_config:
                             mock_config.CONTEXT_MESSAGE_LIMIT = 10
                             mock_config.GEMINI_API_TIMEOUT = 60
                             mock_config.API_RETRY_ATTEMPTS = 1
+                            mock_config.TOKEN_LIMIT_OUT = 2000
+                            mock_config.TOKEN_THINKING_BUDGET = 1024
+                            mock_config.THINKING_MODEL_PREFIXES = ("gemini-2.5",)
+                            mock_config.NON_THINKING_MODEL_PREFIXES = ("gemini-2.5-flash-lite",)
+                            mock_config.TOKEN_EXACT_COUNT = False
 
                             await service.generate_text_response("Test")
 
+                            mock_get_context.assert_called_once_with(123, limit=10)
+
                             # Verify generate_content was called
                             call_args = mock_client.aio.models.generate_content.call_args
                             contents = call_args[1]['contents']
 
                             # Should have 10 context messages + 1 new prompt = 11 total
                             assert len(contents) == 11
+
+
+def _stream_of(*chunks, error=None):
+    """Створює асинхронний ітератор фрагментів відповіді, що може обірватися помилкою."""
+    async def _gen():
+        for text in chunks:
+            yield MagicMock(text=text)
+        if error is not None:
+            raise error
+    return _gen()
+
+
+@pytest.mark.asyncio
+class TestGeminiServiceStream:
+    """Tests for streamed text generation."""
+
+    async def test_stream_accumulates_chunks(self, mock_settings):
+        """Each chunk is reported with the accumulated text and the full turn is saved."""
+        service = GeminiService(user_id=123, bot=AsyncMock())
+        on_update = MagicMock()
+
+        with _gemini_client() as mock_client:
+            mock_client.aio.models.generate_content_stream = AsyncMock(
+                return_value=_stream_of("Hel", "", "lo")
+            )
+            with patch('bot.services.gemini.get_api_text_model_name', new_callable=AsyncMock) as mock_get_model:
+                mock_get_model.return_value = "models/gemini-2.5-flash"
+                with patch('bot.services.gemini.get_user_context', return_value=[]):
+                    with patch('bot.services.gemini.add_message_to_context', new_callable=AsyncMock) as mock_add:
+                        response = await service.generate_text_response_stream("Hi", on_update)
+
+        assert response == "Hello"
+        assert [c.args[0] for c in on_update.call_args_list] == ["Hel", "Hello"]
+        mock_add.assert_any_await(123, "model", "Hello")
+
+    async def test_stream_records_latency(self, mock_settings):
+        """Completed and timed-out streams feed the latency tracker."""
+        from bot.services.latency import latency_tracker
+        service = GeminiService(user_id=123, bot=AsyncMock())
+        model = "models/gemini-2.5-flash"
+
+        with _gemini_client() as mock_client:
+            mock_client.aio.models.generate_content_stream = AsyncMock(
+                side_effect=[_stream_of(error=asyncio.TimeoutError()), _stream_of("OK")]
+            )
+            with patch('bot.services.gemini.get_api_text_model_name', new_callable=AsyncMock) as mock_get_model:
+                mock_get_model.return_value = model
+                with patch('bot.services.gemini.get_user_context', return_value=[]):
+                    with patch('bot.services.gemini.add_message_to_context', new_callable=AsyncMock):
+                        with patch('bot.services.gemini.asyncio.sleep', new_callable=AsyncMock):
+                            await service.generate_text_response_stream("Hi", MagicMock())
+
+        assert latency_tracker.count(model) == 2
+
+    async def test_stream_retries_before_first_chunk(self, mock_settings):
+        """A failure before any text arrives is retried with a fresh stream."""
+        service = GeminiService(user_id=123, bot=AsyncMock())
+
+        with _gemini_client() as mock_client:
+            mock_client.aio.models.generate_content_stream = AsyncMock(
+                side_effect=[_stream_of(error=asyncio.TimeoutError()), _stream_of("OK")]
+            )
+            with patch('bot.services.gemini.get_api_text_model_name', new_callable=AsyncMock) as mock_get_model:
+                mock_get_model.return_value = "models/gemini-2.5-flash"
+                with patch('bot.services.gemini.get_user_context', return_value=[]):
+                    with patch('bot.services.gemini.add_message_to_context', new_callable=AsyncMock):
+                        with patch('bot.services.gemini.asyncio.sleep', new_callable=AsyncMock):
+                            response = await service.generate_text_response_stream("Hi", MagicMock())
+
+        assert response == "OK"
+        assert mock_client.aio.models.generate_content_stream.await_count == 2
+
+    async def test_stream_keeps_partial_text_on_interruption(self, mock_settings):
+        """A failure after text was shown is not retried; the partial text is returned."""
+        service = GeminiService(user_id=123, bot=AsyncMock())
+
+        with _gemini_client() as mock_client:
+            mock_client.aio.models.generate_content_stream = AsyncMock(
+                return_value=_stream_of("Part", error=RuntimeError("connection reset"))
+            )
+            with patch('bot.services.gemini.get_api_text_model_name', new_callable=AsyncMock) as mock_get_model:
+                mock_get_model.return_value = "models/gemini-2.5-flash"
+                with patch('bot.services.gemini.get_user_context', return_value=[]):
+                    with patch('bot.services.gemini.add_message_to_context', new_callable=AsyncMock) as mock_add:
+                        response = await service.generate_text_response_stream("Hi", MagicMock())
+
+        assert response == "Part"
+        assert service.stream_interrupted
+        # У контекст моделі потрапляє лише отриманий текст, без позначки для користувача
+        mock_add.assert_any_await(123, "model", "Part")
+        assert mock_client.aio.models.generate_content_stream.await_count == 1
+
+    async def test_stream_has_overall_deadline(self, mock_settings):
+        """A stream that keeps trickling chunks is cut off at STREAM_TOTAL_TIMEOUT."""
+        service = GeminiService(user_id=123, bot=AsyncMock())
+
+        async def _trickle():
+            while True:
+                yield MagicMock(text="x")
+                await asyncio.sleep(0.02)
+
+        with _gemini_client() as mock_client:
+            mock_client.aio.models.generate_content_stream = AsyncMock(return_value=_trickle())
+            with patch('bot.services.gemini.get_api_text_model_name', new_callable=AsyncMock) as mock_get_model:
+                mock_get_model.return_value = "models/gemini-2.5-flash"
+                with patch('bot.services.gemini.get_user_context', return_value=[]):
+                    with patch('bot.services.gemini.add_message_to_context', new_callable=AsyncMock):
+                        with patch.object(runtime_config, 'STREAM_TOTAL_TIMEOUT', 0.1):
+                            response = await asyncio.wait_for(
+                                service.generate_text_response_stream("Hi", MagicMock()), timeout=5
+                            )
+
+        assert response.startswith("x")
+        assert service.stream_interrupted
+        assert mock_client.aio.models.generate_content_stream.await_count == 1
+
+    async def test_stream_display_error_does_not_regenerate(self, mock_settings):
+        """A failing on_update is logged; the stream continues and is not retried."""
+        service = GeminiService(user_id=123, bot=AsyncMock())
+        on_update = MagicMock(side_effect=RuntimeError("telegram edit failed"))
+
+        with _gemini_client() as mock_client:
+            mock_client.aio.models.generate_content_stream = AsyncMock(
+                return_value=_stream_of("Hel", "lo")
+            )
+            with patch('bot.services.gemini.get_api_text_model_name', new_callable=AsyncMock) as mock_get_model:
+                mock_get_model.return_value = "models/gemini-2.5-flash"
+                with patch('bot.services.gemini.get_user_context', return_value=[]):
+                    with patch('bot.services.gemini.add_message_to_context', new_callable=AsyncMock):
+                        response = await service.generate_text_response_stream("Hi", on_update)
+
+        assert response == "Hello"
+        assert not service.stream_interrupted
+        assert mock_client.aio.models.generate_content_stream.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_generate_text_response_busy(mock_settings):
+    """A full scheduler queue produces an immediate busy reply without retries."""
+    service = GeminiService(user_id=123, bot=AsyncMock())
+
+    with _gemini_client() as mock_client:
+        mock_client.aio.models.generate_content = AsyncMock()
+        with patch('bot.services.gemini.get_api_text_model_name', new_callable=AsyncMock) as mock_get_model:
+            mock_get_model.return_value = "models/gemini-2.5-flash"
+            with patch('bot.services.gemini.get_user_context', return_value=[]):
+                with patch('bot.services.gemini.gemini_scheduler') as mock_scheduler:
+                    mock_scheduler.slot.return_value.__aenter__ = AsyncMock(side_effect=SchedulerBusyError())
+                    mock_scheduler.slot.return_value.__aexit__ = AsyncMock(return_value=False)
+
+                    response = await service.generate_text_response("Hi")
+
+    assert response == BUSY_MESSAGE
+    mock_client.aio.models.generate_content.assert_not_called()
+
+
+@pytest.mark.asyncio
+class TestModelFallback:
+    """Tests for falling back to the next model by priority."""
+
+    async def test_timeout_switches_to_next_model_without_sleep(self, mock_settings, isolate_model_chain):
+        """After a timeout on pro the next attempt goes to flash right away."""
+        isolate_model_chain.return_value = [
+            "models/gemini-2.5-flash-lite", "models/gemini-2.5-flash", "models/gemini-2.5-pro",
+        ]
+        service = GeminiService(user_id=123, bot=AsyncMock())
+        mock_response = MagicMock(text="from flash")
+        calls = []
+
+        async def _generate(model, contents, config):
+            calls.append(model)
+            if model == "models/gemini-2.5-pro":
+                raise asyncio.TimeoutError()
+            return mock_response
+
+        with _gemini_client() as mock_client:
+            mock_client.aio.models.generate_content = _generate
+            with patch('bot.services.gemini.get_api_text_model_name', new_callable=AsyncMock) as mock_get_model:
+                mock_get_model.return_value = "models/gemini-2.5-pro"
+                with patch('bot.services.gemini.get_user_context', return_value=[]):
+                    with patch('bot.services.gemini.add_message_to_context', new_callable=AsyncMock):
+                        with patch('bot.services.gemini.asyncio.sleep', new_callable=AsyncMock) as mock_sleep:
+                            response = await service.generate_text_response("Hi")
+
+                            # Наступний запит одразу йде в обхід деградованої моделі
+                            calls.clear()
+                            await service.generate_text_response("Again")
+
+        assert response == "from flash"
+        mock_sleep.assert_not_called()
+        assert calls == ["models/gemini-2.5-flash"]
+
+    async def test_fallback_chain_order(self):
+        """Lighter neighbours come first, then the rest by priority."""
+        from bot.services.model_health import fallback_chain
+        models = ["lite", "flash", "pro"]
+
+        assert fallback_chain("pro", models) == ["pro", "flash", "lite"]
+        assert fallback_chain("flash", models) == ["flash", "lite", "pro"]
+        assert fallback_chain("other", models) == ["other", "lite", "flash", "pro"]
+
+    async def test_degraded_model_recovers_after_cooldown(self):
+        """A model is skipped only during its cooldown."""
+        from bot.services.model_health import ModelHealth
+        health = ModelHealth(cooldown=30)
+
+        with patch('bot.services.model_health.time.monotonic', return_value=100.0):
+            health.record_failure("pro")
+            assert health.pick(["pro", "flash"]) == "flash"
+        with patch('bot.services.model_health.time.monotonic', return_value=131.0):
+            assert health.pick(["pro", "flash"]) == "pro"
+
+
+def _api_error(code, status, details=None):
+    """Створює помилку google-genai з відповіддю сервера."""
+    return genai_errors.APIError(code, {"error": {"code": code, "status": status, "message": status, **(details or {})}})
+
+
+@pytest.mark.asyncio
+class TestErrorHandling:
+    """Tests for error classification and circuit breakers in the retry loop."""
+
+    async def _generate(self, side_effect, model="models/gemini-2.5-flash"):
+        service = GeminiService(user_id=123, bot=AsyncMock(get_chat=AsyncMock(return_value=MagicMock(username="owner"))))
+        with _gemini_client() as mock_client:
+            mock_client.aio.models.generate_content = AsyncMock(side_effect=side_effect)
+            with patch('bot.services.gemini.get_api_text_model_name', new_callable=AsyncMock, return_value=model):
+                with patch('bot.services.gemini.get_user_context', return_value=[]):
+                    with patch('bot.services.gemini.add_message_to_context', new_callable=AsyncMock):
+                        with patch('bot.services.gemini.asyncio.sleep', new_callable=AsyncMock) as mock_sleep:
+                            response = await service.generate_text_response("Hi")
+            return response, mock_client.aio.models.generate_content, mock_sleep
+
+    async def test_bad_request_is_not_retried(self, mock_settings):
+        """A 400 is terminal: one call, no sleeps."""
+        response, generate, mock_sleep = await self._generate(_api_error(400, "INVALID_ARGUMENT"))
+
+        assert "Не вдалося обробити запит" in response
+        assert generate.await_count == 1
+        mock_sleep.assert_not_called()
+
+    async def test_blocked_response_is_not_retried(self, mock_settings):
+        """An empty answer with a block reason is reported to the user once."""
+        blocked = MagicMock(text=None)
+        blocked.prompt_feedback.block_reason = "SAFETY"
+
+        response, generate, _ = await self._generate([blocked])
+
+        assert response == BLOCKED_MESSAGE
+        assert generate.await_count == 1
+
+    async def test_output_limit_is_not_reported_as_blocked(self, mock_settings):
+        """An empty answer cut by MAX_TOKENS gets its own message, not the safety one."""
+        truncated = MagicMock(text=None)
+        truncated.prompt_feedback.block_reason = None
+        truncated.candidates = [MagicMock(finish_reason=types.FinishReason.MAX_TOKENS)]
+
+        response, generate, _ = await self._generate([truncated])
+
+        assert response == OUTPUT_LIMIT_MESSAGE
+        assert generate.await_count == 1
+
+    async def test_short_retry_after_is_honored(self, mock_settings):
+        """A 429 with a short RetryInfo delay waits and retries the same model."""
+        quota = _api_error(429, "RESOURCE_EXHAUSTED", {"details": [
+            {"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": "3s"},
+        ]})
+
+        clock = [100.0]
+
+        async def _sleep(delay):
+            clock[0] += delay
+
+        service = GeminiService(user_id=123, bot=AsyncMock())
+        with _gemini_client() as mock_client:
+            mock_client.aio.models.generate_content = AsyncMock(side_effect=[quota, MagicMock(text="OK")])
+            with patch('bot.services.gemini.get_api_text_model_name', new_callable=AsyncMock,
+                       return_value="models/gemini-2.5-flash"):
+                with patch('bot.services.gemini.get_user_context', return_value=[]):
+                    with patch('bot.services.gemini.add_message_to_context', new_callable=AsyncMock):
+                        with patch('bot.services.key_pool.time.monotonic', side_effect=lambda: clock[0]):
+                            with patch('bot.services.gemini.asyncio.sleep', side_effect=_sleep) as mock_sleep:
+                                response = await service.generate_text_response("Hi")
+
+        assert response == "OK"
+        assert mock_client.aio.models.generate_content.await_count == 2
+        assert mock_sleep.call_args.args[0] >= 3
+
+    async def test_rate_limited_key_is_replaced(self, mock_settings):
+        """A 429 on one key retries right away through another key."""
+        client_a, client_b = MagicMock(), MagicMock()
+        client_a.aio.models.generate_content = AsyncMock(side_effect=_api_error(429, "RESOURCE_EXHAUSTED"))
+        client_b.aio.models.generate_content = AsyncMock(return_value=MagicMock(text="OK"))
+        pool = ApiKeyPool([("a", client_a), ("b", client_b)])
+        service = GeminiService(user_id=123, bot=AsyncMock())
+
+        with patch('bot.services.gemini.key_pool', pool):
+            with patch('bot.services.gemini.get_api_text_model_name', new_callable=AsyncMock,
+                       return_value="models/gemini-2.5-flash"):
+                with patch('bot.services.gemini.get_user_context', return_value=[]):
+                    with patch('bot.services.gemini.add_message_to_context', new_callable=AsyncMock):
+                        with patch('bot.services.gemini.asyncio.sleep', new_callable=AsyncMock) as mock_sleep:
+                            response = await service.generate_text_response("Hi")
+
+        assert response == "OK"
+        mock_sleep.assert_not_called()
+        assert pool.snapshot()[0]["rate_limited"] == 1
+        assert pool.snapshot()[0]["cooldown"] > 0
+
+    async def test_key_quota_does_not_degrade_model(self, mock_settings):
+        """A 429 on one key leaves the model healthy while another key has quota."""
+        from bot.services.model_health import model_health
+
+        client_a, client_b = MagicMock(), MagicMock()
+        client_a.aio.models.generate_content = AsyncMock(side_effect=_api_error(429, "RESOURCE_EXHAUSTED"))
+        client_b.aio.models.generate_content = AsyncMock(return_value=MagicMock(text="OK"))
+        pool = ApiKeyPool([("a", client_a), ("b", client_b)])
+        service = GeminiService(user_id=123, bot=AsyncMock())
+        model = "models/gemini-2.5-flash"
+
+        with patch('bot.services.gemini.key_pool', pool):
+            with patch('bot.services.gemini.model_health.record_success'):
+                with patch('bot.services.gemini.get_api_text_model_name', new_callable=AsyncMock,
+                           return_value=model):
+                    with patch('bot.services.gemini.get_user_context', return_value=[]):
+                        with patch('bot.services.gemini.add_message_to_context', new_callable=AsyncMock):
+                            response = await service.generate_text_response("Hi")
+
+        assert response == "OK"
+        assert model_health.is_healthy(model)
+        assert model_health.breakers.get(model).failures == 0
+
+    async def test_busy_scheduler_releases_breaker_probe(self, mock_settings):
+        """A probe rejected by the scheduler queue does not keep the breaker half-open."""
+        from bot.services.circuit_breaker import BreakerState, key_breakers
+        from bot.services.model_health import model_health
+
+        model = "models/gemini-2.5-flash"
+        model_breaker = model_health.breakers.get(model)
+        key_breaker = key_breakers.get("#1 …test")
+        for breaker in (model_breaker, key_breaker):
+            breaker.record_failure(open_for=0)
+
+        with patch('bot.services.gemini.gemini_scheduler.slot', side_effect=SchedulerBusyError()):
+            response, generate, _ = await self._generate(MagicMock(text="OK"), model=model)
+
+        assert response == BUSY_MESSAGE
+        generate.assert_not_called()
+        for breaker in (model_breaker, key_breaker):
+            assert breaker.state is BreakerState.HALF_OPEN
+            assert breaker.allow()
+
+    async def test_open_key_breaker_fails_fast(self, mock_settings):
+        """Repeated server errors open the key breaker; later requests skip the API."""
+        from bot.services.circuit_breaker import key_breakers
+
+        breaker = key_breakers.get("#1 …test")
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+
+        response, generate, _ = await self._generate(_api_error(503, "UNAVAILABLE"))
+
+        assert "тимчасово недоступний" in response
+        generate.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_slow_primary_is_hedged(mock_settings):
+    """With hedging on, a reply slower than the model's p90 gets a second request."""
+    from bot.services.hedging import hedge_budget
+    from bot.services.latency import latency_tracker
+
+    model = "models/gemini-2.5-flash"
+    for _ in range(runtime_config.LATENCY_MIN_SAMPLES):
+        latency_tracker.record(model, 0.01)
+    calls = []
+
+    async def _generate(model, contents, config):
+        calls.append(model)
+        if len(calls) == 1:
+            await asyncio.sleep(10)
+        return MagicMock(text="fast")
+
+    service = GeminiService(user_id=123, bot=AsyncMock())
+    try:
+        with patch.object(runtime_config, 'HEDGE_ENABLED', True):
+            with _gemini_client() as mock_client:
+                mock_client.aio.models.generate_content = _generate
+                with patch('bot.services.gemini.get_api_text_model_name', new_callable=AsyncMock, return_value=model):
+                    with patch('bot.services.gemini.get_user_context', return_value=[]):
+                        with patch('bot.services.gemini.add_message_to_context', new_callable=AsyncMock):
+                            response = await asyncio.wait_for(service.generate_text_response("Hi"), timeout=5)
+    finally:
+        hedge_budget.reset()
+
+    assert response == "fast"
+    assert calls == [model, model]
+
+
+@pytest.mark.asyncio
+async def test_hedge_uses_its_own_key(mock_settings):
+    """The hedge request acquires a separate key, and both requests count towards key usage."""
+    from bot.services.hedging import hedge_budget
+    from bot.services.latency import latency_tracker
+
+    model = "models/gemini-2.5-flash"
+    for _ in range(runtime_config.LATENCY_MIN_SAMPLES):
+        latency_tracker.record(model, 0.01)
+
+    async def _slow(model, contents, config):
+        await asyncio.sleep(10)
+
+    usage = MagicMock(total_token_count=50, candidates_token_count=5)
+    client_a, client_b = MagicMock(), MagicMock()
+    client_a.aio.models.generate_content = _slow
+    client_b.aio.models.generate_content = AsyncMock(return_value=MagicMock(text="fast", usage_metadata=usage))
+    pool = ApiKeyPool([("a", client_a), ("b", client_b)])
+    service = GeminiService(user_id=123, bot=AsyncMock())
+    try:
+        with patch.object(runtime_config, 'HEDGE_ENABLED', True):
+            with patch('bot.services.gemini.key_pool', pool):
+                with patch('bot.services.gemini.get_api_text_model_name', new_callable=AsyncMock, return_value=model):
+                    with patch('bot.services.gemini.get_user_context', return_value=[]):
+                        with patch('bot.services.gemini.add_message_to_context', new_callable=AsyncMock):
+                            response = await asyncio.wait_for(service.generate_text_response("Hi"), timeout=5)
+    finally:
+        hedge_budget.reset()
+
+    assert response == "fast"
+    snapshot = {key["label"]: key for key in pool.snapshot()}
+    assert snapshot["a"]["requests"] == 1
+    assert snapshot["b"]["requests"] == 1
+    assert snapshot["b"]["tokens"] == 50
+
+
+class TestGenerationConfig:
+    """Tests for output limits of generation requests."""
+
+    def test_thinking_model_gets_bounded_thinking_budget(self):
+        """Thinking tokens are budgeted on top of TOKEN_LIMIT_OUT, not taken from it."""
+        config = _generation_config("models/gemini-2.5-flash")
+
+        assert config.thinking_config.thinking_budget == runtime_config.TOKEN_THINKING_BUDGET
+        assert config.max_output_tokens == (
+            runtime_config.TOKEN_LIMIT_OUT + runtime_config.TOKEN_THINKING_BUDGET
+        )
+
+    def test_other_models_keep_plain_output_limit(self):
+        config = _generation_config("models/gemini-2.0-flash")
+
+        assert config.thinking_config is None
+        assert config.max_output_tokens == runtime_config.TOKEN_LIMIT_OUT
+
+    def test_flash_lite_does_not_get_thinking_enabled(self):
+        """flash-lite does not think by default, so no thinking budget is sent."""
+        config = _generation_config("models/gemini-2.5-flash-lite")
+
+        assert config.thinking_config is None
+        assert config.max_output_tokens == runtime_config.TOKEN_LIMIT_OUT
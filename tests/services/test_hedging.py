@@ -0,0 +1,114 @@
+"""
+Unit tests for services.hedging module.
+"""
+import asyncio
+from unittest.mock import patch
+
+import pytest
+
+from bot.services.hedging import HedgeBudget, hedge_budget, hedged
+from bot.services.scheduler import GeminiScheduler
+
+
+@pytest.fixture(autouse=True)
+def isolated_scheduler():
+    """Окремий планувальник і бюджет для кожного тесту."""
+    scheduler = GeminiScheduler(max_concurrency=4, per_user_limit=1, max_queue=10, per_user_queue=5)
+    hedge_budget.reset()
+    with patch('bot.services.hedging.gemini_scheduler', scheduler):
+        yield scheduler
+    hedge_budget.reset()
+
+
+def _call_with_delays(delays, calls, cancelled):
+    """Створює виклик, що відповідає через задану для кожного звернення затримку."""
+    async def _call(model):
+        index = len(calls)
+        calls.append(model)
+        try:
+            await asyncio.sleep(delays[index])
+        except asyncio.CancelledError:
+            cancelled.append(index)
+            raise
+        return f"{model}#{index}"
+    return _call
+
+
+@pytest.mark.asyncio
+class TestHedged:
+    """Tests for hedged requests."""
+
+    async def test_fast_primary_is_not_hedged(self):
+        calls, cancelled = [], []
+        result = await hedged(_call_with_delays([0], calls, cancelled), 1, "pro", delay=0.05)
+
+        assert result == "pro#0"
+        assert calls == ["pro"]
+        assert hedge_budget.fired == 0
+
+    async def test_hedge_wins_and_primary_is_cancelled(self, isolated_scheduler):
+        calls, cancelled = [], []
+        call = _call_with_delays([10, 0], calls, cancelled)
+
+        result = await hedged(call, 1, "pro", delay=0.01, hedge_model="flash")
+        await asyncio.sleep(0)
+
+        assert result == "flash#1"
+        assert calls == ["pro", "flash"]
+        assert cancelled == [0]
+        assert hedge_budget.won == 1
+        assert isolated_scheduler.running == 0
+
+    async def test_failed_primary_waits_for_hedge(self):
+        calls = []
+
+        async def _call(model):
+            calls.append(model)
+            if len(calls) == 1:
+                await asyncio.sleep(0.03)
+                raise RuntimeError("boom")
+            await asyncio.sleep(0.05)
+            return "hedge"
+
+        assert await hedged(_call, 1, "pro", delay=0.01) == "hedge"
+
+    async def test_hedge_call_is_used_and_primary_error_wins(self):
+        """The hedge goes through `hedge_call`; if both fail, the primary's error is raised."""
+        async def _primary(model):
+            await asyncio.sleep(0.03)
+            raise RuntimeError("primary")
+
+        async def _hedge(model):
+            raise ValueError("hedge")
+
+        with pytest.raises(RuntimeError, match="primary"):
+            await hedged(_primary, 1, "pro", delay=0.01, hedge_call=_hedge)
+        assert hedge_budget.fired == 1
+
+    async def test_budget_limits_hedges(self):
+        hedge_budget.per_minute = 0
+        try:
+            calls, cancelled = [], []
+            result = await hedged(_call_with_delays([0.03], calls, cancelled), 1, "pro", delay=0.01)
+        finally:
+            hedge_budget.per_minute = 10
+
+        assert result == "pro#0"
+        assert calls == ["pro"]
+
+    async def test_no_spare_capacity_skips_hedge(self, isolated_scheduler):
+        isolated_scheduler.max_concurrency = 0
+        calls, cancelled = [], []
+
+        assert await hedged(_call_with_delays([0.03], calls, cancelled), 1, "pro", delay=0.01) == "pro#0"
+        assert calls == ["pro"]
+
+
+def test_budget_window_slides():
+    budget = HedgeBudget(per_minute=1)
+    with patch('bot.services.hedging.time.monotonic', return_value=100.0):
+        assert budget.available()
+        budget.spend()
+        assert not budget.available()
+    with patch('bot.services.hedging.time.monotonic', return_value=160.0):
+        assert budget.available()
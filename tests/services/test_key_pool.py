@@ -0,0 +1,83 @@
+"""
+Unit tests for services.key_pool module.
+"""
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from bot.config.settings import Settings
+from bot.services.circuit_breaker import key_breakers
+from bot.services.key_pool import ApiKeyPool
+
+
+def _at(seconds):
+    return patch('bot.services.key_pool.time.monotonic', return_value=seconds)
+
+
+@pytest.fixture(autouse=True)
+def reset_breakers():
+    key_breakers.reset()
+    yield
+    key_breakers.reset()
+
+
+def _pool(*labels):
+    return ApiKeyPool([(label, MagicMock(name=label)) for label in labels])
+
+
+class TestApiKeyPool:
+    """Tests for key rotation and utilization tracking."""
+
+    def test_requests_are_spread_across_keys(self):
+        pool = _pool("a", "b")
+        with _at(100.0):
+            labels = [pool.acquire().label for _ in range(4)]
+
+        assert sorted(labels) == ["a", "a", "b", "b"]
+
+    def test_rate_limited_key_leaves_rotation(self):
+        pool = _pool("a", "b")
+        key_a = pool.keys[0]
+        with _at(100.0):
+            pool.cool_down(key_a, 30)
+            assert [pool.acquire().label for _ in range(3)] == ["b", "b", "b"]
+        with _at(131.0):
+            assert pool.acquire().label == "a"
+        assert pool.snapshot()[0]["rate_limited"] == 1
+
+    def test_all_keys_cooling(self):
+        pool = _pool("a")
+        with _at(100.0):
+            pool.cool_down(pool.keys[0], 20)
+            assert pool.acquire() is None
+            assert pool.wait_time() == 20
+
+    def test_rpm_limit(self):
+        pool = _pool("a")
+        with patch('bot.services.key_pool.runtime_config.API_KEY_RPM_LIMIT', 2):
+            with _at(100.0):
+                assert pool.acquire() and pool.acquire()
+                assert pool.acquire() is None
+                assert pool.wait_time() == 60
+            with _at(160.0):
+                assert pool.acquire() is not None
+
+    def test_token_utilization_prefers_idle_key(self):
+        pool = _pool("a", "b")
+        with patch('bot.services.key_pool.runtime_config.API_KEY_TPM_LIMIT', 1000):
+            with _at(100.0):
+                pool.record_tokens(pool.keys[0], 900)
+                assert pool.acquire().label == "b"
+                assert pool.snapshot()[0]["tpm"] == 900
+
+    def test_open_breaker_skips_key(self):
+        pool = _pool("a", "b")
+        pool.keys[0].breaker.record_failure(open_for=60)
+        assert pool.acquire().label == "b"
+
+
+def test_settings_collect_all_keys():
+    settings = Settings(
+        TG_TOKEN="t", GEMINI_API_KEY="a", GEMINI_API_KEYS="b, a,,c", OWNER_ID=1, DATABASE_URL="db",
+    )
+    assert settings.gemini_api_keys == ["a", "b", "c"]
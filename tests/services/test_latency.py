@@ -0,0 +1,100 @@
+"""
+Unit tests for services.latency module.
+"""
+from unittest.mock import patch
+
+import pytest
+
+from bot.config import runtime_config
+from bot.services.latency import (
+    LatencyHistogram,
+    LatencyTracker,
+    latency_tracker,
+    request_timeout,
+    retry_delay,
+)
+
+
+def _at(seconds):
+    return patch('bot.services.latency.time.monotonic', return_value=seconds)
+
+
+@pytest.fixture(autouse=True)
+def reset_tracker():
+    latency_tracker.reset()
+    yield
+    latency_tracker.reset()
+
+
+class TestLatencyHistogram:
+    """Tests for the rolling fixed-bucket histogram."""
+
+    def test_percentiles_are_bucket_upper_bounds(self):
+        with _at(0.0):
+            histogram = LatencyHistogram(window_seconds=60, slices=6)
+            for _ in range(90):
+                histogram.record(1.0)
+            for _ in range(10):
+                histogram.record(30.0)
+
+            p50 = histogram.percentile(0.5)
+            p99 = histogram.percentile(0.99)
+
+        assert 1.0 <= p50 < 1.25
+        assert 30.0 <= p99 < 37.5
+
+    def test_old_slices_expire(self):
+        with _at(0.0):
+            histogram = LatencyHistogram(window_seconds=60, slices=6)
+            histogram.record(5.0)
+        with _at(35.0):
+            histogram.record(1.0)
+            assert sum(histogram.counts()) == 2
+        with _at(65.0):
+            # Частина з першим заміром вийшла за межі вікна
+            assert sum(histogram.counts()) == 1
+        with _at(1000.0):
+            assert histogram.percentile(0.5) is None
+
+    def test_empty_histogram(self):
+        assert LatencyHistogram(window_seconds=60, slices=6).percentile(0.9) is None
+
+
+class TestAdaptiveTimeouts:
+    """Tests for timeouts and retry delays derived from the histogram."""
+
+    def test_static_timeout_until_enough_samples(self):
+        latency_tracker.record("flash", 1.0)
+        assert request_timeout("flash") == runtime_config.GEMINI_API_TIMEOUT
+        assert retry_delay("flash", 0) == runtime_config.API_RETRY_BASE_DELAY
+
+    def test_timeout_follows_observed_latency(self):
+        for _ in range(runtime_config.LATENCY_MIN_SAMPLES):
+            latency_tracker.record("flash", 2.0)
+            latency_tracker.record("pro", 40.0)
+
+        assert request_timeout("flash") == runtime_config.ADAPTIVE_TIMEOUT_MIN
+        assert 80 <= request_timeout("pro") <= runtime_config.GEMINI_API_TIMEOUT
+
+    def test_timeout_is_capped(self):
+        for _ in range(runtime_config.LATENCY_MIN_SAMPLES):
+            latency_tracker.record("slow", 500.0)
+        assert request_timeout("slow") == runtime_config.GEMINI_API_TIMEOUT
+
+    def test_retry_delay_grows_within_bounds(self):
+        for _ in range(runtime_config.LATENCY_MIN_SAMPLES):
+            latency_tracker.record("flash", 2.0)
+
+        first = retry_delay("flash", 0)
+        assert 2.0 <= first < 2.5
+        assert retry_delay("flash", 1) == 2 * first
+        assert retry_delay("flash", 10) == runtime_config.API_RETRY_DELAY_MAX
+
+    def test_snapshot_lists_models(self):
+        tracker = LatencyTracker(window_seconds=60, slices=6)
+        tracker.record("flash", 1.0)
+
+        (snapshot,) = tracker.snapshot()
+        assert snapshot["model"] == "flash"
+        assert snapshot["samples"] == 1
+        assert snapshot["buckets"] == [(snapshot["p50"], 1)]
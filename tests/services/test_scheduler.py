@@ -0,0 +1,171 @@
+"""
+Unit tests for services.scheduler module.
+"""
+import asyncio
+
+import pytest
+
+from bot.services.scheduler import GeminiScheduler, SchedulerBusyError
+
+
+def _scheduler(**overrides):
+    params = dict(max_concurrency=2, per_user_limit=1, max_queue=10, per_user_queue=5)
+    params.update(overrides)
+    return GeminiScheduler(**params)
+
+
+async def _hold(scheduler, user_id, model, started, release):
+    """Займає слот і тримає його, доки не буде встановлено `release`."""
+    async with scheduler.slot(user_id, model):
+        started.append(user_id)
+        await release.wait()
+
+
+@pytest.mark.asyncio
+class TestGeminiScheduler:
+    """Tests for GeminiScheduler."""
+
+    async def test_global_and_per_user_limits(self):
+        """Only allowed requests run; the rest wait in the queue."""
+        scheduler = _scheduler()
+        release = asyncio.Event()
+        started = []
+        tasks = [
+            asyncio.create_task(_hold(scheduler, user_id, "m", started, release))
+            for user_id in (1, 1, 2, 3)
+        ]
+        await asyncio.sleep(0)
+
+        # Користувач 1 має лише один слот, глобальний ліміт — два
+        assert started == [1, 2]
+        assert scheduler.stats()["running"] == 2
+        assert scheduler.stats()["queued"] == 2
+
+        release.set()
+        await asyncio.gather(*tasks)
+        assert sorted(started) == [1, 1, 2, 3]
+        assert scheduler.stats()["running"] == 0
+        assert scheduler.stats()["queued"] == 0
+
+    async def test_round_robin_between_users(self):
+        """A user with many queued requests does not starve others."""
+        scheduler = _scheduler(max_concurrency=1, per_user_limit=5)
+        order = []
+        gate = asyncio.Event()
+
+        async def _run(user_id):
+            async with scheduler.slot(user_id, "m"):
+                order.append(user_id)
+                await gate.wait()
+
+        blocker = asyncio.create_task(_run(0))
+        await asyncio.sleep(0)
+        tasks = [asyncio.create_task(_run(user_id)) for user_id in (1, 1, 1, 2)]
+        await asyncio.sleep(0)
+        gate.set()
+        await asyncio.gather(blocker, *tasks)
+
+        assert order == [0, 1, 2, 1, 1]
+
+    async def test_per_model_limit(self):
+        """A saturated model does not block requests to another model."""
+        scheduler = _scheduler(max_concurrency=3, model_limits={"pro": 1})
+        release = asyncio.Event()
+        started = []
+        tasks = [
+            asyncio.create_task(_hold(scheduler, 1, "pro", started, release)),
+            asyncio.create_task(_hold(scheduler, 2, "pro", started, release)),
+            asyncio.create_task(_hold(scheduler, 3, "flash", started, release)),
+        ]
+        await asyncio.sleep(0)
+
+        assert started == [1, 3]
+        release.set()
+        await asyncio.gather(*tasks)
+
+    async def test_full_queue_rejects_immediately(self):
+        """Requests beyond the queue bounds fail fast with SchedulerBusyError."""
+        scheduler = _scheduler(max_concurrency=1, max_queue=1)
+        release = asyncio.Event()
+        started = []
+        holder = asyncio.create_task(_hold(scheduler, 1, "m", started, release))
+        waiter = asyncio.create_task(_hold(scheduler, 2, "m", started, release))
+        await asyncio.sleep(0)
+
+        with pytest.raises(SchedulerBusyError):
+            async with scheduler.slot(3, "m"):
+                pass
+        assert scheduler.stats()["rejected"] == 1
+
+        release.set()
+        await asyncio.gather(holder, waiter)
+
+    async def test_per_user_queue_limit(self):
+        """One user cannot fill the whole queue."""
+        scheduler = _scheduler(max_concurrency=1, per_user_queue=1)
+        release = asyncio.Event()
+        started = []
+        tasks = [asyncio.create_task(_hold(scheduler, 1, "m", started, release)) for _ in range(2)]
+        await asyncio.sleep(0)
+
+        with pytest.raises(SchedulerBusyError):
+            async with scheduler.slot(1, "m"):
+                pass
+
+        release.set()
+        await asyncio.gather(*tasks)
+
+    async def test_cancelled_waiter_leaves_queue(self):
+        """Cancelling a queued request frees its queue place."""
+        scheduler = _scheduler(max_concurrency=1)
+        release = asyncio.Event()
+        started = []
+        holder = asyncio.create_task(_hold(scheduler, 1, "m", started, release))
+        waiter = asyncio.create_task(_hold(scheduler, 2, "m", started, release))
+        await asyncio.sleep(0)
+        assert scheduler.queued == 1
+
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert scheduler.queued == 0
+
+        release.set()
+        await holder
+        assert scheduler.running == 0
+        assert started == [1]
+
+    async def test_waiter_cancelled_right_after_release(self):
+        """A waiter cancelled in the same tick as the release does not take the slot."""
+        scheduler = _scheduler(max_concurrency=1)
+        release = asyncio.Event()
+        started = []
+        holder = asyncio.create_task(_hold(scheduler, 1, "m", started, release))
+        waiter = asyncio.create_task(_hold(scheduler, 2, "m", started, release))
+        await asyncio.sleep(0)
+
+        release.set()
+        waiter.cancel()
+        await holder
+        await asyncio.gather(waiter, return_exceptions=True)
+
+        assert scheduler.running == 0
+        assert scheduler.queued == 0
+        async with scheduler.slot(3, "m"):
+            assert scheduler.running == 1
+
+    async def test_spare_slot_ignores_user_limit_but_not_queue(self):
+        """Spare slots use idle capacity only and never jump the queue."""
+        scheduler = _scheduler()
+        release = asyncio.Event()
+        started = []
+        holder = asyncio.create_task(_hold(scheduler, 1, "m", started, release))
+        await asyncio.sleep(0)
+
+        assert scheduler.try_acquire_spare(1, "m")
+        assert not scheduler.try_acquire_spare(1, "m")  # глобальний ліміт вичерпано
+        scheduler.release_spare(1, "m")
+        assert scheduler.running == 1
+
+        release.set()
+        await holder
+        assert scheduler.running == 0
@@ -0,0 +1,65 @@
+"""
+Unit tests for services.tokens module.
+"""
+from bot.services.tokens import MESSAGE_OVERHEAD_TOKENS, TokenCounter, build_context_window
+
+
+def _msg(role, text):
+    return {"role": role, "parts": [{"text": text}]}
+
+
+class TestTokenCounter:
+    """Tests for TokenCounter."""
+
+    def test_estimate_counts_utf8_bytes(self):
+        """Cyrillic text is estimated as more expensive than Latin of the same length."""
+        assert TokenCounter.estimate("abcd" * 10) == 10
+        assert TokenCounter.estimate("абвг" * 10) == 20
+        assert TokenCounter.estimate("") == 0
+
+    def test_exact_count_overrides_estimate(self):
+        """A recorded exact count is returned for the same content."""
+        counter = TokenCounter(max_entries=10)
+        counter.record("hello world", 2)
+
+        assert counter.count("hello world") == 2
+        assert counter.unknown(["hello world", "other"]) == ["other"]
+
+    def test_non_integer_counts_are_ignored(self):
+        """Missing usage metadata does not poison the cache."""
+        counter = TokenCounter(max_entries=10)
+        counter.record("text", None)
+        counter.record("text", True)
+
+        assert counter.count("text") == TokenCounter.estimate("text")
+
+
+class TestBuildContextWindow:
+    """Tests for build_context_window."""
+
+    def test_newest_messages_fill_budget(self):
+        """The window keeps the newest messages that fit together with the prompt."""
+        counter = TokenCounter(max_entries=10)
+        history = [_msg("user", "a" * 400), _msg("model", "b" * 40), _msg("user", "c" * 40)]
+        # Запит (10) + два найновіші повідомлення (по 10) з накладними витратами
+        budget = 30 + 3 * MESSAGE_OVERHEAD_TOKENS
+
+        contents = build_context_window(history, "d" * 40, budget=budget, counter=counter)
+
+        assert contents == [history[1], history[2], _msg("user", "d" * 40)]
+
+    def test_many_small_messages_all_fit(self):
+        """Small messages are not dropped just because there are many of them."""
+        history = [_msg("user", f"m{i}") for i in range(25)]
+
+        contents = build_context_window(history, "hi", budget=10_000, counter=TokenCounter(10))
+
+        assert len(contents) == 26
+
+    def test_prompt_is_always_included(self):
+        """An oversized prompt is still sent, without any history."""
+        history = [_msg("user", "old")]
+
+        contents = build_context_window(history, "x" * 1000, budget=5, counter=TokenCounter(10))
+
+        assert contents == [_msg("user", "x" * 1000)]
@@ -0,0 +1,102 @@
+"""
+Unit tests for services.user_turns module.
+"""
+import asyncio
+
+import pytest
+
+from bot.services.user_turns import UserTurns
+
+
+async def _take_turn(turns, user_id, text, log, hold=0.0):
+    """Проходить хід і записує отриманий запит у `log`."""
+    async with turns.turn(user_id, text) as prompt:
+        log.append(prompt)
+        if prompt is not None and hold:
+            await asyncio.sleep(hold)
+
+
+@pytest.mark.asyncio
+class TestUserTurns:
+    """Tests for UserTurns."""
+
+    async def test_turns_are_serialized_per_user(self):
+        """Without debounce each message is its own turn, one at a time per user."""
+        turns = UserTurns(debounce=0)
+        active = 0
+        peak = 0
+
+        async def _run(text):
+            nonlocal active, peak
+            async with turns.turn(1, text) as prompt:
+                assert prompt == text
+                active += 1
+                peak = max(peak, active)
+                await asyncio.sleep(0.01)
+                active -= 1
+
+        await asyncio.gather(*(_run(f"m{i}") for i in range(3)))
+
+        assert peak == 1
+        assert turns.active_users == 0
+
+    async def test_different_users_run_in_parallel(self):
+        """Serialization is per user, not global."""
+        turns = UserTurns(debounce=0)
+        started = []
+
+        async def _run(user_id):
+            async with turns.turn(user_id, "hi"):
+                started.append(user_id)
+                await asyncio.sleep(0.01)
+
+        task = asyncio.gather(_run(1), _run(2))
+        await asyncio.sleep(0.001)
+        assert sorted(started) == [1, 2]
+        await task
+
+    async def test_rapid_messages_are_merged(self):
+        """Messages inside the debounce window become one prompt."""
+        turns = UserTurns(debounce=0.05)
+        log = []
+
+        first = asyncio.create_task(_take_turn(turns, 1, "one", log))
+        await asyncio.sleep(0.01)
+        second = asyncio.create_task(_take_turn(turns, 1, "two", log))
+        await asyncio.gather(first, second)
+
+        assert log == [None, "one\n\ntwo"]
+        assert turns.merged == 1
+
+    async def test_messages_during_generation_form_next_prompt(self):
+        """Messages sent while a reply is generated are answered together afterwards."""
+        turns = UserTurns(debounce=0.01)
+        log = []
+
+        first = asyncio.create_task(_take_turn(turns, 1, "one", log, hold=0.05))
+        await asyncio.sleep(0.02)
+        rest = [asyncio.create_task(_take_turn(turns, 1, text, log)) for text in ("two", "three")]
+        await asyncio.gather(first, *rest)
+
+        assert log == ["one", None, "two\n\nthree"]
+        assert turns.active_users == 0
+
+    async def test_cancelled_collector_drops_merged_messages(self):
+        """Messages merged into a cancelled prompt do not leak into the next one."""
+        turns = UserTurns(debounce=0.01)
+        log = []
+
+        generating = asyncio.create_task(_take_turn(turns, 1, "zero", log, hold=0.1))
+        await asyncio.sleep(0.02)
+        collector = asyncio.create_task(_take_turn(turns, 1, "one", log))
+        await asyncio.sleep(0)
+        await _take_turn(turns, 1, "two", log)
+        await asyncio.sleep(0.02)
+        collector.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await collector
+
+        await asyncio.gather(generating, _take_turn(turns, 1, "three", log))
+
+        assert log == ["zero", None, "three"]
+        assert turns.active_users == 0
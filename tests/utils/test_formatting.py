@@ -0,0 +1,112 @@
+"""
+Unit tests for presentation.formatting module.
+"""
+import html
+import random
+import re
+
+from bot.presentation.formatting import (
+    html_to_text,
+    markdown_to_html,
+    split_html,
+    utf16_len,
+)
+
+_TAG = re.compile(r"<(/?)([a-z]+)[^>]*>")
+
+
+def _assert_balanced(part: str):
+    """Кожен відкритий тег частини закривається в ній же, у правильному порядку."""
+    stack = []
+    for closing, name in _TAG.findall(part):
+        if closing:
+            assert stack and stack[-1] == name, part
+            stack.pop()
+        else:
+            stack.append(name)
+    assert not stack, part
+
+
+class TestMarkdownToHtml:
+    """Tests for markdown_to_html."""
+
+    def test_escapes_html_special_characters(self):
+        assert markdown_to_html("a < b && c > d") == "a &lt; b &amp;&amp; c &gt; d"
+
+    def test_inline_markup(self):
+        result = markdown_to_html("**bold** *it* _it_ ~~gone~~ `x<y` [link](https://e.com/?a=1&b=2)")
+        assert result == (
+            '<b>bold</b> <i>it</i> <i>it</i> <s>gone</s> <code>x&lt;y</code> '
+            '<a href="https://e.com/?a=1&amp;b=2">link</a>'
+        )
+
+    def test_snake_case_and_math_are_not_italic(self):
+        assert markdown_to_html("snake_case_name and 2 * 3 * 4") == "snake_case_name and 2 * 3 * 4"
+
+    def test_headings_lists_and_quotes(self):
+        result = markdown_to_html("## Title\n* one\n- two\n> quoted\n> text\nend")
+        assert result == (
+            "<b>Title</b>\n• one\n• two\n<blockquote>quoted\ntext</blockquote>\nend"
+        )
+
+    def test_fenced_code_is_not_formatted(self):
+        result = markdown_to_html("Code:\n```python\nx = a**2 < b\n```\nDone")
+        assert result == (
+            'Code:\n<pre><code class="language-python">x = a**2 &lt; b</code></pre>\nDone'
+        )
+
+    def test_html_to_text_restores_plain_text(self):
+        assert html_to_text(markdown_to_html("**a** < b")) == "a < b"
+
+
+class TestSplitHtml:
+    """Tests for split_html."""
+
+    def test_short_text_is_single_part(self):
+        assert split_html("<b>hi</b>", limit=10) == ["<b>hi</b>"]
+
+    def test_tags_do_not_count_towards_limit(self):
+        text = "<b>" + "a" * 10 + "</b>"
+        assert split_html(text, limit=10) == [text]
+
+    def test_entities_count_as_one_character(self):
+        text = "&lt;" * 10
+        assert split_html(text, limit=10) == [text]
+
+    def test_prefers_newline_then_space(self):
+        assert split_html("aaa bbb\nccc ddd", limit=12) == ["aaa bbb", "ccc ddd"]
+        assert split_html("aaa bbb ccc", limit=9) == ["aaa bbb", "ccc"]
+
+    def test_tags_are_reopened_across_parts(self):
+        parts = split_html('<a href="u"><b>one two three</b></a>', limit=8)
+        assert parts == [
+            '<a href="u"><b>one two</b></a>',
+            '<a href="u"><b>three</b></a>',
+        ]
+
+    def test_length_is_measured_in_utf16_units(self):
+        parts = split_html("😀" * 10, limit=7)
+        assert parts == ["😀😀😀", "😀😀😀", "😀😀😀", "😀"]
+
+    def test_code_indentation_is_kept(self):
+        parts = split_html("<pre>line one\n    indented</pre>", limit=12)
+        assert parts == ["<pre>line one</pre>", "<pre>    indented</pre>"]
+
+    def test_random_markdown_parts_are_valid(self):
+        """Every part fits the limit, has balanced tags and no text is lost."""
+        rng = random.Random(42)
+        words = ["word", "**bold**", "*it*", "`a<b`", "😀", "&", "[x](https://e.com)", "\n", "\n- item"]
+        source = " ".join(rng.choice(words) for _ in range(5000))
+        source += "\n```\n" + "code line\n" * 300 + "```\n"
+        converted = markdown_to_html(source)
+
+        parts = split_html(converted, limit=300)
+
+        visible = ""
+        for part in parts:
+            _assert_balanced(part)
+            text = html.unescape(re.sub(r"<[^>]*>", "", part))
+            assert 0 < utf16_len(text) <= 300
+            visible += text
+        expected = html.unescape(re.sub(r"<[^>]*>", "", converted))
+        assert re.sub(r"\s", "", visible) == re.sub(r"\s", "", expected)
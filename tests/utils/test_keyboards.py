@@ -0,0 +1,67 @@
+"""
+Unit tests for presentation.keyboards modules.
+"""
+import pytest
+
+from bot.db import cache
+from bot.db.user_settings import UserContext
+from bot.presentation.keyboards.inline import get_model_selection_keyboard
+from bot.presentation.keyboards.reply import (
+    get_admin_management_keyboard,
+    get_admin_menu,
+    get_main_menu,
+    get_settings_menu,
+)
+
+
+def _texts(markup):
+    return [[button.text for button in row] for row in markup.keyboard]
+
+
+class TestReplyKeyboards:
+    """Tests for prebuilt reply keyboards."""
+
+    @pytest.mark.asyncio
+    async def test_main_menu_variants_are_reused(self):
+        user = await get_main_menu(user_context=UserContext(user_id=1, role="user", tts_enabled=False, tts_voice="male"))
+        admin = await get_main_menu(user_context=UserContext(user_id=2, role="admin", tts_enabled=False, tts_voice="male"))
+
+        assert _texts(user) == [["⚙️ Налаштування"]]
+        assert _texts(admin) == [["👑 Адмін-панель"], ["⚙️ Налаштування"]]
+        assert await get_main_menu(user_context=UserContext(user_id=3, role="admin", tts_enabled=False, tts_voice="male")) is admin
+
+    def test_admin_menu_owner_variant(self):
+        assert _texts(get_admin_menu(True))[1] == ["👥 Редагувати адмінів"]
+        assert ["👥 Редагувати адмінів"] not in _texts(get_admin_menu(False))
+        assert get_admin_menu(True) is get_admin_menu(True)
+
+    def test_static_keyboards_are_reused(self):
+        assert get_settings_menu() is get_settings_menu()
+        assert get_admin_management_keyboard() is get_admin_management_keyboard()
+
+
+class TestModelSelectionKeyboard:
+    """Tests for the memoized model selection keyboard."""
+
+    def test_same_models_and_current_model_reuse_markup(self):
+        models = ["models/a", "models/b"]
+        first = get_model_selection_keyboard(models, "models/a")
+
+        assert get_model_selection_keyboard(list(models), "models/a") is first
+        assert first.inline_keyboard[0][0].text == "✅ a"
+
+    def test_current_model_change_rebuilds(self):
+        models = ["models/a", "models/b"]
+        first = get_model_selection_keyboard(models, "models/a")
+        second = get_model_selection_keyboard(models, "models/b")
+
+        assert second is not first
+        assert second.inline_keyboard[1][0].text == "✅ b"
+
+    def test_invalidation_rebuilds(self):
+        models = ["models/a"]
+        first = get_model_selection_keyboard(models, "models/a")
+
+        cache.invalidate_models_cache()
+
+        assert get_model_selection_keyboard(models, "models/a") is not first
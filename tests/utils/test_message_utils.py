@@ -2,7 +2,9 @@
 Unit tests for utils.message_utils module.
 """
 import pytest
-from unittest.mock import AsyncMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from aiogram.exceptions import TelegramBadRequest
 
 from bot.presentation.message_utils import send_long_message, MAX_MESSAGE_LENGTH
 
@@ -111,3 +113,28 @@ class TestSendLongMessage:
         await send_long_message(message_mock, ukrainian_text)
 
         message_mock.answer.assert_called_once_with(ukrainian_text)
+
+    @pytest.mark.asyncio
+    async def test_first_part_replaces_edited_message(self):
+        """The status message is edited into the first part; the rest is sent."""
+        message_mock = AsyncMock()
+        status_mock = AsyncMock()
+        text = "A" * (MAX_MESSAGE_LENGTH - 10) + "\n" + "B" * 100
+
+        await send_long_message(message_mock, text, edit=status_mock)
+
+        status_mock.edit_text.assert_called_once_with("A" * (MAX_MESSAGE_LENGTH - 10))
+        message_mock.answer.assert_called_once_with("B" * 100)
+        status_mock.delete.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_failed_edit_falls_back_to_new_message(self):
+        """If the edit is rejected, the status is deleted and the text is sent anew."""
+        message_mock = AsyncMock()
+        status_mock = AsyncMock()
+        status_mock.edit_text.side_effect = TelegramBadRequest(MagicMock(), "can't parse entities")
+
+        await send_long_message(message_mock, "Відповідь", edit=status_mock)
+
+        status_mock.delete.assert_called_once()
+        message_mock.answer.assert_called_once_with("Відповідь")
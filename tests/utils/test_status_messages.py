@@ -1,10 +1,12 @@
 """
 Unit tests for utils.status_messages module.
 """
+import asyncio
+
 import pytest
-from unittest.mock import AsyncMock
+from unittest.mock import AsyncMock, MagicMock, patch
 
-from bot.presentation.status_messages import send_status, update_status, delete_status
+from bot.presentation.status_messages import DeferredStatus, send_status, update_status, delete_status
 
 
 class TestSendStatus:
@@ -170,3 +172,69 @@ class TestStatusMessagesIntegration:
         # Final delete
         await delete_status(status_msg)
         status_msg_mock.delete.assert_called_once()
+
+
+def _deferred_mocks():
+    """Створює мок-повідомлення, статус та бота для DeferredStatus."""
+    message_mock = AsyncMock()
+    message_mock.chat = MagicMock(id=42)
+    status_msg_mock = AsyncMock()
+    message_mock.answer.return_value = status_msg_mock
+    bot_mock = AsyncMock()
+    return message_mock, status_msg_mock, bot_mock
+
+
+@pytest.mark.asyncio
+class TestDeferredStatus:
+    """Tests for DeferredStatus."""
+
+    async def test_fast_reply_skips_status(self):
+        """A reply faster than the delay sends only the typing action."""
+        message_mock, _, bot_mock = _deferred_mocks()
+
+        with patch("bot.presentation.status_messages.runtime_config.STATUS_MESSAGE_DELAY", 10):
+            async with DeferredStatus(message_mock, bot_mock, "Генерація відповіді.") as status:
+                await asyncio.sleep(0)
+                assert await status.claim() is None
+
+        bot_mock.send_chat_action.assert_called_once()
+        message_mock.answer.assert_not_called()
+
+    async def test_slow_reply_posts_status_and_hands_it_over(self):
+        """After the delay the status is posted, then claimed instead of deleted."""
+        message_mock, status_msg_mock, bot_mock = _deferred_mocks()
+
+        with patch("bot.presentation.status_messages.runtime_config.STATUS_MESSAGE_DELAY", 0.01):
+            async with DeferredStatus(message_mock, bot_mock, "Генерація відповіді.") as status:
+                await asyncio.sleep(0.05)
+                assert await status.claim() is status_msg_mock
+
+        message_mock.answer.assert_called_once_with("**Очікуйте...**\nГенерація відповіді.")
+        status_msg_mock.delete.assert_not_called()
+
+    async def test_unclaimed_status_is_deleted(self):
+        """If the work fails, a posted status is deleted on exit."""
+        message_mock, status_msg_mock, bot_mock = _deferred_mocks()
+
+        with patch("bot.presentation.status_messages.runtime_config.STATUS_MESSAGE_DELAY", 0):
+            with pytest.raises(RuntimeError):
+                async with DeferredStatus(message_mock, bot_mock, "Генерація відповіді."):
+                    await asyncio.sleep(0.01)
+                    raise RuntimeError("boom")
+
+        status_msg_mock.delete.assert_called_once()
+
+    async def test_typing_is_refreshed_while_working(self):
+        """The typing action repeats every TYPING_REFRESH_INTERVAL and stops after claim."""
+        message_mock, _, bot_mock = _deferred_mocks()
+
+        with patch("bot.presentation.status_messages.runtime_config.STATUS_MESSAGE_DELAY", 10), \
+                patch("bot.presentation.status_messages.runtime_config.TYPING_REFRESH_INTERVAL", 0.01):
+            async with DeferredStatus(message_mock, bot_mock, "Генерація відповіді.") as status:
+                await asyncio.sleep(0.055)
+                await status.claim()
+                calls = bot_mock.send_chat_action.call_count
+                await asyncio.sleep(0.03)
+
+        assert calls >= 3
+        assert bot_mock.send_chat_action.call_count == calls
@@ -0,0 +1,158 @@
+"""
+Unit tests for presentation.streaming module.
+"""
+import asyncio
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from aiogram.exceptions import TelegramBadRequest
+
+from bot.presentation.streaming import StreamingReply
+
+
+def _make_reply():
+    """Створює StreamingReply з мок-повідомленнями."""
+    message = MagicMock()
+    status_msg = MagicMock()
+    status_msg.edit_text = AsyncMock()
+    new_msg = MagicMock()
+    new_msg.edit_text = AsyncMock()
+    message.answer = AsyncMock(return_value=new_msg)
+    return StreamingReply(message, status_msg), message, status_msg, new_msg
+
+
+@pytest.mark.asyncio
+class TestStreamingReply:
+    """Tests for StreamingReply."""
+
+    async def test_updates_are_rate_limited(self):
+        """Intermediate edits are throttled and sent without markup."""
+        reply, _, status_msg, _ = _make_reply()
+
+        with patch('bot.presentation.streaming.time.monotonic', side_effect=[100.0, 100.0, 100.5, 102.0, 102.0]):
+            await reply.update("a")
+            await reply.update("ab")  # Занадто рано після попереднього редагування
+            await reply.update("abc")
+
+        assert status_msg.edit_text.await_args_list[0].args == ("a",)
+        assert status_msg.edit_text.await_args_list[0].kwargs == {"parse_mode": None}
+        assert [c.args[0] for c in status_msg.edit_text.await_args_list] == ["a", "abc"]
+
+    async def test_finish_uses_markup_and_falls_back_to_plain(self):
+        """The final edit uses the default parse mode and retries as plain text on error."""
+        reply, _, status_msg, _ = _make_reply()
+        status_msg.edit_text.side_effect = [
+            TelegramBadRequest(method=MagicMock(), message="can't parse entities"),
+            None,
+        ]
+
+        await reply.finish("<b>broken")
+
+        calls = status_msg.edit_text.await_args_list
+        assert calls[0].kwargs == {}
+        assert calls[1].kwargs == {"parse_mode": None}
+
+    async def test_long_text_rolls_over_to_new_message(self):
+        """Text beyond the Telegram limit continues in a new message."""
+        reply, message, status_msg, new_msg = _make_reply()
+        first = "a" * 4000
+        second = "b" * 200
+
+        await reply.finish(f"{first}\n{second}")
+
+        status_msg.edit_text.assert_awaited_once_with(first)
+        message.answer.assert_awaited_once_with(second)
+        new_msg.edit_text.assert_not_awaited()
+
+    async def test_rolled_over_parts_are_rendered_as_html_on_finish(self):
+        """Parts rolled over mid-stream are plain; finish() re-renders all parts as HTML."""
+        reply, message, status_msg, new_msg = _make_reply()
+        first = "**a** < b " * 800
+        second = "**c** & d"
+        text = f"{first}\n{second}"
+
+        with patch('bot.presentation.streaming.runtime_config.STREAM_EDIT_INTERVAL', 0):
+            await reply.update(text)
+        # Під час потоку перша частина показана без розмітки
+        assert status_msg.edit_text.await_args_list[0].kwargs == {"parse_mode": None}
+
+        await reply.finish(text)
+
+        final_first = status_msg.edit_text.await_args_list[-1]
+        assert final_first.kwargs == {}
+        assert final_first.args[0].startswith("<b>a</b> &lt; b")
+        final_second = new_msg.edit_text.await_args_list[-1]
+        assert final_second.args[0].endswith("<b>c</b> &amp; d")
+        assert final_second.kwargs == {}
+        message.answer.assert_awaited_once()
+
+    async def test_finish_deletes_surplus_messages(self):
+        """If the HTML needs fewer parts than were streamed, extra messages are deleted."""
+        reply, _, status_msg, new_msg = _make_reply()
+        new_msg.delete = AsyncMock()
+        text = "[link](https://example.com/" + "x" * 100 + ") " + "y" * 4000
+
+        with patch('bot.presentation.streaming.runtime_config.STREAM_EDIT_INTERVAL', 0):
+            await reply.update(text)
+        await reply.finish(text)
+
+        # Уся відповідь вміщується в статус-повідомлення, вже з розміткою
+        assert status_msg.edit_text.await_args_list[-1].kwargs == {}
+        new_msg.delete.assert_awaited_once()
+
+    async def test_not_modified_error_is_ignored(self):
+        """Editing with identical text does not raise."""
+        reply, _, status_msg, _ = _make_reply()
+        status_msg.edit_text.side_effect = TelegramBadRequest(
+            method=MagicMock(), message="Bad Request: message is not modified"
+        )
+
+        await reply.finish("same")
+
+        status_msg.edit_text.assert_awaited_once()
+
+    async def test_push_renders_in_background(self):
+        """push() returns at once; the renderer shows only the newest text."""
+        reply, _, status_msg, _ = _make_reply()
+        release = asyncio.Event()
+
+        async def _slow_edit(*args, **kwargs):
+            await release.wait()
+
+        status_msg.edit_text.side_effect = _slow_edit
+
+        with patch('bot.presentation.streaming.runtime_config.STREAM_EDIT_INTERVAL', 0):
+            reply.push("a")
+            await asyncio.sleep(0)
+            reply.push("ab")  # Редагування "a" ще триває — проміжні версії пропускаються
+            reply.push("abc")
+            release.set()
+            await reply._renderer
+
+        assert [c.args[0] for c in status_msg.edit_text.await_args_list] == ["a", "abc"]
+
+    async def test_finish_waits_for_renderer_and_claims_status_lazily(self):
+        """The status message is claimed on first display and reused by finish()."""
+        message = MagicMock()
+        status_msg = MagicMock()
+        status_msg.edit_text = AsyncMock()
+        claim = AsyncMock(return_value=status_msg)
+        reply = StreamingReply(message, claim=claim)
+
+        reply.push("Hel")
+        await reply.finish("Hello")
+
+        claim.assert_awaited_once()
+        assert status_msg.edit_text.await_args_list[-1].args == ("Hello",)
+        assert reply._renderer is None
+
+    async def test_cancel_stops_renderer(self):
+        """cancel() stops pending background edits."""
+        reply, _, status_msg, _ = _make_reply()
+
+        reply.push("a")
+        reply.cancel()
+        await asyncio.sleep(0)
+
+        status_msg.edit_text.assert_not_awaited()